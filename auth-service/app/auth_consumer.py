@@ -1,37 +1,36 @@
 import pika
-import json
-import os
 from supabase_client import supabase
+from consumer_runtime import ConsumerRuntime
+from metrics import timed_db
+import deadlines
+import codec
 from dotenv import load_dotenv
 
 load_dotenv()
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS")
+# Declarada a cada (re)conexão pelo runtime
+def declare_topology(channel):
+    channel.queue_declare(queue="auth_signup", durable=True)
+    channel.queue_declare(queue="auth_login", durable=True)
+    channel.queue_declare(queue="auth_response", durable=True)
 
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials))
-channel = connection.channel()
+runtime = ConsumerRuntime(declare_topology)
 
-channel.queue_declare(queue="auth_signup", durable=True)
-channel.queue_declare(queue="auth_login", durable=True)
-channel.queue_declare(queue="auth_response", durable=True)
 
-
-def send_response(correlation_id, response):
-    channel.basic_publish(
+def send_response(correlation_id, response, formato=codec.JSON):
+    runtime.publish(
         exchange='',
         routing_key='auth_response',
-        properties=pika.BasicProperties(correlation_id=correlation_id),
-        body=json.dumps(response)
+        properties=pika.BasicProperties(correlation_id=correlation_id, content_type=formato),
+        body=codec.dumps(response, formato)
     )
     print(f"Resposta enviada: {response}")
 
 def process_signup(data):
     email = data['email']
     password = data['password']
-    response = supabase.auth.sign_up({"email": email, "password": password})
+    with timed_db("auth.sign_up"):
+        response = supabase.auth.sign_up({"email": email, "password": password})
     if response.get("error"):
         return {"success": False, "error": response["error"]["message"]}
     else:
@@ -40,7 +39,8 @@ def process_signup(data):
 def process_login(data):
     email = data['email']
     password = data['password']
-    response = supabase.auth.sign_in(email=email, password=password)
+    with timed_db("auth.sign_in"):
+        response = supabase.auth.sign_in(email=email, password=password)
     if response.get("error"):
         return {"success": False, "error": response["error"]["message"]}
     else:
@@ -51,25 +51,33 @@ def process_login(data):
         }
 
 def on_signup(ch, method, properties, body):
-    data = json.loads(body)
+    data, formato = codec.loads(body, properties.content_type)
     correlation_id = data.get("correlation_id")
+    if deadlines.expired(data.get("deadline")):
+        deadlines.shed("on_signup", correlation_id)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
     print(f"Processando signup para {data['email']}")
     response = process_signup(data)
-    send_response(correlation_id, response)
+    send_response(correlation_id, response, formato)
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
 def on_login(ch, method, properties, body):
-    data = json.loads(body)
+    data, formato = codec.loads(body, properties.content_type)
     correlation_id = data.get("correlation_id")
+    if deadlines.expired(data.get("deadline")):
+        deadlines.shed("on_login", correlation_id)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        return
     print(f"Processando login para {data['email']}")
     response = process_login(data)
-    send_response(correlation_id, response)
+    send_response(correlation_id, response, formato)
     ch.basic_ack(delivery_tag=method.delivery_tag)
 
 def start_consuming():
-    channel.basic_consume(queue="auth_signup", on_message_callback=on_signup)
-    channel.basic_consume(queue="auth_login", on_message_callback=on_login)
+    runtime.consume("auth_signup", on_signup)
+    runtime.consume("auth_login", on_login)
 
     print("👤 Auth Service rodando. Aguardando mensagens...")
-    channel.start_consuming()
-    
\ No newline at end of file
+    runtime.start()
+    
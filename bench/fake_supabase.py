@@ -0,0 +1,367 @@
+import os
+import json
+import uuid
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# Latência simulada de cada chamada ao "banco" (ida e volta do PostgREST)
+DB_LATENCY_MS = float(os.getenv("BENCH_DB_LATENCY_MS", "15"))
+# Lotes grandes (ex.: consulta de várias placas) cabem numa linha só
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+# Filtros guardados como dados (operação, coluna, valor): a consulta também
+# pode ser enviada ao FakeSupabase compartilhado de outro processo
+OPERATORS = {
+    "eq": lambda atual, valor: atual == valor,
+    "gte": lambda atual, valor: atual is not None and atual >= valor,
+    "lt": lambda atual, valor: atual is not None and atual < valor,
+    "in": lambda atual, valor: atual in valor,
+}
+
+
+class FakeQuery:
+    """Imitação da cadeia de consulta do postgrest (`table(...).select(...).eq(...)...execute()`)."""
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.payload = None
+        self.filters = []
+        self.order_by = None
+        self.window = None
+
+    def select(self, *columns, **kwargs):
+        self.action = "select"
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.action = "insert"
+        self.payload = payload
+        return self
+
+    def update(self, payload, **kwargs):
+        self.action = "update"
+        self.payload = payload
+        return self
+
+    def delete(self, **kwargs):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(("eq", column, value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(("gte", column, value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(("lt", column, value))
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(("in", column, list(values)))
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, size):
+        self.window = (0, size - 1)
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end)
+        return self
+
+    async def execute(self):
+        return FakeResponse(await self.db.execute({
+            "table": self.table, "action": self.action, "payload": self.payload, "filters": self.filters,
+            "order_by": self.order_by, "window": self.window,
+        }))
+
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    async def execute(self):
+        return FakeResponse(await self.db.execute({"rpc": self.name, "params": self.params}))
+
+
+class FakeClient:
+    """`table(...)` e `rpc(...)` do AsyncClient; cada chamada espera a latência simulada."""
+    latency_ms = DB_LATENCY_MS
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+    async def latency(self):
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    async def execute(self, request):
+        raise NotImplementedError
+
+
+class FakeSupabase(FakeClient):
+    """
+    Substituto em memória do AsyncClient do Supabase para benchmarks offline.
+    Cobre apenas o que os consumidores usam: `table(...)` e `rpc(...)`.
+
+    O estado fica no processo que o criou: para que pagamento, creditos e
+    fiscalizacao vejam os mesmos dados, rode um só com `serve` e conecte os
+    serviços a ele com `RemoteFakeSupabase`.
+    """
+    def __init__(self, latency_ms=DB_LATENCY_MS, seed_plates=0):
+        self.latency_ms = latency_ms
+        self.tables = {}
+        self._next_id = 1
+        self.seed(seed_plates)
+
+    async def execute(self, request):
+        await self.latency()
+        return self.run(request)
+
+    def run(self, request):
+        """Executa uma consulta (`table`) ou função (`rpc`) e devolve as linhas."""
+        if "rpc" in request:
+            return getattr(self, f"rpc_{request['rpc']}")(**request["params"])
+        return self._query(request)
+
+    def _matching(self, request):
+        filters = [(OPERATORS[op], column, value) for op, column, value in request["filters"]]
+        rows = [
+            row for row in self.tables.setdefault(request["table"], [])
+            if all(op(row.get(column), value) for op, column, value in filters)
+        ]
+        if request["order_by"]:
+            column, desc = request["order_by"]
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        if request["window"]:
+            rows = rows[request["window"][0]:request["window"][1] + 1]
+        return rows
+
+    def _query(self, request):
+        table, action, payload = request["table"], request["action"], request["payload"]
+        if action == "insert":
+            records = payload if isinstance(payload, list) else [payload]
+            return [self.insert(table, record) for record in records]
+        if action == "update":
+            rows = self._matching(request)
+            for row in rows:
+                row.update(payload)
+            return [dict(row) for row in rows]
+        if action == "delete":
+            rows = self._matching(request)
+            ids = {id(row) for row in rows}
+            self.tables[table][:] = [row for row in self.tables[table] if id(row) not in ids]
+            return rows
+        return [dict(row) for row in self._matching(request)]
+
+    def insert(self, table, record):
+        row = dict(record)
+        row.setdefault("id", self._next_id)
+        self._next_id += 1
+        if table == "pagamentos":
+            row.setdefault("order_id", str(uuid.uuid4()))
+        self.tables.setdefault(table, []).append(row)
+        return dict(row)
+
+    def seed(self, total):
+        """Cria `total` créditos ativos para as placas BENCH0000, BENCH0001, ..."""
+        now = datetime.now(timezone.utc)
+        for i in range(total):
+            self.insert("creditos", {
+                "placa": f"BENCH{i:04d}",
+                "zona": random.choice("ABC"),
+                "comprado_em": now.isoformat(),
+                "expira_em": (now + timedelta(hours=2)).isoformat(),
+                "origem": "bench",
+            })
+
+    def rpc_estender_credito(self, p_placa, p_horas, p_pagamento_id, p_zona=None, p_origem="app"):
+        if not isinstance(p_horas, int) or p_horas <= 0:
+            raise ValueError(f"estender_credito: p_horas deve ser positivo (recebido {p_horas!r})")
+        now = datetime.now(timezone.utc)
+        pagamento = next(
+            (row for row in self.tables.setdefault("pagamentos", []) if row.get("order_id") == p_pagamento_id), {}
+        )
+        if pagamento.get("creditado_em"):
+            # O crédito pode já ter vencido e ido para o arquivo
+            atual = max((row["expira_em"] for row in self.tables["creditos"] if row["placa"] == p_placa), default=None)
+            if atual is None:
+                atual = max((
+                    row["expira_em"] for row in self.tables.setdefault("creditos_arquivo", [])
+                    if row["placa"] == p_placa
+                ), default=None)
+            return [{"nova_expiracao": atual, "estendido": True, "duplicado": True}]
+        pagamento["creditado_em"] = now.isoformat()
+        ativos = [
+            row for row in self.tables.setdefault("creditos", [])
+            if row["placa"] == p_placa and row["expira_em"] >= now.isoformat()
+        ]
+        if ativos:
+            credito = max(ativos, key=lambda row: row["expira_em"])
+            nova = datetime.fromisoformat(credito["expira_em"]) + timedelta(hours=p_horas)
+            credito.update({"expira_em": nova.isoformat(), "pagamento_id": p_pagamento_id})
+            return [{"nova_expiracao": nova.isoformat(), "estendido": True, "duplicado": False}]
+        nova = now + timedelta(hours=p_horas)
+        self.insert("creditos", {
+            "placa": p_placa,
+            "pagamento_id": p_pagamento_id,
+            "zona": p_zona,
+            "comprado_em": now.isoformat(),
+            "expira_em": nova.isoformat(),
+            "origem": p_origem,
+        })
+        return [{"nova_expiracao": nova.isoformat(), "estendido": False, "duplicado": False}]
+
+    def rpc_arquivar_creditos(self, p_limite=1000):
+        now = datetime.now(timezone.utc).isoformat()
+        creditos = self.tables.setdefault("creditos", [])
+        vencidos = sorted((row for row in creditos if row["expira_em"] < now), key=lambda row: row["expira_em"])[:p_limite]
+        ids = {row["id"] for row in vencidos}
+        creditos[:] = [row for row in creditos if row["id"] not in ids]
+        self.tables.setdefault("creditos_arquivo", []).extend({**row, "arquivado_em": now} for row in vencidos)
+        return len(vencidos)
+
+    def rpc_creditos_expirando(self, p_janela_segundos, p_limite=1000):
+        now = datetime.now(timezone.utc)
+        limite = (now + timedelta(seconds=p_janela_segundos)).isoformat()
+        avisos = []
+        for row in sorted(self.tables.setdefault("creditos", []), key=lambda row: row["expira_em"]):
+            if len(avisos) >= p_limite:
+                break
+            if now.isoformat() <= row["expira_em"] < limite and row.get("avisado_para") != row["expira_em"]:
+                row["avisado_para"] = row["expira_em"]
+                avisos.append({"placa": row["placa"], "zona": row.get("zona"), "expira_em": row["expira_em"]})
+        return avisos
+
+    def rpc_desmarcar_avisos(self, p_creditos):
+        chaves = {(credito["placa"], credito["expira_em"]) for credito in p_creditos}
+        for row in self.tables.setdefault("creditos", []):
+            if (row["placa"], row["expira_em"]) in chaves and row.get("avisado_para") == row["expira_em"]:
+                row["avisado_para"] = None
+
+    def rpc_registrar_pagamentos(self, p_itens):
+        pagamentos = self.tables.setdefault("pagamentos", [])
+        resultado = []
+        for item in p_itens:
+            pagamento = item["pagamento"]
+            existente = next((row for row in pagamentos if row.get("correlation_id") == pagamento["correlation_id"]), None)
+            outbox_id = None
+            # Pagamento repetido: nem nova linha nem novo evento
+            if existente is None:
+                existente = self.insert("pagamentos", pagamento)
+                outbox_id = self.insert("outbox", {
+                    "routing_key": item["routing_key"],
+                    "payload": {**item["evento"], "order_id": existente["order_id"]},
+                    "correlation_id": pagamento["correlation_id"],
+                    "criado_em": datetime.now(timezone.utc).isoformat(),
+                })["id"]
+            resultado.append({
+                "order_id": existente["order_id"], "correlation_id": pagamento["correlation_id"], "outbox_id": outbox_id,
+            })
+        return resultado
+
+    def rpc_reservar_outbox(self, p_limite=100, p_atraso_segundos=60, p_reserva_segundos=30):
+        now = datetime.now(timezone.utc)
+        limite = (now - timedelta(seconds=p_atraso_segundos)).isoformat()
+        reservados = []
+        for row in sorted(self.tables.setdefault("outbox", []), key=lambda row: row["criado_em"]):
+            if len(reservados) >= p_limite:
+                break
+            if row["criado_em"] < limite and (row.get("reservado_ate") is None or row["reservado_ate"] < now.isoformat()):
+                row["reservado_ate"] = (now + timedelta(seconds=p_reserva_segundos)).isoformat()
+                reservados.append({key: row[key] for key in ("id", "routing_key", "payload", "correlation_id")})
+        return reservados
+
+
+class RemoteFakeSupabase(FakeClient):
+    """
+    Cliente do FakeSupabase compartilhado (`serve`): uma conexão TCP por
+    processo, com uma requisição JSON por linha. A latência simulada é
+    esperada aqui, antes do envio, então as chamadas de um serviço não se
+    enfileiram atrás dela; só a ida ao servidor (microssegundos) é serial.
+    """
+    def __init__(self, host, port, latency_ms=DB_LATENCY_MS):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self._connection = None
+        self._lock = None
+
+    async def execute(self, request):
+        await self.latency()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._connection is None:
+                self._connection = await asyncio.open_connection(self.host, self.port, limit=STREAM_LIMIT)
+            reader, writer = self._connection
+            try:
+                writer.write(json.dumps(request).encode() + b"\n")
+                await writer.drain()
+                line = await reader.readline()
+            except (ConnectionError, OSError):
+                self._connection = None
+                raise
+        if not line:
+            self._connection = None
+            raise ConnectionError("FakeSupabase compartilhado encerrou a conexão")
+        response = json.loads(line)
+        if "erro" in response:
+            raise RuntimeError(response["erro"])
+        return response["data"]
+
+
+async def serve(db, host="127.0.0.1", port=0):
+    """Serve `db` para os serviços do benchmark. Devolve o servidor (porta em `sockets`)."""
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            try:
+                response = {"data": db.run(json.loads(line))}
+            except Exception as e:
+                response = {"erro": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, host, port, limit=STREAM_LIMIT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FakeSupabase compartilhado pelos serviços do benchmark")
+    parser.add_argument("--porta", type=int, default=int(os.getenv("BENCH_FAKE_PORT", "54329")))
+    parser.add_argument("--placas", type=int, default=int(os.getenv("BENCH_SEED_PLATES", "0")),
+                        help="créditos semeados (placas BENCH0000, BENCH0001, ...)")
+    args = parser.parse_args()
+
+    async def run():
+        # A latência é simulada nos clientes (RemoteFakeSupabase)
+        server = await serve(FakeSupabase(latency_ms=0, seed_plates=args.placas), port=args.porta)
+        print(f"FakeSupabase compartilhado em 127.0.0.1:{args.porta} ({args.placas} créditos semeados)")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Sobe um microsserviço real usando o FakeSupabase no lugar do banco.
+
+Com BENCH_FAKE_ADDR (host:porta, como faz o run_bench.py) o serviço usa o
+FakeSupabase compartilhado, com os mesmos dados dos outros serviços; sem
+ele, um FakeSupabase só deste processo (a compra não chega ao creditos nem
+à fiscalização). Com BENCH_STORAGE diferente de "fake" o serviço usa o
+STORAGE_BACKEND configurado (por exemplo sqlite), sem substituições.
+
+Uso: python bench/launcher.py <pagamento|creditos|fiscalizacao>
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = {
+    "pagamento": "pagamento_consumer",
+    "creditos": "credits_consumer",
+    "fiscalizacao": "fiscalizacao_consumer",
+}
+
+
+def install_fake_supabase():
+    import storage
+    from fake_supabase import FakeSupabase, RemoteFakeSupabase
+
+    endereco = os.getenv("BENCH_FAKE_ADDR")
+    if endereco:
+        host, port = endereco.rsplit(":", 1)
+        fake = RemoteFakeSupabase(host, int(port))
+    else:
+        print("⚠️ BENCH_FAKE_ADDR não definido: banco falso só deste processo, sem dados dos outros serviços.")
+        fake = FakeSupabase(seed_plates=int(os.getenv("BENCH_SEED_PLATES", "0")))
+
+    # Mesmo caminho de código do backend Supabase, só trocando o cliente
+    async def open_storage(backend=None):
+        return storage.InstrumentedStorage(storage.SupabaseStorage(fake))
+
+    storage.open_storage = open_storage
+
+
+def main():
+    service = sys.argv[1]
+    if service not in SERVICES:
+        sys.exit(f"Serviço desconhecido: {service}. Opções: {', '.join(SERVICES)}")
+
+    os.environ.setdefault("SERVICE_NAME", service)
+    os.environ.setdefault("RABBITMQ_HOST", "localhost")
+    os.environ.setdefault("RABBITMQ_USER", "estaciona_user")
+    os.environ.setdefault("RABBITMQ_PASS", "estaciona_user")
+
+    # Mesmo layout da imagem Docker: common/ + app/ do serviço no path
+    sys.path[:0] = [
+        os.path.join(ROOT, "bench"),
+        os.path.join(ROOT, "common"),
+        os.path.join(ROOT, f"{service}-service", "app"),
+    ]
+    if os.getenv("BENCH_STORAGE", "fake") == "fake":
+        install_fake_supabase()
+
+    consumer = __import__(SERVICES[service])
+    consumer.start_consuming()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Benchmark ponta a ponta do pipeline (cliente MQTT -> serviços -> resposta).
+
+Sobe pagamento, creditos e fiscalizacao com um FakeSupabase compartilhado
+(um processo só, ver fake_supabase.py e launcher.py: a compra gravada pelo
+pagamento é creditada e vista pela fiscalização) contra um RabbitMQ local
+e dispara usuários virtuais usando o MqttRpcClient do cliente. Ao final mostra p50/p95/p99 por operação e as
+mensagens por segundo de cada fila (hop), lidas da API de management.
+
+Exemplo:
+    docker-compose up -d rabbitmq
+    python bench/run_bench.py --usuarios 20 --duracao 30 --mix-compra 0.3 --max-p95-ms 500
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import base64
+import argparse
+import threading
+import subprocess
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "client"))
+
+from cli import MqttRpcClient, USER_ID_FIXO, RABBIT_USER, RABBIT_PASS, plate_topic
+
+MANAGEMENT_API = os.getenv("BENCH_MANAGEMENT_API", "http://localhost:15672/api")
+MANAGEMENT_USER = os.getenv("BENCH_MANAGEMENT_USER", RABBIT_USER)
+MANAGEMENT_PASS = os.getenv("BENCH_MANAGEMENT_PASS", RABBIT_PASS)
+
+SERVICES = ["pagamento", "creditos", "fiscalizacao"]
+HOPS = {
+    "pagamento": "queue_pagamento",
+    "creditos": "queue_credito",
+    "fiscalizacao": "queue_fiscalizacao",
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def queue_acks(queue):
+    """
+    Total de mensagens confirmadas na fila e nas suas partições <fila>.<n>
+    (None se a API não responder).
+    """
+    pattern = urllib.parse.quote(f"^{queue}(\\.[0-9]+)?$")
+    url = f"{MANAGEMENT_API}/queues/%2F?name={pattern}&use_regex=true"
+    token = base64.b64encode(f"{MANAGEMENT_USER}:{MANAGEMENT_PASS}".encode()).decode()
+    request = urllib.request.Request(url, headers={"Authorization": f"Basic {token}"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return sum(q.get("message_stats", {}).get("ack", 0) for q in json.load(response))
+    except Exception:
+        return None
+
+
+def wait_port(port, timeout=10):
+    # Os serviços acessam o banco logo ao subir
+    limite = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > limite:
+                raise
+            time.sleep(0.1)
+
+
+def start_services(args):
+    env = dict(os.environ)
+    env["BENCH_DB_LATENCY_MS"] = str(args.latencia_db_ms)
+    env["BENCH_SEED_PLATES"] = str(args.placas)
+    env["BENCH_STORAGE"] = args.storage
+    processes = []
+    if args.storage == "fake":
+        # Um banco falso para todos os serviços, como o banco real
+        env["BENCH_FAKE_ADDR"] = f"127.0.0.1:{args.porta_fake}"
+        processes.append(subprocess.Popen(
+            [sys.executable, "-u", os.path.join(ROOT, "bench", "fake_supabase.py"),
+             "--porta", str(args.porta_fake), "--placas", str(args.placas)],
+            env=env,
+            stdout=subprocess.DEVNULL if not args.logs_servicos else None,
+        ))
+        wait_port(args.porta_fake)
+    else:
+        env["STORAGE_BACKEND"] = args.storage
+    for service in SERVICES:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-u", os.path.join(ROOT, "bench", "launcher.py"), service],
+            env=env,
+            stdout=subprocess.DEVNULL if not args.logs_servicos else None,
+        ))
+    return processes
+
+
+def operation(args):
+    # Metade das placas consultadas tem crédito semeado, metade não
+    placa = f"BENCH{random.randrange(args.placas * 2):04d}"
+    if random.random() < args.mix_compra:
+        payload = {"user_id": USER_ID_FIXO, "placa": placa, "zona": random.choice("ABC"), "duracao_horas": 1}
+        return "credito/compra", payload
+    return "fiscalizacao/consulta", {"placa": placa}
+
+
+def virtual_call(client, topic, payload):
+    # Mesmo tópico do cliente real, com a placa no final (partição por placa)
+    return client.call(plate_topic(topic, payload["placa"]), payload)
+
+
+def virtual_user(args, client, deadline, results, lock):
+    while time.monotonic() < deadline:
+        topic, payload = operation(args)
+        start = time.perf_counter()
+        response = virtual_call(client, topic, payload)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        ok = not response.get("error") and response.get("success", True) is not False
+        with lock:
+            results.setdefault(topic, []).append((elapsed_ms, ok))
+
+
+def report(results, elapsed, hop_rates):
+    print("\n=== Latência ponta a ponta ===")
+    print(f"{'operação':<24}{'total':>8}{'falhas':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for topic, samples in sorted(results.items()):
+        latencies = [ms for ms, ok in samples if ok]
+        falhas = sum(1 for _, ok in samples if not ok)
+        print(
+            f"{topic:<24}{len(samples):>8}{falhas:>8}{len(samples) / elapsed:>9.1f}"
+            f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}{percentile(latencies, 99):>9.1f}"
+        )
+
+    print("\n=== Mensagens por segundo por hop ===")
+    for service, rate in hop_rates.items():
+        valor = f"{rate:.1f} msg/s" if rate is not None else "indisponível (API de management)"
+        print(f"{HOPS[service]:<24}{valor}")
+    print("(a API de management atualiza as estatísticas a cada poucos segundos)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline do EstacionaApp")
+    parser.add_argument("--usuarios", type=int, default=10, help="usuários virtuais (agentes e compradores) simultâneos")
+    parser.add_argument("--duracao", type=float, default=30, help="duração da carga em segundos")
+    parser.add_argument("--mix-compra", type=float, default=0.3, help="fração das operações que são compras (0 a 1)")
+    parser.add_argument("--placas", type=int, default=500, help="créditos semeados no banco falso")
+    parser.add_argument("--latencia-db-ms", type=float, default=15, help="latência simulada de cada chamada ao banco")
+    parser.add_argument("--storage", default="fake", choices=["fake", "sqlite", "postgres", "supabase"],
+                        help="banco usado pelos serviços (fake = em memória, compartilhado pelos serviços)")
+    parser.add_argument("--porta-fake", type=int, default=54329, help="porta local do FakeSupabase compartilhado")
+    parser.add_argument("--aquecimento", type=float, default=3, help="espera (s) para os serviços conectarem")
+    parser.add_argument("--sem-servicos", action="store_true", help="não sobe os serviços (já estão rodando)")
+    parser.add_argument("--logs-servicos", action="store_true", help="mostra a saída dos serviços")
+    parser.add_argument("--codec", default="json", choices=["json", "msgpack"], help="formato das mensagens do cliente")
+    parser.add_argument("--max-p95-ms", type=float, help="falha (código 1) se o p95 de alguma operação passar deste valor")
+    args = parser.parse_args()
+
+    processes = [] if args.sem_servicos else start_services(args)
+    try:
+        time.sleep(args.aquecimento)
+        clients = [MqttRpcClient(verbose=False, codec=args.codec) for _ in range(args.usuarios)]
+        time.sleep(1)
+
+        acks_before = {service: queue_acks(queue) for service, queue in HOPS.items()}
+        results, lock = {}, threading.Lock()
+        start = time.monotonic()
+        deadline = start + args.duracao
+        threads = [
+            threading.Thread(target=virtual_user, args=(args, client, deadline, results, lock))
+            for client in clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        acks_after = {service: queue_acks(queue) for service, queue in HOPS.items()}
+        hop_rates = {
+            service: (acks_after[service] - acks_before[service]) / elapsed
+            if acks_before[service] is not None and acks_after[service] is not None else None
+            for service in HOPS
+        }
+        for client in clients:
+            client.disconnect()
+    finally:
+        for process in processes:
+            process.terminate()
+
+    report(results, elapsed, hop_rates)
+
+    if args.max_p95_ms is not None:
+        piores = {
+            topic: percentile([ms for ms, ok in samples if ok], 95)
+            for topic, samples in results.items()
+        }
+        acima = {topic: p95 for topic, p95 in piores.items() if p95 > args.max_p95_ms}
+        if acima:
+            print(f"\nREGRESSÃO: p95 acima de {args.max_p95_ms} ms em {acima}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
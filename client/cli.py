@@ -6,6 +6,18 @@ import uuid
 import cmd
 import threading
 import time
+import heapq
+import asyncio
+import sys
+import argparse
+import os
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # --- Configurações ---
 MQTT_BROKER_HOST = 'localhost'
@@ -13,95 +25,343 @@ MQTT_BROKER_PORT = 1883 # Porta padrão do MQTT
 USER_ID_FIXO = "a1b2c3d4-e5f6-7890-1234-567890abcdef"
 RABBIT_USER = "estaciona_user"
 RABBIT_PASS = "estaciona_user"
+CODECS = ("json", "msgpack")
+
+
+def plate_topic(base, placa):
+    """Tópico com a placa no final: os serviços particionam as filas pelo hash dela."""
+    return f"{base}/{placa.upper().replace('-', '')}"
+
+
+def batch_topic(base):
+    """Tópico de lote: sem placa, um id aleatório no final espalha os lotes entre as partições."""
+    return f"{base}/{uuid.uuid4().hex}"
+
+
+def encode_payload(payload, codec="json"):
+    """Serializa a requisição; os serviços respondem no mesmo formato."""
+    if codec == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("codec msgpack requer o pacote msgpack (pip install msgpack)")
+        return msgpack.packb(payload)
+    return json.dumps(payload)
+
+
+def decode_payload(raw):
+    # O MQTT 3.1.1 não transporta content_type: objetos msgpack começam com 0x80-0x8f, 0xde ou 0xdf
+    if raw and (0x80 <= raw[0] <= 0x8f or raw[0] in (0xde, 0xdf)):
+        return msgpack.unpackb(raw)
+    return json.loads(raw)
 
 class MqttRpcClient:
     """
     Classe que encapsula a lógica de RPC (Requisição-Resposta) sobre o protocolo MQTT.
+
+    Várias chamadas podem ficar em voo ao mesmo tempo sobre a mesma conexão:
+    `call_async` devolve um `concurrent.futures.Future`, `acall` é a versão
+    para asyncio e `call` continua bloqueando até a resposta. As chamadas
+    pendentes são limitadas a `max_pending`; ao passar do limite a mais
+    antiga é encerrada com erro. Timeouts são tratados por uma única thread.
+    Com `codec="msgpack"` as requisições (e as respostas) trafegam em msgpack.
+    O `access_token` (quando informado) segue em todas as requisições.
     """
-    def __init__(self):
+    def __init__(self, verbose=True, qos=0, max_pending=1000, timeout=10, codec="json", access_token=None):
+        self.verbose = verbose
+        self.codec = codec
+        self.access_token = access_token
+        self.qos = qos
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.late_replies = 0
+
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.client.username_pw_set(RABBIT_USER, RABBIT_PASS)
         self.client.on_connect = self.on_connect
+        self.client.on_subscribe = self.on_subscribe
         self.client.on_message = self.on_message
 
-        # Dicionários para rastrear as respostas pendentes
-        self.response_payloads = {}
-        self.response_events = {}
+        # Chamadas pendentes: corr_id -> (future, enviado_em, trace), em ordem de envio
+        self._pending = OrderedDict()
+        self._timeouts = []  # heap de (expira_em, corr_id)
+        self._lock = threading.Condition()
+        self._subscribed = threading.Event()
+        self._closed = False
 
         # Tópico de resposta único para este cliente
         self.response_topic = f"response/client/{uuid.uuid4()}"
 
+        self._reaper = threading.Thread(target=self._expire_calls, daemon=True)
+        self._reaper.start()
+
         self.client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
         self.client.loop_start()  # Inicia a thread de rede em background
 
     def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
-            print("[INFO] Conectado ao Broker MQTT com sucesso!")
             # Inscreve-se no tópico de resposta assim que a conexão é estabelecida
-            client.subscribe(self.response_topic)
-            print(f"[INFO] Escutando por respostas no tópico: {self.response_topic}")
+            client.subscribe(self.response_topic, qos=self.qos)
+            if self.verbose:
+                print("[INFO] Conectado ao Broker MQTT com sucesso!")
+                print(f"[INFO] Escutando por respostas no tópico: {self.response_topic}")
         else:
             print(f"[ERRO] Falha ao conectar, código de retorno: {rc}\n")
 
+    def on_subscribe(self, client, userdata, mid, reason_codes, properties=None):
+        self._subscribed.set()
+
     def on_message(self, client, userdata, msg):
         # Callback chamado para TODAS as mensagens recebidas
         try:
-            payload = json.loads(msg.payload)
+            payload = decode_payload(msg.payload)
             corr_id = payload.get('correlation_id')
 
-            # Se a mensagem tem um correlation_id que estamos esperando...
-            if corr_id in self.response_events:
-                self.response_payloads[corr_id] = payload
-                # ...sinaliza o evento para "acordar" a thread que fez a chamada
-                self.response_events[corr_id].set()
+            with self._lock:
+                pending = self._pending.pop(corr_id, None)
+            if pending is None:
+                # Resposta que chegou depois do timeout (ou duplicada com QoS 1)
+                self.late_replies += 1
+                if self.verbose:
+                    print(f"[AVISO] Resposta tardia ignorada (corr_id={str(corr_id)[:8]}...).")
+                return
+
+            future, enviado_em, trace = pending
+            if trace:
+                print_trace(enviado_em, time.time(), payload.get('_trace', []))
+            future.set_result(payload)
         except Exception as e:
             print(f"[ERRO] Falha ao processar a mensagem: {str(e)}")
 
-    def call(self, target_topic, payload):
+    def call_async(self, target_topic, payload, trace=False, timeout=None, qos=None):
+        """Publica a requisição e devolve um Future com a resposta (ou um dict com 'error')."""
+        timeout = timeout or self.timeout
         corr_id = str(uuid.uuid4())
-        
-        # Prepara o evento de sincronização para esta chamada específica
-        event = threading.Event()
-        self.response_events[corr_id] = event
+        future = Future()
 
-        # Adiciona os metadados de RPC ao payload
+        # Adiciona os metadados de RPC a uma cópia: o payload do chamador não muda
+        payload = dict(payload)
         payload['correlation_id'] = corr_id
         payload['reply_to'] = self.response_topic
+        if trace:
+            payload['trace'] = True
 
-        # Publica a mensagem de requisição
-        self.client.publish(target_topic, json.dumps(payload))
-        print(f" [->] Requisição (corr_id={corr_id[:8]}...) enviada para o tópico '{target_topic}'...")
+        # O deadline avisa os serviços de quando esta chamada deixa de esperar pela resposta
+        enviado_em = time.time()
+        payload['deadline'] = enviado_em + timeout
+        if self.access_token:
+            payload['access_token'] = self.access_token
 
-        # Espera pelo evento ser sinalizado (com timeout)
-        event_was_set = event.wait(timeout=10)
+        evicted = None
+        with self._lock:
+            self._pending[corr_id] = (future, enviado_em, trace)
+            if len(self._pending) > self.max_pending:
+                _, evicted = self._pending.popitem(last=False)
+            heapq.heappush(self._timeouts, (time.monotonic() + timeout, corr_id))
+            self._lock.notify()
+        if evicted:
+            evicted[0].set_result({"error": "Descartada: limite de chamadas pendentes atingido."})
+
+        # Só publica depois que a inscrição no tópico de resposta foi confirmada
+        self._subscribed.wait(timeout=timeout)
+        try:
+            self.client.publish(target_topic, encode_payload(payload, self.codec), qos=self.qos if qos is None else qos)
+        except Exception:
+            # A requisição não saiu: ninguém vai responder a este corr_id
+            with self._lock:
+                self._pending.pop(corr_id, None)
+            raise
+        if self.verbose:
+            print(f" [->] Requisição (corr_id={corr_id[:8]}...) enviada para o tópico '{target_topic}'...")
+        return future
 
-        # Limpeza
-        del self.response_events[corr_id]
+    def call(self, target_topic, payload, trace=False, timeout=None, qos=None):
+        return self.call_async(target_topic, payload, trace=trace, timeout=timeout, qos=qos).result()
 
-        if not event_was_set:
-            return {"error": "Timeout: Nenhuma resposta recebida do serviço."}
-        
-        return self.response_payloads.pop(corr_id)
+    async def acall(self, target_topic, payload, trace=False, timeout=None, qos=None):
+        return await asyncio.wrap_future(
+            self.call_async(target_topic, payload, trace=trace, timeout=timeout, qos=qos)
+        )
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _expire_calls(self):
+        while True:
+            expired = []
+            with self._lock:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                while self._timeouts and self._timeouts[0][0] <= now:
+                    _, corr_id = heapq.heappop(self._timeouts)
+                    pending = self._pending.pop(corr_id, None)
+                    if pending:
+                        expired.append(pending[0])
+                wait = self._timeouts[0][0] - now if self._timeouts else None
+                if not expired:
+                    self._lock.wait(timeout=wait)
+            for future in expired:
+                future.set_result({"error": "Timeout: Nenhuma resposta recebida do serviço."})
 
     def disconnect(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
         self.client.loop_stop()
         self.client.disconnect()
 
 
+def print_trace(enviado_em, recebido_em, spans):
+    """Mostra onde o tempo de uma requisição foi gasto em cada hop."""
+    print("\n--- Tempo por hop (ms) ---")
+    print(f"{'hop':<16}{'fila':>9}{'banco':>9}{'outros':>9}")
+    anterior = enviado_em
+    for span in spans:
+        publicado = span.get('publicado') or span['recebido']
+        fila = (span['recebido'] - anterior) * 1000
+        processamento = (publicado - span['recebido']) * 1000
+        banco = span.get('banco_ms', 0.0)
+        print(f"{span['servico']:<16}{fila:>9.1f}{banco:>9.1f}{processamento - banco:>9.1f}")
+        anterior = publicado
+    print(f"{'resposta':<16}{(recebido_em - anterior) * 1000:>9.1f}")
+    print(f"{'total':<16}{(recebido_em - enviado_em) * 1000:>9.1f}")
+    print("(fila = espera no broker desde a publicação do hop anterior)")
+
+
+def multa_payload(placa, localizacao=None):
+    return {"placa": placa.upper(), "localizacao": localizacao or "Rua Principal, 123"}
+
+
+def parse_command(linha):
+    """
+    Converte uma linha de script em (tópico, payload, espera_resposta).
+    Aceita os mesmos comandos do shell: adicionar_credito, consultar_placa,
+    consultar_placas, consultar_ocupacao e notificar_multa.
+    """
+    comando, _, resto = linha.partition(' ')
+    args = resto.split()
+    if comando == 'adicionar_credito' and len(args) == 3:
+        placa, zona, horas = args
+        payload = {"user_id": USER_ID_FIXO, "placa": placa.upper(), "zona": zona, "duracao_horas": int(horas)}
+        return plate_topic('credito/compra', placa), payload, True
+    if comando == 'consultar_placa' and len(args) == 1:
+        return plate_topic('fiscalizacao/consulta', args[0]), {"placa": args[0].upper()}, True
+    if comando == 'consultar_placas' and args:
+        return batch_topic('fiscalizacao/lote'), {"placas": [placa.upper() for placa in args]}, True
+    if comando == 'consultar_ocupacao' and len(args) <= 1:
+        return 'ocupacao/consulta', {"zona": args[0]} if args else {}, True
+    if comando == 'notificar_multa' and args:
+        partes = resto.split(maxsplit=1)
+        return 'fiscalizacao/multa', multa_payload(partes[0], partes[1] if len(partes) > 1 else None), False
+    raise ValueError(f"comando inválido: {linha}")
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+
+class BulkRunner:
+    """
+    Executa um script de comandos sem interação: até `concorrencia`
+    requisições em voo e no máximo `taxa` envios por segundo (0 = sem
+    limite). Ao final imprime vazão, latências por comando e as falhas.
+    """
+    def __init__(self, mqtt_client, concorrencia=8, taxa=0):
+        self.mqtt_client = mqtt_client
+        self.slots = threading.Semaphore(concorrencia)
+        self.intervalo = 1 / taxa if taxa > 0 else 0
+        self.lock = threading.Lock()
+        self.latencias = {}
+        self.falhas = []
+        self.total = 0
+
+    def _registrar(self, numero, linha, comando, inicio, resposta):
+        elapsed_ms = (time.perf_counter() - inicio) * 1000
+        erro = resposta.get("error") or (resposta.get("success") is False and "success=False")
+        with self.lock:
+            self.total += 1
+            if erro:
+                self.falhas.append((numero, linha, erro))
+            else:
+                self.latencias.setdefault(comando, []).append(elapsed_ms)
+        self.slots.release()
+
+    def run(self, linhas):
+        inicio_geral = time.perf_counter()
+        proximo_envio = inicio_geral
+        futures = []
+        for numero, linha in enumerate(linhas, start=1):
+            linha = linha.strip()
+            if not linha or linha.startswith('#'):
+                continue
+            try:
+                topico, payload, espera_resposta = parse_command(linha)
+            except ValueError as e:
+                self.falhas.append((numero, linha, str(e)))
+                continue
+            # As latências são agrupadas por comando (o tópico inclui a placa)
+            comando = linha.split()[0]
+
+            if self.intervalo:
+                espera = proximo_envio - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                proximo_envio = max(proximo_envio, time.perf_counter()) + self.intervalo
+
+            self.slots.acquire()
+            inicio = time.perf_counter()
+            try:
+                if espera_resposta:
+                    future = self.mqtt_client.call_async(topico, payload)
+                else:
+                    self.mqtt_client.client.publish(topico, encode_payload(payload, self.mqtt_client.codec))
+            except Exception as e:
+                # O envio falhou: conta como falha e devolve a vaga
+                self._registrar(numero, linha, comando, inicio, {"error": str(e)})
+                continue
+            if not espera_resposta:
+                self._registrar(numero, linha, comando, inicio, {})
+                continue
+            future.add_done_callback(
+                lambda f, n=numero, l=linha, c=comando, i=inicio: self._registrar(n, l, c, i, f.result())
+            )
+            futures.append(future)
+
+        for future in futures:
+            future.result()
+        self.resumo(time.perf_counter() - inicio_geral)
+        return not self.falhas
+
+    def resumo(self, duracao):
+        print("\n=== Resumo da execução ===")
+        print(f"Comandos: {self.total}  Falhas: {len(self.falhas)}  Duração: {duracao:.1f}s  "
+              f"Vazão: {self.total / duracao if duracao else 0:.1f} cmd/s")
+        print(f"{'comando':<24}{'ok':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for comando, valores in sorted(self.latencias.items()):
+            print(f"{comando:<24}{len(valores):>6}{percentil(valores, 50):>9.1f}"
+                  f"{percentil(valores, 95):>9.1f}{percentil(valores, 99):>9.1f}")
+        if self.falhas:
+            print("\nFalhas:")
+            for numero, linha, erro in sorted(self.falhas):
+                print(f"  linha {numero}: {linha} -> {erro}")
+
+
 class EstacionamentoShell(cmd.Cmd):
     """Shell interativo para testar o sistema de estacionamento via MQTT."""
     intro = 'Bem-vindo ao cliente MQTT do EstacionaApp. Digite help ou ? para listar os comandos.\n'
     prompt = '(Estacionamento)> '
 
-    def __init__(self):
+    def __init__(self, codec="json", access_token=None):
         super().__init__()
-        self.mqtt_client = MqttRpcClient()
-        # Damos um pequeno tempo para a conexão ser estabelecida
-        time.sleep(1)
+        self.mqtt_client = MqttRpcClient(codec=codec, access_token=access_token)
+        self.trace = False
 
     def _publish_simple_message(self, topic_name, payload):
         """Função auxiliar para enviar mensagens "fire-and-forget"."""
-        self.mqtt_client.client.publish(topic_name, json.dumps(payload))
+        self.mqtt_client.client.publish(topic_name, encode_payload(payload, self.mqtt_client.codec))
         print(f" [✔] Mensagem enviada com sucesso para o tópico '{topic_name}'.")
 
     def do_adicionar_credito(self, arg):
@@ -116,7 +376,7 @@ class EstacionamentoShell(cmd.Cmd):
                 "zona" : zona,
                 "duracao_horas": int(valor)
             }
-            response = self.mqtt_client.call('credito/compra', payload)
+            response = self.mqtt_client.call(plate_topic('credito/compra', placa), payload, trace=self.trace)
             print("\n--- Resultado da Consulta ---")
             if response.get("error"):
                 print(f"ERRO: {response['error']}")
@@ -141,7 +401,7 @@ class EstacionamentoShell(cmd.Cmd):
             return
 
         payload = {"placa": placa}
-        response = self.mqtt_client.call('fiscalizacao/consulta', payload)
+        response = self.mqtt_client.call(plate_topic('fiscalizacao/consulta', placa), payload, trace=self.trace)
 
         print("\n--- Resultado da Consulta ---")
         if response.get("error"):
@@ -164,6 +424,71 @@ class EstacionamentoShell(cmd.Cmd):
                     # Envia a confirmação para o serviço de notificação
                     self._publish_simple_message('fiscalizacao/multa', notification_payload)
 
+    def do_consultar_placas(self, arg):
+        """Consulta a situação de várias placas numa única requisição. (Função do Fiscal)
+        Uso: consultar_placas <placa> [<placa> ...]
+        Exemplo: consultar_placas BRA-2E19 ABC-1234 XYZ-9876"""
+        placas = [placa.upper() for placa in arg.split()]
+        if not placas:
+            print("Erro: Por favor, informe ao menos uma placa.")
+            return
+
+        payload = {"placas": placas}
+        response = self.mqtt_client.call(batch_topic('fiscalizacao/lote'), payload, trace=self.trace)
+
+        print("\n--- Resultado da Consulta em Lote ---")
+        if response.get("error"):
+            print(f"ERRO: {response['error']}")
+        elif not response.get("resultados"):
+            print(f"ERRO: {response.get('mensagem', 'Resposta sem resultados.')}")
+        else:
+            for resultado in response["resultados"]:
+                status = 'REGULAR' if resultado.get('status', False) else 'IRREGULAR'
+                print(f"{resultado.get('placa')}: {status}")
+            irregulares = sum(1 for r in response["resultados"] if not r.get('status', False))
+            print(f"Total: {len(response['resultados'])} placas, {irregulares} irregulares")
+        print("-------------------------------------\n")
+
+    def do_consultar_ocupacao(self, arg):
+        """Mostra quantos veículos com crédito ativo há em cada zona (ou em uma).
+        Uso: consultar_ocupacao [zona]
+        Exemplo: consultar_ocupacao A"""
+        zona = arg.strip()
+        payload = {"zona": zona} if zona else {}
+        response = self.mqtt_client.call('ocupacao/consulta', payload, trace=self.trace)
+
+        print("\n--- Ocupação por Zona ---")
+        if response.get("error"):
+            print(f"ERRO: {response['error']}")
+        else:
+            for nome, total in sorted(response.get("zonas", {}).items(), key=lambda item: str(item[0])):
+                print(f"Zona {nome}: {total} veículos")
+            print(f"Total: {response.get('total', 0)} veículos")
+        print("-------------------------\n")
+
+    def do_notificar_multa(self, arg):
+        """Notifica a guarda sobre um veículo irregular.
+        Uso: notificar_multa <placa> [localização]
+        Exemplo: notificar_multa BRA-2E19 Rua Principal, 123"""
+        partes = arg.split(maxsplit=1)
+        if not partes:
+            print("Erro: Por favor, informe a placa.")
+            return
+        payload = multa_payload(partes[0], partes[1] if len(partes) > 1 else None)
+        self._publish_simple_message('fiscalizacao/multa', payload)
+
+    def do_token(self, arg):
+        """Define o access token enviado nas requisições (sem argumento, remove).
+        Uso: token <access_token>"""
+        self.mqtt_client.access_token = arg.strip() or None
+        print("Token definido." if self.mqtt_client.access_token else "Token removido.")
+
+    def do_trace(self, arg):
+        """Liga ou desliga a exibição do tempo gasto em cada hop das requisições.
+        Uso: trace on|off"""
+        self.trace = arg.strip().lower() in ('on', 'sim', '1')
+        print(f"Trace {'ligado' if self.trace else 'desligado'}.")
+
     def do_exit(self, arg):
         """Sai do programa."""
         print('Encerrando conexão e saindo...')
@@ -179,8 +504,34 @@ class EstacionamentoShell(cmd.Cmd):
         return self.do_exit(arg)
 
 
-if __name__ == '__main__':
+def main():
+    parser = argparse.ArgumentParser(description="Cliente MQTT do EstacionaApp")
+    parser.add_argument("--script", help="arquivo de comandos para executar sem interação ('-' lê da entrada padrão)")
+    parser.add_argument("--concorrencia", type=int, default=8, help="requisições simultâneas no modo script")
+    parser.add_argument("--taxa", type=float, default=0, help="comandos por segundo no modo script (0 = sem limite)")
+    parser.add_argument("--codec", default="json", choices=CODECS, help="formato das mensagens")
+    parser.add_argument("--token", default=os.getenv("ESTACIONA_TOKEN"), help="access token do Supabase Auth (padrão: $ESTACIONA_TOKEN)")
+    args = parser.parse_args()
+
+    if not args.script:
+        try:
+            EstacionamentoShell(codec=args.codec, access_token=args.token).cmdloop()
+        except KeyboardInterrupt:
+            print("\nSaindo...")
+        return
+
+    arquivo = sys.stdin if args.script == '-' else open(args.script)
+    mqtt_client = MqttRpcClient(
+        verbose=False, max_pending=max(1000, args.concorrencia), codec=args.codec, access_token=args.token
+    )
     try:
-        EstacionamentoShell().cmdloop()
-    except KeyboardInterrupt:
-        print("\nSaindo...")
\ No newline at end of file
+        ok = BulkRunner(mqtt_client, args.concorrencia, args.taxa).run(arquivo)
+    finally:
+        mqtt_client.disconnect()
+        if arquivo is not sys.stdin:
+            arquivo.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import os
+import time
+import random
+import asyncio
+import aio_pika
+from aio_pika.exceptions import DeliveryError, PublishError as ReturnedError
+from dotenv import load_dotenv
+import metrics
+import backoff
+import sharding
+from runtime_base import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASS, RABBITMQ_HEARTBEAT
+from runtime_base import handling, publish_headers, observe_publish
+
+load_dotenv()
+
+TOPIC_EXCHANGE = 'amq.topic'
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "256"))
+
+# Filas particionadas por placa atrás de uma exchange x-consistent-hash:
+# QUEUE_SHARDS filas <fila>.<n>; as consumidas por esta réplica vêm de
+# `sharding.assigned`. QUEUE_TYPE=quorum declara as filas principais como
+# quorum queues.
+QUEUE_SHARDS = int(os.getenv("QUEUE_SHARDS", "1"))
+QUEUE_TYPE = os.getenv("QUEUE_TYPE", "classic")
+
+# Publisher confirms: tempo máximo de espera pelo ack do broker e tentativas
+PUBLISH_CONFIRM_TIMEOUT = float(os.getenv("PUBLISH_CONFIRM_TIMEOUT", "5"))
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "3"))
+
+# Esperas (ms) antes de cada nova tentativa de uma mensagem que falhou;
+# esgotadas as tentativas a mensagem vai para a fila <fila>.dlq
+RETRY_DELAYS_MS = [int(d) for d in os.getenv("RETRY_DELAYS_MS", "1000,5000,30000").split(",") if d]
+RETRY_HEADER = "x-retry-count"
+ROUTING_KEY_HEADER = "x-routing-key"
+ERROR_HEADER = "x-ultimo-erro"
+
+
+class PublishError(Exception):
+    """O broker não confirmou a publicação depois de todas as tentativas."""
+
+
+class RetryLater(Exception):
+    """Falha transitória (ex.: banco indisponível): a mensagem volta pela fila de retry."""
+
+
+def retry_count(message):
+    """Quantas vezes a mensagem já voltou pelas filas de retry."""
+    return int((message.headers or {}).get(RETRY_HEADER, 0))
+
+
+def last_attempt(message):
+    """True quando uma nova falha levará a mensagem para a DLQ."""
+    return retry_count(message) >= len(RETRY_DELAYS_MS)
+
+
+def max_publish_seconds():
+    """Pior caso de um `publish`: todas as tentativas esgotando o timeout, mais as pausas entre elas."""
+    return PUBLISH_CONFIRM_TIMEOUT * PUBLISH_MAX_ATTEMPTS + sum(0.1 * t for t in range(1, PUBLISH_MAX_ATTEMPTS + 1))
+
+
+def original_routing_key(message):
+    # Mensagens vindas do retry/DLQ chegam pela exchange padrão, com o nome da fila como routing key
+    return (message.headers or {}).get(ROUTING_KEY_HEADER) or message.routing_key
+
+
+class AsyncConsumerRuntime:
+    """
+    Runtime asyncio para os consumidores: uma conexão AMQP (aio-pika) e um
+    único event loop. Cada mensagem vira uma task; o prefetch limita
+    quantas ficam em voo ao mesmo tempo.
+
+    Os handlers são corrotinas `handler(message)` que recebem a
+    `aio_pika.IncomingMessage`. A mensagem é confirmada quando o handler
+    retorna; uma exceção não tratada devolve a mensagem à fila uma única vez.
+
+    O canal usa publisher confirms: cada `publish` espera o ack do broker
+    para a sua delivery tag, mas como cada mensagem roda na própria task as
+    publicações ficam em pipeline em vez de serializadas.
+
+    A conexão é robusta: depois de uma queda o aio-pika reconecta e
+    restaura canal, filas, bindings e consumidores sozinho. A primeira
+    conexão também é repetida com backoff e jitter, e `on_reconnect`
+    registra corrotinas para ressincronizar estado local após a volta.
+
+    Filas nomeadas ganham filas de retry `<fila>.retry.<ms>` (TTL que
+    devolve a mensagem à fila original) e uma `<fila>.dlq`. Uma exceção no
+    handler republica a mensagem na próxima fila de retry, em vez de
+    reentregá-la na hora; esgotado RETRY_DELAYS_MS ela vai para a DLQ, de
+    onde pode ser inspecionada e reprocessada (rabbitmq-data/replay_dlq.py).
+    """
+    def __init__(self, prefetch=None):
+        self.prefetch = prefetch or CONSUMER_PREFETCH
+        self.connection = None
+        self.channel = None
+        self.topic = None
+        self._tasks = set()
+        self._on_reconnect = []
+        self._retry_queues = set()
+        self.shards = None
+
+    async def connect(self):
+        # Sem partições definidas a réplica nem conecta (sharding.assigned levanta)
+        self.shards = sharding.assigned(QUEUE_SHARDS) if QUEUE_SHARDS > 1 else None
+        metrics.start_metrics_server()
+        tentativa = 0
+        while True:
+            try:
+                self.connection = await aio_pika.connect_robust(
+                    host=RABBITMQ_HOST, login=RABBITMQ_USER, password=RABBITMQ_PASS,
+                    heartbeat=RABBITMQ_HEARTBEAT,
+                    # Intervalo sorteado por processo: réplicas não reconectam todas juntas
+                    reconnect_interval=backoff.RECONNECT_BASE_DELAY * (2 + 2 * random.random()),
+                )
+                break
+            except (ConnectionError, OSError, aio_pika.exceptions.AMQPConnectionError) as e:
+                tentativa += 1
+                espera = backoff.delay(tentativa)
+                metrics.RECONNECTS.inc()
+                print(f"Conexão com o RabbitMQ indisponível ({e!r}); nova tentativa em {espera:.1f}s.")
+                await asyncio.sleep(espera)
+        self.connection.reconnect_callbacks.add(self._reconnected)
+        # on_return_raises: mensagem `mandatory` sem fila de destino volta como
+        # basic.return e o publish falha, em vez de contar como confirmada
+        self.channel = await self.connection.channel(publisher_confirms=True, on_return_raises=True)
+        await self.channel.set_qos(prefetch_count=self.prefetch)
+        self.topic = await self.channel.get_exchange(TOPIC_EXCHANGE)
+        return self
+
+    def on_reconnect(self, coro_fn):
+        """Agenda `coro_fn()` toda vez que a conexão for restabelecida."""
+        self._on_reconnect.append(coro_fn)
+
+    def _reconnected(self, *args):
+        metrics.RECONNECTS.inc()
+        print("Conexão com o RabbitMQ restabelecida; topologia e consumidores restaurados.")
+        for coro_fn in self._on_reconnect:
+            task = asyncio.get_running_loop().create_task(coro_fn())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def declare_queue(self, name, routing_keys=(), retries=True, exchange=None, **kwargs):
+        """Declara a fila (nome vazio = exclusiva) e a liga ao amq.topic (ou a `exchange`)."""
+        if name:
+            arguments = {"x-queue-type": QUEUE_TYPE} if QUEUE_TYPE != "classic" else None
+            queue = await self.channel.declare_queue(name, durable=True, arguments=arguments, **kwargs)
+            if retries:
+                await self._declare_retry_queues(name)
+        else:
+            queue = await self.channel.declare_queue(exclusive=True, **kwargs)
+        for routing_key in routing_keys:
+            await queue.bind(exchange or self.topic, routing_key=routing_key)
+        return queue
+
+    async def declare_sharded_queue(self, name, routing_keys=()):
+        """
+        Com QUEUE_SHARDS > 1, liga as routing keys a uma exchange
+        x-consistent-hash `<fila>.hash` que distribui as mensagens entre
+        `<fila>.0` ... `<fila>.<N-1>` pelo hash da routing key (que termina
+        na placa): a mesma placa cai sempre na mesma fila e, portanto, na
+        mesma réplica, em ordem. Devolve as filas que esta réplica consome.
+        """
+        if QUEUE_SHARDS <= 1:
+            return [await self.declare_queue(name, routing_keys)]
+
+        hash_exchange = await self.channel.declare_exchange(f"{name}.hash", "x-consistent-hash", durable=True)
+        for routing_key in routing_keys:
+            await hash_exchange.bind(self.topic, routing_key=routing_key)
+
+        # Todas as partições precisam existir: a exchange não guarda mensagens
+        # de partições sem fila. A routing key do binding é o peso da partição.
+        minhas = self.shards
+        queues = []
+        for shard in range(QUEUE_SHARDS):
+            queue = await self.declare_queue(f"{name}.{shard}", ["1"], exchange=hash_exchange)
+            if shard in minhas:
+                queues.append(queue)
+        print(f"Fila {name} particionada em {QUEUE_SHARDS}; consumindo {sorted(minhas)}")
+        return queues
+
+    async def _declare_retry_queues(self, name):
+        for delay in RETRY_DELAYS_MS:
+            await self.channel.declare_queue(f"{name}.retry.{delay}", durable=True, arguments={
+                "x-message-ttl": delay,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": name,
+            })
+        await self.channel.declare_queue(f"{name}.dlq", durable=True)
+        self._retry_queues.add(name)
+
+    async def _retry(self, queue_name, handler_name, message, error):
+        """Agenda uma nova tentativa (ou manda para a DLQ). False quando a fila não tem retry."""
+        if queue_name not in self._retry_queues:
+            return False
+        tentativa = retry_count(message)
+        if tentativa < len(RETRY_DELAYS_MS):
+            destino = f"{queue_name}.retry.{RETRY_DELAYS_MS[tentativa]}"
+        else:
+            destino = f"{queue_name}.dlq"
+        headers = {
+            **(message.headers or {}),
+            RETRY_HEADER: tentativa + 1,
+            ROUTING_KEY_HEADER: original_routing_key(message),
+            ERROR_HEADER: str(error)[:500],
+        }
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers=headers,
+                content_type=message.content_type,
+                correlation_id=message.correlation_id,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=destino,
+            timeout=PUBLISH_CONFIRM_TIMEOUT,
+        )
+        metrics.RETRIES.labels(handler=handler_name, destino="dlq" if destino.endswith(".dlq") else "retry").inc()
+        print(f"Mensagem {message.correlation_id} enviada para '{destino}' após falha em {handler_name}: {error}")
+        return True
+
+    async def publish(self, routing_key, body, correlation_id=None, persistent=False, exchange=None,
+                      mandatory=False, expiration=None, content_type=None):
+        """
+        Publica e espera a confirmação do broker. Nacks e timeouts são
+        repetidos até PUBLISH_MAX_ATTEMPTS vezes; depois disso levanta
+        `PublishError`. Com `mandatory`, mensagem sem fila de destino
+        levanta `PublishError` na hora, sem novas tentativas. `expiration` (segundos) faz o broker
+        descartar a mensagem que ficar parada na fila por mais tempo.
+        `content_type` identifica o formato do corpo (ver codec.py).
+        """
+        message = aio_pika.Message(
+            body=body,
+            content_type=content_type,
+            correlation_id=correlation_id,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT if persistent else None,
+            headers=publish_headers(),
+            expiration=expiration,
+        )
+        exchange = exchange or self.topic
+        start = time.perf_counter()
+        for tentativa in range(1, PUBLISH_MAX_ATTEMPTS + 1):
+            try:
+                await exchange.publish(
+                    message, routing_key=routing_key, mandatory=mandatory, timeout=PUBLISH_CONFIRM_TIMEOUT
+                )
+                observe_publish(routing_key, time.perf_counter() - start)
+                return
+            except ReturnedError as e:
+                # Nenhuma fila ligada à routing key: repetir não adianta
+                raise PublishError(f"publicação em '{routing_key}' sem fila de destino: {e!r}") from e
+            except (DeliveryError, asyncio.TimeoutError) as e:
+                print(f"Publicação em '{routing_key}' não confirmada (tentativa {tentativa}/{PUBLISH_MAX_ATTEMPTS}): {e!r}")
+                await asyncio.sleep(0.1 * tentativa)
+        raise PublishError(f"publicação em '{routing_key}' não confirmada pelo broker")
+
+    async def consume(self, queue, handler):
+        async def dispatch(message):
+            task = asyncio.create_task(self._run(handler, message, queue.name))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        await queue.consume(dispatch)
+
+    async def _run(self, handler, message, queue_name):
+        name = handler.__name__
+        with handling(name, original_routing_key(message), message.headers, message.correlation_id):
+            try:
+                # Se nem a fila de retry aceitar a mensagem, ela volta à fila uma única vez
+                async with message.process(requeue=not message.redelivered, ignore_processed=True):
+                    try:
+                        await handler(message)
+                    except Exception as e:
+                        metrics.count_error(name)
+                        if not await self._retry(queue_name, name, message, e):
+                            raise
+            except Exception as e:
+                print(f"ERRO não tratado em {name}: {e}")
+
+    async def run_forever(self):
+        print(f"Runtime asyncio: prefetch={self.prefetch}")
+        try:
+            await asyncio.Future()
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.connection.close()
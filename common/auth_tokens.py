@@ -0,0 +1,130 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import jwt
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# Tokens HS256 (segredo JWT do projeto) e/ou chaves assimétricas publicadas no JWKS do Supabase Auth
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or (
+    f"{os.getenv('SUPABASE_URL').rstrip('/')}/auth/v1/.well-known/jwks.json" if os.getenv("SUPABASE_URL") else ""
+)
+JWT_AUDIENCE = os.getenv("JWT_AUDIENCE", "authenticated")
+JWKS_CACHE_SECONDS = int(os.getenv("JWKS_CACHE_SECONDS", "600"))
+AUTH_SESSION_CACHE = int(os.getenv("AUTH_SESSION_CACHE", "10000"))
+# Sem AUTH_REQUIRED, mensagens sem token continuam aceitas (tokens presentes são sempre verificados)
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "false").lower() in ("1", "true", "sim")
+
+ASYMMETRIC_ALGORITHMS = ["RS256", "ES256"]
+
+
+class InvalidToken(Exception):
+    """Token ausente, expirado ou com assinatura inválida."""
+
+
+class TokenVerifier:
+    """
+    Verifica access tokens do Supabase Auth localmente, sem chamada de rede
+    por mensagem: o segredo HS256 vem do ambiente e as chaves públicas do
+    JWKS ficam em cache (buscadas de novo só quando aparece um `kid`
+    desconhecido ou o cache vence).
+
+    Tokens já validados ficam num LRU até o `exp`, então repetir o mesmo
+    token custa uma consulta ao dicionário.
+    """
+    def __init__(self, secret=None, jwks_url=None, audience=None, cache_size=None):
+        self.secret = secret if secret is not None else SUPABASE_JWT_SECRET
+        self.audience = audience or JWT_AUDIENCE
+        self.cache_size = cache_size or AUTH_SESSION_CACHE
+        jwks_url = jwks_url if jwks_url is not None else SUPABASE_JWKS_URL
+        self._jwks = jwt.PyJWKClient(jwks_url, lifespan=JWKS_CACHE_SECONDS) if jwks_url else None
+        self._sessions = OrderedDict()  # token -> claims
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Baixa as chaves do JWKS na inicialização, fora do caminho das mensagens."""
+        if self._jwks is not None:
+            try:
+                self._jwks.get_signing_keys()
+            except jwt.PyJWKClientError as e:
+                print(f"Não foi possível carregar o JWKS ({e}); apenas tokens HS256 serão aceitos por enquanto.")
+
+    def _decode(self, token):
+        algorithm = jwt.get_unverified_header(token).get("alg")
+        if algorithm == "HS256":
+            if not self.secret:
+                raise InvalidToken("token HS256 recebido mas SUPABASE_JWT_SECRET não está configurado")
+            key, algorithms = self.secret, ["HS256"]
+        elif algorithm in ASYMMETRIC_ALGORITHMS and self._jwks is not None:
+            key, algorithms = self._jwks.get_signing_key_from_jwt(token).key, [algorithm]
+        else:
+            raise InvalidToken(f"algoritmo não suportado: {algorithm}")
+        return jwt.decode(token, key, algorithms=algorithms, audience=self.audience)
+
+    def verify(self, token, now=None):
+        """Devolve as claims do token ou levanta `InvalidToken`."""
+        if not token:
+            raise InvalidToken("token ausente")
+        now = now or time.time()
+        with self._lock:
+            claims = self._sessions.get(token)
+            if claims is not None:
+                if claims.get("exp", 0) > now:
+                    self._sessions.move_to_end(token)
+                    metrics.AUTH_CHECKS.labels(resultado="cache").inc()
+                    return claims
+                del self._sessions[token]
+
+        try:
+            claims = self._decode(token)
+        except (jwt.PyJWTError, InvalidToken) as e:
+            metrics.AUTH_CHECKS.labels(resultado="rejeitado").inc()
+            raise InvalidToken(str(e)) from e
+
+        metrics.AUTH_CHECKS.labels(resultado="verificado").inc()
+        with self._lock:
+            self._sessions[token] = claims
+            if len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+        return claims
+
+    def authorize(self, req):
+        """
+        Autoriza uma requisição pelo `access_token` do corpo. Devolve as
+        claims (None quando não há token e AUTH_REQUIRED está desligado).
+        """
+        token = req.get("access_token")
+        if not token and not AUTH_REQUIRED:
+            return None
+        return self.verify(token)
+
+    async def authorize_async(self, req):
+        """
+        `authorize` para handlers asyncio. O PyJWKClient busca o JWKS com
+        urllib (bloqueante) quando o cache vence ou aparece um `kid`
+        desconhecido: um token assimétrico fora do cache de sessões é
+        verificado numa thread, sem parar o loop de eventos.
+        """
+        token = req.get("access_token")
+        if not token and not AUTH_REQUIRED:
+            return None
+        if self._may_fetch_jwks(token):
+            return await asyncio.to_thread(self.verify, token)
+        return self.verify(token)
+
+    def _may_fetch_jwks(self, token):
+        if self._jwks is None or not token:
+            return False
+        with self._lock:
+            if token in self._sessions:
+                return False
+        try:
+            return jwt.get_unverified_header(token).get("alg") in ASYMMETRIC_ALGORITHMS
+        except jwt.PyJWTError:
+            # Token malformado: `verify` rejeita sem acessar a rede
+            return False
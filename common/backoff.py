@@ -0,0 +1,19 @@
+import os
+import random
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Espera entre tentativas de reconexão ao broker (segundos)
+RECONNECT_BASE_DELAY = float(os.getenv("RECONNECT_BASE_DELAY", "0.5"))
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", "30"))
+
+
+def delay(tentativa):
+    """
+    Backoff exponencial com jitter: entre metade e o total de
+    base * 2^(tentativa-1), limitado a RECONNECT_MAX_DELAY. O jitter evita
+    que todos os serviços reconectem no mesmo instante depois de uma queda.
+    """
+    teto = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (tentativa - 1))
+    return random.uniform(teto / 2, teto)
@@ -0,0 +1,47 @@
+import os
+import json
+from dotenv import load_dotenv
+
+try:
+    import msgpack
+except ImportError:
+    # Sem msgpack instalado tudo continua em JSON
+    msgpack = None
+
+load_dotenv()
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+# Formato dos eventos entre serviços: msgpack (padrão) ou json.
+# Respostas aos clientes seguem sempre o formato da requisição.
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "msgpack")
+INTERNAL = MSGPACK if MESSAGE_CODEC == "msgpack" and msgpack is not None else JSON
+
+
+def detect(body):
+    """
+    Identifica o formato pelo primeiro byte. Mensagens vindas do MQTT 3.1.1
+    não têm content_type: um objeto msgpack começa com 0x80-0x8f, 0xde ou
+    0xdf, nunca com '{' ou espaço como o JSON.
+    """
+    if body and (0x80 <= body[0] <= 0x8f or body[0] in (0xde, 0xdf)):
+        return MSGPACK
+    return JSON
+
+
+def loads(body, content_type=None):
+    """Decodifica o corpo e devolve (dados, formato) para responder no mesmo formato."""
+    if content_type not in (JSON, MSGPACK):
+        content_type = detect(body)
+    if content_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("mensagem msgpack recebida mas o pacote msgpack não está instalado")
+        return msgpack.unpackb(body), MSGPACK
+    return json.loads(body), JSON
+
+
+def dumps(data, content_type=JSON):
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(data)
+    return json.dumps(data).encode()
@@ -0,0 +1,163 @@
+import os
+import time
+import functools
+import pika
+from pika.exceptions import AMQPConnectionError, AMQPChannelError
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import metrics
+import backoff
+from runtime_base import RABBITMQ_HOST, RABBITMQ_USER, RABBITMQ_PASS, RABBITMQ_HEARTBEAT
+from runtime_base import handling, publish_headers, observe_publish
+
+load_dotenv()
+
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "16"))
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", "0")) or CONSUMER_PREFETCH
+
+
+def connection_parameters():
+    return pika.ConnectionParameters(
+        host=RABBITMQ_HOST,
+        credentials=pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS),
+        heartbeat=RABBITMQ_HEARTBEAT,
+        blocked_connection_timeout=RABBITMQ_HEARTBEAT * 2,
+        # As novas tentativas (com jitter) ficam por conta do ConsumerRuntime
+        connection_attempts=1,
+    )
+
+
+class ThreadSafeChannel:
+    """
+    Fachada do canal pika para uso nas threads de trabalho.
+
+    O BlockingConnection não é thread-safe: ack, nack e publish são agendados
+    na thread da conexão via `add_callback_threadsafe`.
+
+    Cada conexão tem a sua fachada. Se a conexão cair com uma mensagem em
+    processamento, o ack/publish é descartado e o broker entrega a mensagem
+    de novo na próxima conexão.
+    """
+    def __init__(self, connection, channel):
+        self._connection = connection
+        self._channel = channel
+
+    def _schedule(self, fn, *args, **kwargs):
+        try:
+            self._connection.add_callback_threadsafe(functools.partial(fn, *args, **kwargs))
+        except AMQPConnectionError:
+            print(f"Conexão encerrada; {getattr(fn, '__name__', 'operação')} descartado (a mensagem será reentregue).")
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._schedule(self._channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._schedule(self._channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        # Os headers de trace são lidos aqui, na thread de trabalho que tem o span
+        headers = publish_headers(properties.headers if properties else None)
+        if headers:
+            properties = properties or pika.BasicProperties()
+            properties.headers = headers
+
+        def publish():
+            start = time.perf_counter()
+            self._channel.basic_publish(
+                exchange=exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties,
+                mandatory=mandatory,
+            )
+            observe_publish(routing_key, time.perf_counter() - start)
+        self._schedule(publish)
+
+
+class ConsumerRuntime:
+    """
+    Executa os callbacks dos consumidores num pool de threads.
+
+    A thread da conexão apenas recebe as mensagens (limitadas pelo prefetch)
+    e as entrega ao pool; os callbacks recebem um `ThreadSafeChannel` no
+    lugar do canal, mantendo a assinatura (ch, method, properties, body).
+
+    A conexão só é aberta em `start()`, com heartbeat. Se o broker cair, a
+    conexão é refeita com backoff exponencial com jitter: `topology(channel)`
+    declara filas e bindings de novo e os consumidores registrados com
+    `consume` voltam a consumir, sem reiniciar o processo.
+    """
+    def __init__(self, topology=None, prefetch=None, workers=None):
+        self.topology = topology
+        self.prefetch = prefetch or CONSUMER_PREFETCH
+        self.workers = workers or max(CONSUMER_WORKERS, 1)
+        self.connection = None
+        self.channel = None
+        self._channel = None
+        self._consumers = []
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body, properties=properties)
+
+    def consume(self, queue, callback):
+        self._consumers.append((queue, callback))
+        if self._channel is not None:
+            self._basic_consume(queue, callback)
+
+    def _basic_consume(self, queue, callback):
+        channel = self.channel
+
+        def dispatch(ch, method, properties, body):
+            self._executor.submit(self._run, channel, callback, method, properties, body)
+        self._channel.basic_consume(queue=queue, on_message_callback=dispatch)
+
+    def _connect(self):
+        self.connection = pika.BlockingConnection(connection_parameters())
+        self._channel = self.connection.channel()
+        self._channel.basic_qos(prefetch_count=self.prefetch)
+        if self.topology:
+            self.topology(self._channel)
+        self.channel = ThreadSafeChannel(self.connection, self._channel)
+        for queue, callback in self._consumers:
+            self._basic_consume(queue, callback)
+
+    def _run(self, channel, callback, method, properties, body):
+        handler = callback.__name__
+        with handling(handler, method.routing_key, properties.headers, properties.correlation_id):
+            try:
+                callback(channel, method, properties, body)
+            except Exception as e:
+                # Devolve à fila uma única vez; se falhar de novo, descarta
+                print(f"ERRO não tratado em {handler}: {e}")
+                metrics.count_error(handler)
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=not method.redelivered)
+
+    def start(self):
+        metrics.start_metrics_server()
+        print(f"Runtime de consumo: prefetch={self.prefetch}, workers={self.workers}")
+        tentativa = 0
+        try:
+            while True:
+                try:
+                    self._connect()
+                    tentativa = 0
+                    self._channel.start_consuming()
+                    return
+                except (AMQPConnectionError, AMQPChannelError) as e:
+                    tentativa += 1
+                    espera = backoff.delay(tentativa)
+                    metrics.RECONNECTS.inc()
+                    print(f"Conexão com o RabbitMQ indisponível ({e!r}); nova tentativa em {espera:.1f}s.")
+                    self._close()
+                    time.sleep(espera)
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _close(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except AMQPConnectionError:
+            pass
+        self._channel = None
@@ -0,0 +1,31 @@
+import os
+import time
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# Tolerância para diferenças de relógio entre cliente e servidores
+DEADLINE_GRACE_MS = int(os.getenv("DEADLINE_GRACE_MS", "1000"))
+
+
+def expired(deadline, now=None):
+    """`deadline` é o instante (epoch em segundos) em que o cliente para de esperar."""
+    if not deadline:
+        return False
+    now = now or time.time()
+    return now > float(deadline) + DEADLINE_GRACE_MS / 1000
+
+
+def remaining(deadline, now=None):
+    """Segundos restantes até o deadline (None quando não há deadline)."""
+    if not deadline:
+        return None
+    now = now or time.time()
+    return max(float(deadline) + DEADLINE_GRACE_MS / 1000 - now, 0.001)
+
+
+def shed(handler, correlation_id):
+    """Registra uma requisição descartada por ter passado do deadline."""
+    metrics.EXPIRED.labels(handler=handler).inc()
+    print(f"Requisição {correlation_id} expirada; descartada por {handler} sem acessar o banco.")
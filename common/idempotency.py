@@ -0,0 +1,57 @@
+import os
+import asyncio
+from collections import OrderedDict
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+
+class IdempotencyCache:
+    """
+    Resultado já calculado por chave (correlation_id, order_id...), em LRU.
+
+    `run(chave, fn)` executa `fn()` uma única vez por chave: pedidos
+    repetidos recebem o mesmo resultado sem novo acesso ao banco, e um
+    repetido que chega enquanto o original ainda está em andamento espera o
+    mesmo future. Falhas não ficam em cache, para que a próxima tentativa
+    execute de novo. O limite do processo é coberto pela chave única no banco.
+
+    O mesmo objeto é devolvido a todos os pedidos: não altere o resultado.
+    """
+    def __init__(self, handler, max_size=None):
+        self.handler = handler
+        self.max_size = max_size or IDEMPOTENCY_CACHE_SIZE
+        self._entries = OrderedDict()  # chave -> future
+
+    async def run(self, key, fn):
+        if key is None:
+            return await fn()
+
+        future = self._entries.get(key)
+        if future is not None:
+            self._entries.move_to_end(key)
+            metrics.DUPLICATES.labels(handler=self.handler).inc()
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._entries.pop(key, None)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._entries.pop(key, None)
+            # Os repetidos em espera recebem a mesma exceção; marca como lida
+            # para não gerar aviso quando não há nenhum
+            future.set_exception(e)
+            future.exception()
+            raise
+        future.set_result(result)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return result
@@ -0,0 +1,88 @@
+import os
+import time
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Porta interna do container (mapeada para 8000-8005 no docker-compose.yml)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+MESSAGES = Counter(
+    "estaciona_mensagens_total", "Mensagens recebidas por routing key", ["routing_key"]
+)
+HANDLER_LATENCY = Histogram(
+    "estaciona_handler_segundos", "Tempo de processamento de cada mensagem", ["handler"]
+)
+IN_FLIGHT = Gauge(
+    "estaciona_mensagens_em_processamento", "Mensagens sendo processadas no momento", ["handler"]
+)
+ERRORS = Counter(
+    "estaciona_erros_total", "Mensagens que terminaram em erro", ["handler"]
+)
+EXPIRED = Counter(
+    "estaciona_expiradas_total", "Requisições descartadas por terem passado do deadline", ["handler"]
+)
+DB_LATENCY = Histogram(
+    "estaciona_banco_segundos", "Tempo das chamadas ao banco (Supabase/Postgres/SQLite)", ["operacao"]
+)
+AUTH_CHECKS = Counter(
+    "estaciona_autenticacao_total", "Verificações de token (cache, verificado ou rejeitado)", ["resultado"]
+)
+PUBLISH_LATENCY = Histogram(
+    "estaciona_publicacao_segundos", "Tempo das publicações no broker (incluindo o confirm)", ["routing_key"]
+)
+
+DUPLICATES = Counter(
+    "estaciona_duplicadas_total", "Requisições repetidas atendidas sem novo acesso ao banco", ["handler"]
+)
+RETRIES = Counter(
+    "estaciona_reprocessamentos_total", "Mensagens com falha enviadas para retry ou para a DLQ", ["handler", "destino"]
+)
+SWEPT = Counter(
+    "estaciona_varredura_creditos_total", "Créditos arquivados e avisos de expiração publicados pela varredura", ["tipo"]
+)
+NOTIFICATIONS = Counter(
+    "estaciona_notificacoes_total", "Multas e lotes do serviço de notificação (enviada, duplicada, lote, falha_envio)",
+    ["resultado"]
+)
+OUTBOX = Counter(
+    "estaciona_outbox_total", "Eventos da outbox (publicado pelo pedido, reenviado pelo relay)", ["resultado"]
+)
+RECONNECTS = Counter(
+    "estaciona_reconexoes_total", "Tentativas de reconexão ao RabbitMQ"
+)
+
+_server_started = False
+
+
+def start_metrics_server():
+    """Sobe o endpoint /metrics uma única vez por processo."""
+    global _server_started
+    if not _server_started:
+        start_http_server(METRICS_PORT)
+        _server_started = True
+        print(f"Métricas disponíveis em :{METRICS_PORT}/metrics")
+
+
+def routing_key_label(routing_key):
+    """Reduz a routing key aos dois primeiros segmentos (sem placa, id de cliente etc.)."""
+    return ".".join((routing_key or "").split(".")[:2])
+
+
+def count_error(handler):
+    ERRORS.labels(handler=handler).inc()
+
+
+class timed_db:
+    """Context manager que mede uma chamada ao banco: `with timed_db("operacao"): ...`"""
+    def __init__(self, operacao):
+        self.operacao = operacao
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        DB_LATENCY.labels(operacao=self.operacao).observe(time.perf_counter() - self.start)
+        return False
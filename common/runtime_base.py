@@ -0,0 +1,55 @@
+import os
+import time
+from dotenv import load_dotenv
+import metrics
+import tracing
+
+load_dotenv()
+
+# Partes comuns aos dois runtimes de consumo (async_runtime e
+# consumer_runtime): configuração do broker, instrumentação de cada
+# mensagem e das publicações. Os runtimes cuidam só do transporte.
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS")
+# Intervalo de heartbeat (segundos): conexões mortas são detectadas em ~2x esse tempo
+RABBITMQ_HEARTBEAT = int(os.getenv("RABBITMQ_HEARTBEAT", "30"))
+
+
+class handling:
+    """
+    Métricas e span de trace de uma mensagem recebida:
+    `with handling(handler, routing_key, headers, correlation_id): ...`
+    """
+    def __init__(self, handler, routing_key, headers=None, correlation_id=None):
+        self.handler = handler
+        self.routing_key = routing_key
+        self.headers = headers
+        self.correlation_id = correlation_id
+
+    def __enter__(self):
+        metrics.MESSAGES.labels(routing_key=metrics.routing_key_label(self.routing_key)).inc()
+        metrics.IN_FLIGHT.labels(handler=self.handler).inc()
+        self.span = tracing.begin(self.handler, self.headers, self.correlation_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.HANDLER_LATENCY.labels(handler=self.handler).observe(time.perf_counter() - self.start)
+        metrics.IN_FLIGHT.labels(handler=self.handler).dec()
+        tracing.finish(self.span)
+        return False
+
+
+def publish_headers(headers=None):
+    """Headers da publicação mais os de trace, quando há um trace ativo."""
+    trace_headers = tracing.publish_headers()
+    if not trace_headers:
+        return headers
+    return {**(headers or {}), **trace_headers}
+
+
+def observe_publish(routing_key, elapsed):
+    metrics.PUBLISH_LATENCY.labels(routing_key=metrics.routing_key_label(routing_key)).observe(elapsed)
+    tracing.record_publish(elapsed)
@@ -0,0 +1,42 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Partições consumidas por esta réplica: SHARD_INDEX explícito (lista
+# separada por vírgula) ou derivadas do número da réplica, com
+# REPLICA_INDEX (0..REPLICA_COUNT-1) e REPLICA_COUNT
+SHARD_INDEX = os.getenv("SHARD_INDEX", "")
+REPLICA_INDEX = os.getenv("REPLICA_INDEX", "")
+REPLICA_COUNT = os.getenv("REPLICA_COUNT", "")
+
+
+def assigned(shards, shard_index=None, replica_index=None, replica_count=None):
+    """
+    Partições (de 0 a shards-1) que esta réplica consome. Com REPLICA_*,
+    a réplica r de n fica com as partições p em que p % n == r.
+
+    Sem nenhuma das duas configurações levanta ValueError: consumir todas
+    por padrão faria cada réplica nova ler todas as partições e a mesma
+    placa voltaria a ser tratada por mais de uma réplica.
+    """
+    shard_index = SHARD_INDEX if shard_index is None else shard_index
+    replica_index = REPLICA_INDEX if replica_index is None else replica_index
+    replica_count = REPLICA_COUNT if replica_count is None else replica_count
+
+    if shard_index.strip():
+        minhas = {int(i) for i in shard_index.split(",") if i.strip()}
+    elif replica_index.strip() and replica_count.strip():
+        indice, total = int(replica_index), int(replica_count)
+        if not 0 <= indice < total:
+            raise ValueError(f"REPLICA_INDEX={indice} fora de 0..{total - 1}")
+        minhas = {p for p in range(shards) if p % total == indice}
+    else:
+        raise ValueError(
+            f"QUEUE_SHARDS={shards} exige SHARD_INDEX ou REPLICA_INDEX/REPLICA_COUNT nesta réplica"
+        )
+
+    fora = sorted(p for p in minhas if not 0 <= p < shards)
+    if fora:
+        raise ValueError(f"SHARD_INDEX com partições inexistentes: {fora} (QUEUE_SHARDS={shards})")
+    return minhas
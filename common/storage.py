@@ -0,0 +1,585 @@
+import os
+import abc
+import json
+import uuid
+import asyncio
+import sqlite3
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+import metrics
+import tracing
+
+load_dotenv()
+
+# supabase (PostgREST), postgres (conexão direta com pool) ou sqlite (execução local)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+
+TARIFF_COLUMNS = "zona, dia_semana, hora_inicio, hora_fim, valor_por_hora"
+
+
+class Storage(abc.ABC):
+    """
+    Camada de acesso a dados compartilhada pelos serviços.
+
+    Datas são trocadas como strings ISO 8601 em UTC, no mesmo formato que o
+    PostgREST devolve, independente do backend.
+    """
+
+    @abc.abstractmethod
+    async def active_credits(self, placas=None):
+        """Créditos não expirados ({placa, zona, expira_em}); todos, ou só os das placas informadas."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def record_payments(self, items):
+        """
+        Grava pagamentos e os eventos de saída (outbox) na mesma transação.
+        Cada item é {pagamento, routing_key, evento}; o order_id entra no
+        evento gravado. Devolve {order_id, correlation_id, outbox_id} na
+        ordem dos itens. Um pagamento repetido (correlation_id) não é
+        inserido de novo nem gera evento: volta o order_id original com
+        `outbox_id` nulo.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def claim_outbox(self, limite, atraso_segundos, reserva_segundos):
+        """
+        Reserva por `reserva_segundos` até `limite` eventos gravados há mais
+        de `atraso_segundos` e ainda não apagados ({id, routing_key,
+        payload, correlation_id}).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete_outbox(self, ids):
+        """Apaga eventos já publicados."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def extend_credit(self, placa, horas, pagamento_id, zona=None, origem="app"):
+        """
+        Estende o crédito ativo ou cria um novo. Devolve {nova_expiracao,
+        estendido, duplicado}; com `duplicado` o pagamento já tinha sido
+        creditado e nada foi alterado.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def archive_expired(self, limite):
+        """Move até `limite` créditos vencidos para o arquivo. Devolve quantos foram movidos."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def claim_expiring(self, janela_segundos, limite):
+        """
+        Créditos ({placa, zona, expira_em}) que vencem dentro da janela e
+        ainda não foram avisados; ficam marcados como avisados.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def unclaim_expiring(self, creditos):
+        """
+        Desfaz a marca de `claim_expiring` nos créditos cujo aviso não foi
+        publicado: voltam na próxima rodada (se a expiração não mudou).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def tariffs(self):
+        """
+        Tabela de tarifas ({zona, dia_semana, hora_inicio, hora_fim,
+        valor_por_hora}); `zona` e `dia_semana` nulos valem para todos.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _iso(value):
+    """Data em UTC com microssegundos: strings nesse formato se comparam na ordem cronológica."""
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _utc(value):
+    # Função `utc()` registrada no SQLite para normalizar datas já gravadas
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return _iso(parsed)
+
+
+def _jsonable(row):
+    """Converte tipos do driver (UUID, datetime, Decimal) para o formato do PostgREST."""
+    converted = {}
+    for key, value in dict(row).items():
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, uuid.UUID):
+            value = str(value)
+        elif isinstance(value, Decimal):
+            value = float(value)
+        converted[key] = value
+    return converted
+
+
+class SupabaseStorage(Storage):
+    def __init__(self, client, page_size=1000):
+        self.client = client
+        self.page_size = page_size
+
+    @classmethod
+    async def connect(cls):
+        from supabase import acreate_client
+        client = await acreate_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+        return cls(client)
+
+    async def active_credits(self, placas=None):
+        now = _now().isoformat()
+        rows = []
+        inicio = 0
+        # O PostgREST limita o tamanho da resposta: pagina pelo id
+        while True:
+            query = self.client.table("creditos").select("placa, zona, expira_em").gte("expira_em", now)
+            if placas is not None:
+                query = query.in_("placa", list(placas))
+            page = (await query.order("id").range(inicio, inicio + self.page_size - 1).execute()).data
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+            inicio += self.page_size
+
+    async def extend_credit(self, placa, horas, pagamento_id, zona=None, origem="app"):
+        res = await self.client.rpc("estender_credito", {
+            "p_placa": placa,
+            "p_horas": horas,
+            "p_pagamento_id": pagamento_id,
+            "p_zona": zona,
+            "p_origem": origem,
+        }).execute()
+        return res.data[0]
+
+    async def archive_expired(self, limite):
+        res = await self.client.rpc("arquivar_creditos", {"p_limite": limite}).execute()
+        return res.data
+
+    async def claim_expiring(self, janela_segundos, limite):
+        res = await self.client.rpc("creditos_expirando", {
+            "p_janela_segundos": janela_segundos,
+            "p_limite": limite,
+        }).execute()
+        return res.data
+
+    async def unclaim_expiring(self, creditos):
+        await self.client.rpc("desmarcar_avisos", {"p_creditos": creditos}).execute()
+
+    async def tariffs(self):
+        res = await self.client.table("tarifas").select(TARIFF_COLUMNS).execute()
+        return res.data
+
+    async def record_payments(self, items):
+        res = await self.client.rpc("registrar_pagamentos", {"p_itens": items}).execute()
+        # Uma linha por item, na ordem dos itens
+        return res.data
+
+    async def claim_outbox(self, limite, atraso_segundos, reserva_segundos):
+        res = await self.client.rpc("reservar_outbox", {
+            "p_limite": limite,
+            "p_atraso_segundos": atraso_segundos,
+            "p_reserva_segundos": reserva_segundos,
+        }).execute()
+        return res.data
+
+    async def delete_outbox(self, ids):
+        await self.client.table("outbox").delete().in_("id", list(ids)).execute()
+
+
+class PostgresStorage(Storage):
+    """Acesso direto ao Postgres por um pool asyncpg, sem o HTTP/JSON do PostgREST."""
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def connect(cls):
+        import asyncpg
+        pool = await asyncpg.create_pool(
+            os.getenv("DATABASE_URL"),
+            min_size=int(os.getenv("DATABASE_POOL_MIN", "2")),
+            max_size=int(os.getenv("DATABASE_POOL_MAX", "10")),
+            # Poolers em modo transação (pgbouncer/supavisor) exigem 0
+            statement_cache_size=int(os.getenv("DATABASE_STATEMENT_CACHE", "100")),
+        )
+        return cls(pool)
+
+    async def active_credits(self, placas=None):
+        if placas is None:
+            rows = await self.pool.fetch(
+                "select placa, zona, expira_em from creditos where expira_em >= now()"
+            )
+        else:
+            rows = await self.pool.fetch(
+                "select placa, zona, expira_em from creditos where placa = any($1::text[]) and expira_em >= now()",
+                list(placas),
+            )
+        return [_jsonable(row) for row in rows]
+
+    async def extend_credit(self, placa, horas, pagamento_id, zona=None, origem="app"):
+        row = await self.pool.fetchrow(
+            "select nova_expiracao, estendido, duplicado from estender_credito($1, $2, $3, $4, $5)",
+            placa, horas, pagamento_id, zona, origem,
+        )
+        return _jsonable(row)
+
+    async def archive_expired(self, limite):
+        return await self.pool.fetchval("select arquivar_creditos($1)", limite)
+
+    async def claim_expiring(self, janela_segundos, limite):
+        rows = await self.pool.fetch("select * from creditos_expirando($1, $2)", janela_segundos, limite)
+        return [_jsonable(row) for row in rows]
+
+    async def unclaim_expiring(self, creditos):
+        await self.pool.execute("select desmarcar_avisos($1::jsonb)", json.dumps(creditos))
+
+    async def tariffs(self):
+        rows = await self.pool.fetch(f"select {TARIFF_COLUMNS} from tarifas")
+        return [_jsonable(row) for row in rows]
+
+    async def record_payments(self, items):
+        rows = await self.pool.fetch("select * from registrar_pagamentos($1::jsonb)", json.dumps(items))
+        return [_jsonable(row) for row in rows]
+
+    async def claim_outbox(self, limite, atraso_segundos, reserva_segundos):
+        rows = await self.pool.fetch(
+            "select * from reservar_outbox($1, $2, $3)", limite, atraso_segundos, reserva_segundos
+        )
+        # O asyncpg devolve jsonb como texto
+        return [{**_jsonable(row), "payload": json.loads(row["payload"])} for row in rows]
+
+    async def delete_outbox(self, ids):
+        await self.pool.execute("delete from outbox where id = any($1::bigint[])", list(ids))
+
+    async def close(self):
+        await self.pool.close()
+
+
+class SqliteStorage(Storage):
+    """
+    Backend em arquivo para rodar e medir os serviços localmente. O sqlite3
+    é bloqueante: as chamadas rodam numa thread própria, uma de cada vez
+    (a conexão é única), fora do loop de eventos. Vários processos podem
+    compartilhar o mesmo arquivo.
+
+    As datas são gravadas em UTC com microssegundos, para que a comparação
+    das strings ISO siga a ordem cronológica.
+    """
+    SCHEMA = """
+        create table if not exists pagamentos (
+            order_id      text primary key,
+            placa         text not null,
+            duracao_horas integer,
+            valor         real,
+            criado_em     text,
+            correlation_id text,
+            creditado_em  text
+        );
+        create table if not exists creditos (
+            id           integer primary key autoincrement,
+            placa        text not null,
+            pagamento_id text,
+            zona         text,
+            comprado_em  text,
+            expira_em    text not null,
+            origem       text,
+            avisado_para text
+        );
+        create index if not exists creditos_placa_expira_em_idx on creditos (placa, expira_em);
+        create index if not exists creditos_expira_em_idx on creditos (expira_em);
+        create table if not exists creditos_arquivo (
+            id           integer primary key,
+            placa        text not null,
+            pagamento_id text,
+            zona         text,
+            comprado_em  text,
+            expira_em    text not null,
+            origem       text,
+            avisado_para text,
+            arquivado_em text
+        );
+        create table if not exists tarifas (
+            id             integer primary key autoincrement,
+            zona           text,
+            dia_semana     integer,
+            hora_inicio    integer not null default 0,
+            hora_fim       integer not null default 24,
+            valor_por_hora real not null,
+            atualizado_em  text
+        );
+        create table if not exists outbox (
+            id             integer primary key autoincrement,
+            routing_key    text not null,
+            payload        text not null,
+            correlation_id text,
+            criado_em      text not null,
+            reservado_ate  text,
+            tentativas     integer not null default 0
+        );
+        create index if not exists outbox_criado_em_idx on outbox (criado_em);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function("utc", 1, _utc, deterministic=True)
+        self.conn.execute("pragma journal_mode=wal")
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Arquivos criados antes da idempotência não têm as colunas novas
+        colunas = {row["name"] for row in self.conn.execute("pragma table_info(pagamentos)")}
+        for coluna in ("correlation_id", "creditado_em"):
+            if coluna not in colunas:
+                self.conn.execute(f"alter table pagamentos add column {coluna} text")
+        if "avisado_para" not in {row["name"] for row in self.conn.execute("pragma table_info(creditos)")}:
+            self.conn.execute("alter table creditos add column avisado_para text")
+        self.conn.execute(
+            "create unique index if not exists pagamentos_correlation_id_key on pagamentos (correlation_id)"
+        )
+        # Datas gravadas com outro offset (ou sem microssegundos) não se
+        # comparam como texto: reescreve em UTC
+        self.conn.execute(
+            "update creditos set expira_em = utc(expira_em), avisado_para = utc(avisado_para) "
+            "where expira_em <> utc(expira_em) or avisado_para <> utc(avisado_para)"
+        )
+        self.conn.execute(
+            "update outbox set criado_em = utc(criado_em), reservado_ate = utc(reservado_ate) "
+            "where criado_em <> utc(criado_em) or reservado_ate <> utc(reservado_ate)"
+        )
+
+    @classmethod
+    async def connect(cls):
+        storage = cls(os.getenv("SQLITE_PATH", "estaciona.db"))
+        await storage._run(storage._open)
+        return storage
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def _transaction(self, fn, *args):
+        # "begin immediate" segura o lock de escrita: mesma garantia do advisory lock no Postgres
+        self.conn.execute("begin immediate")
+        try:
+            result = fn(*args)
+            self.conn.execute("commit")
+        except Exception:
+            self.conn.execute("rollback")
+            raise
+        return result
+
+    async def active_credits(self, placas=None):
+        return await self._run(self._active_credits, placas)
+
+    def _active_credits(self, placas):
+        now = _iso(_now())
+        if placas is None:
+            rows = self.conn.execute(
+                "select placa, zona, expira_em from creditos where expira_em >= ?", (now,)
+            ).fetchall()
+        else:
+            placas = list(placas)
+            marks = ", ".join("?" for _ in placas)
+            rows = self.conn.execute(
+                f"select placa, zona, expira_em from creditos where placa in ({marks}) and expira_em >= ?",
+                (*placas, now),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    async def extend_credit(self, placa, horas, pagamento_id, zona=None, origem="app"):
+        # Mesma validação da função estender_credito: horas nulas zerariam a expiração
+        if not isinstance(horas, int) or horas <= 0:
+            raise ValueError(f"horas deve ser positivo (recebido {horas!r})")
+        return await self._run(self._transaction, self._extend_credit, placa, horas, pagamento_id, zona, origem)
+
+    def _extend_credit(self, placa, horas, pagamento_id, zona, origem):
+        now = _now()
+        creditado = pagamento_id is not None and self.conn.execute(
+            "select 1 from pagamentos where order_id = ? and creditado_em is not null", (pagamento_id,)
+        ).fetchone()
+        if creditado:
+            # O crédito pode já ter vencido e ido para o arquivo
+            atual = self.conn.execute(
+                "select coalesce((select max(expira_em) from creditos where placa = ?),"
+                " (select max(expira_em) from creditos_arquivo where placa = ?)) as expira_em",
+                (placa, placa),
+            ).fetchone()
+            return {"nova_expiracao": atual["expira_em"], "estendido": True, "duplicado": True}
+
+        ativo = self.conn.execute(
+            "select id, expira_em from creditos where placa = ? and expira_em >= ? order by expira_em desc limit 1",
+            (placa, _iso(now)),
+        ).fetchone()
+        if ativo:
+            nova = datetime.fromisoformat(ativo["expira_em"]) + timedelta(hours=horas)
+            self.conn.execute(
+                "update creditos set expira_em = ?, pagamento_id = ? where id = ?",
+                (_iso(nova), pagamento_id, ativo["id"]),
+            )
+        else:
+            nova = now + timedelta(hours=horas)
+            self.conn.execute(
+                "insert into creditos (placa, pagamento_id, zona, comprado_em, expira_em, origem) values (?, ?, ?, ?, ?, ?)",
+                (placa, pagamento_id, zona, _iso(now), _iso(nova), origem),
+            )
+        self.conn.execute(
+            "update pagamentos set creditado_em = ? where order_id = ?", (_iso(now), pagamento_id)
+        )
+        return {"nova_expiracao": _iso(nova), "estendido": ativo is not None, "duplicado": False}
+
+    async def archive_expired(self, limite):
+        return await self._run(self._transaction, self._archive_expired, limite)
+
+    def _archive_expired(self, limite):
+        now = _iso(_now())
+        colunas = "id, placa, pagamento_id, zona, comprado_em, expira_em, origem, avisado_para"
+        ids = [row["id"] for row in self.conn.execute(
+            "select id from creditos where expira_em < ? order by expira_em limit ?", (now, limite)
+        )]
+        if ids:
+            marks = ", ".join("?" for _ in ids)
+            self.conn.execute(
+                f"insert into creditos_arquivo ({colunas}, arquivado_em) "
+                f"select {colunas}, ? from creditos where id in ({marks})",
+                (now, *ids),
+            )
+            self.conn.execute(f"delete from creditos where id in ({marks})", ids)
+        return len(ids)
+
+    async def claim_expiring(self, janela_segundos, limite):
+        return await self._run(self._transaction, self._claim_expiring, janela_segundos, limite)
+
+    def _claim_expiring(self, janela_segundos, limite):
+        now = _now()
+        rows = self.conn.execute(
+            "select id, placa, zona, expira_em from creditos "
+            "where expira_em >= ? and expira_em < ? and (avisado_para is null or avisado_para <> expira_em) "
+            "order by expira_em limit ?",
+            (_iso(now), _iso(now + timedelta(seconds=janela_segundos)), limite),
+        ).fetchall()
+        self.conn.executemany(
+            "update creditos set avisado_para = expira_em where id = ?", [(row["id"],) for row in rows]
+        )
+        return [{"placa": row["placa"], "zona": row["zona"], "expira_em": row["expira_em"]} for row in rows]
+
+    async def unclaim_expiring(self, creditos):
+        return await self._run(self._transaction, self._unclaim_expiring, creditos)
+
+    def _unclaim_expiring(self, creditos):
+        self.conn.executemany(
+            "update creditos set avisado_para = null where placa = ? and expira_em = ? and avisado_para = expira_em",
+            [(credito["placa"], credito["expira_em"]) for credito in creditos],
+        )
+
+    async def tariffs(self):
+        return await self._run(self._tariffs)
+
+    def _tariffs(self):
+        return [dict(row) for row in self.conn.execute(f"select {TARIFF_COLUMNS} from tarifas")]
+
+    async def record_payments(self, items):
+        return await self._run(self._transaction, self._record_payments, items)
+
+    def _record_payments(self, items):
+        results = []
+        for item in items:
+            row = {"order_id": str(uuid.uuid4()), "criado_em": _iso(_now()), **item["pagamento"]}
+            columns = list(row)
+            inserido = self.conn.execute(
+                f"insert or ignore into pagamentos ({', '.join(columns)}) values ({', '.join('?' for _ in columns)})",
+                [row[column] for column in columns],
+            ).rowcount == 1
+            order_id = self.conn.execute(
+                "select order_id from pagamentos where correlation_id = ?", (row["correlation_id"],)
+            ).fetchone()["order_id"]
+            outbox_id = None
+            if inserido:
+                outbox_id = self.conn.execute(
+                    "insert into outbox (routing_key, payload, correlation_id, criado_em) values (?, ?, ?, ?)",
+                    (item["routing_key"], json.dumps({**item["evento"], "order_id": order_id}),
+                     row["correlation_id"], _iso(_now())),
+                ).lastrowid
+            results.append({"order_id": order_id, "correlation_id": row["correlation_id"], "outbox_id": outbox_id})
+        return results
+
+    async def claim_outbox(self, limite, atraso_segundos, reserva_segundos):
+        return await self._run(self._transaction, self._claim_outbox, limite, atraso_segundos, reserva_segundos)
+
+    def _claim_outbox(self, limite, atraso_segundos, reserva_segundos):
+        now = _now()
+        rows = self.conn.execute(
+            "select id, routing_key, payload, correlation_id from outbox "
+            "where criado_em < ? and (reservado_ate is null or reservado_ate < ?) order by criado_em limit ?",
+            (_iso(now - timedelta(seconds=atraso_segundos)), _iso(now), limite),
+        ).fetchall()
+        self.conn.executemany(
+            "update outbox set reservado_ate = ?, tentativas = tentativas + 1 where id = ?",
+            [(_iso(now + timedelta(seconds=reserva_segundos)), row["id"]) for row in rows],
+        )
+        return [{**dict(row), "payload": json.loads(row["payload"])} for row in rows]
+
+    async def delete_outbox(self, ids):
+        await self._run(self._delete_outbox, list(ids))
+
+    def _delete_outbox(self, ids):
+        marks = ", ".join("?" for _ in ids)
+        self.conn.execute(f"delete from outbox where id in ({marks})", ids)
+
+    async def close(self):
+        if self.conn is not None:
+            await self._run(self.conn.close)
+        self._executor.shutdown(wait=False)
+
+
+class InstrumentedStorage:
+    """Mede o tempo de cada chamada do backend (histograma de banco e span do trace)."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+
+        async def timed(*args, **kwargs):
+            with metrics.timed_db(name), tracing.db_time():
+                return await method(*args, **kwargs)
+        return timed
+
+
+BACKENDS = {
+    "supabase": SupabaseStorage,
+    "postgres": PostgresStorage,
+    "sqlite": SqliteStorage,
+}
+
+
+async def open_storage(backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"STORAGE_BACKEND inválido: {backend}. Opções: {', '.join(BACKENDS)}")
+    storage = await BACKENDS[backend].connect()
+    print(f"Armazenamento: {backend}")
+    return InstrumentedStorage(storage)
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import contextvars
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVICE_NAME = os.getenv("SERVICE_NAME", "servico")
+# Arquivo JSON Lines onde cada hop grava o próprio span (vazio = não grava)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_HEADER = "x-trace"
+
+_current = contextvars.ContextVar("trace_span", default=None)
+# Spans a gravar no TRACE_FILE: a escrita fica numa thread própria, fora do
+# loop de eventos e das threads de trabalho
+_pending = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        value = value.decode()
+    try:
+        return json.loads(value) if value else []
+    except ValueError:
+        return []
+
+
+def begin(handler, headers=None, correlation_id=None):
+    """
+    Abre o span deste hop para a mensagem recebida. Os spans dos hops
+    anteriores chegam no header `x-trace` e seguem adiante nas publicações;
+    sem o header o trace só é propagado depois de `activate()`.
+    """
+    anteriores = (headers or {}).get(TRACE_HEADER)
+    span = {
+        "servico": SERVICE_NAME,
+        "handler": handler,
+        "correlation_id": correlation_id,
+        "recebido": time.time(),
+        "banco_ms": 0.0,
+        "publicado": None,
+        "publicacao_ms": 0.0,
+        "_anteriores": _decode(anteriores),
+        "_ativo": anteriores is not None,
+        "_banco_ativo": False,
+    }
+    span["_token"] = _current.set(span)
+    return span
+
+
+def activate():
+    """Propaga o trace a partir deste hop (o cliente pediu `trace`)."""
+    span = _current.get()
+    if span is not None:
+        span["_ativo"] = True
+
+
+def current():
+    return _current.get()
+
+
+class db_time:
+    """Soma o tempo gasto no banco ao span atual (chamadas aninhadas contam uma vez)."""
+    def __enter__(self):
+        self.span = _current.get()
+        self.outer = self.span is not None and not self.span["_banco_ativo"]
+        if self.outer:
+            self.span["_banco_ativo"] = True
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.outer:
+            self.span["banco_ms"] += (time.perf_counter() - self.start) * 1000
+            self.span["_banco_ativo"] = False
+        return False
+
+
+def _public(span):
+    return {k: v for k, v in span.items() if not k.startswith("_")}
+
+
+def chain(span=None):
+    """Spans dos hops anteriores mais o atual, marcando a hora de publicação."""
+    span = span or _current.get()
+    if span is None:
+        return []
+    if span["publicado"] is None:
+        span["publicado"] = time.time()
+    return span["_anteriores"] + [_public(span)]
+
+
+def publish_headers():
+    """Headers para uma publicação feita dentro de um hop com trace ativo."""
+    span = _current.get()
+    if span is None or not span["_ativo"]:
+        return None
+    return {TRACE_HEADER: json.dumps(chain(span))}
+
+
+def record_publish(elapsed):
+    span = _current.get()
+    if span is not None:
+        span["publicacao_ms"] += elapsed * 1000
+
+
+def finish(span):
+    if span is None:
+        return
+    token = span.pop("_token", None)
+    if token is not None:
+        _current.reset(token)
+    if TRACE_FILE:
+        _start_writer()
+        _pending.put(json.dumps(_public(span)))
+
+
+def _start_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="trace-writer", daemon=True)
+            _writer.start()
+            atexit.register(_stop_writer)
+
+
+def _write_loop():
+    with open(TRACE_FILE, "a") as f:
+        while True:
+            lines = [_pending.get()]
+            # Junta numa escrita só o que acumulou enquanto o arquivo era gravado
+            while True:
+                try:
+                    lines.append(_pending.get_nowait())
+                except queue.Empty:
+                    break
+            fim = None in lines
+            f.writelines(line + "\n" for line in lines if line is not None)
+            f.flush()
+            if fim:
+                return
+
+
+def _stop_writer():
+    # Grava os spans pendentes antes de o processo sair
+    _pending.put(None)
+    _writer.join(timeout=5)
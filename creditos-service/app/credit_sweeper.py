@@ -0,0 +1,73 @@
+import time
+import asyncio
+import metrics
+
+
+class CreditSweeper:
+    """
+    Job periódico que mantém a tabela `creditos` só com créditos ativos.
+
+    A cada `interval` segundos move os vencidos para `creditos_arquivo` em
+    lotes de `batch_size` (no máximo `max_batches` por rodada, com
+    `batch_pause` segundos entre lotes para não disputar o banco com as
+    compras) e publica um evento por crédito que vence nos próximos
+    `warn_window` segundos; os que falham voltam na rodada seguinte.
+    """
+    def __init__(self, storage, publish_expiring, interval=60, batch_size=1000, max_batches=10,
+                 batch_pause=0.05, warn_window=600):
+        self.storage = storage
+        self.publish_expiring = publish_expiring
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.batch_pause = batch_pause
+        self.warn_window = warn_window
+        self._task = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"🧹 ERRO na varredura de créditos: {e}")
+                metrics.count_error("credit_sweeper")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self):
+        """Uma rodada: arquiva vencidos e avisa os que estão para vencer."""
+        start = time.perf_counter()
+        arquivados = 0
+        for _ in range(self.max_batches):
+            movidos = await self.storage.archive_expired(self.batch_size)
+            arquivados += movidos
+            if movidos < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause)
+        metrics.SWEPT.labels(tipo="arquivado").inc(arquivados)
+
+        avisos = 0
+        if self.warn_window > 0:
+            falhas = []
+            for credito in await self.storage.claim_expiring(self.warn_window, self.batch_size):
+                try:
+                    await self.publish_expiring(credito)
+                except Exception as e:
+                    print(f"🧹 ERRO ao avisar a expiração da placa {credito['placa']}: {e}")
+                    metrics.count_error("credit_sweeper")
+                    falhas.append(credito)
+                    continue
+                avisos += 1
+            metrics.SWEPT.labels(tipo="aviso_expiracao").inc(avisos)
+            # Já marcados como avisados: sem desmarcar, o aviso se perderia
+            if falhas:
+                await self.storage.unclaim_expiring(falhas)
+
+        elapsed = time.perf_counter() - start
+        if arquivados or avisos:
+            print(f"🧹 Varredura: {arquivados} créditos arquivados, {avisos} avisos de expiração em {elapsed:.2f}s")
+        return {"arquivados": arquivados, "avisos": avisos, "segundos": elapsed}
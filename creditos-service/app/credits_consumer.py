@@ -1,100 +1,231 @@
 import os
-import json
-import pika
-from supabase_client import supabase
-from datetime import datetime, timedelta, timezone
+import asyncio
+from storage import open_storage
+from async_runtime import AsyncConsumerRuntime, last_attempt
+from idempotency import IdempotencyCache
+from credit_sweeper import CreditSweeper
+from occupancy import OccupancyTracker, save_snapshot
+import metrics
+import tracing
+import deadlines
+import codec
 from dotenv import load_dotenv
 
 load_dotenv()
-env = os.environ
 
-TOPIC_EXCHANGE = 'amq.topic'
 ROUTING_KEY_CREDITOS = 'credito.confirmacao.#'
 QUEUE_NAME = 'queue_credito'
+ROUTING_KEY_EXPIRANDO = 'credito.expirando'
+ROUTING_KEY_ATIVADO = 'credito.ativado'
+ROUTING_KEY_OCUPACAO = 'ocupacao.consulta.#'
+QUEUE_OCUPACAO = 'queue_ocupacao'
 
-# Configuração do RabbitMQ
-credentials = pika.PlainCredentials(env["RABBITMQ_USER"], env["RABBITMQ_PASS"])
-connection = pika.BlockingConnection(
-    pika.ConnectionParameters(host=env["RABBITMQ_HOST"], credentials=credentials)
-)
-channel = connection.channel()
+# Varredura de créditos vencidos (SWEEP_INTERVAL_S=0 desliga)
+SWEEP_INTERVAL_S = float(os.getenv("SWEEP_INTERVAL_S", "60"))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "1000"))
+SWEEP_MAX_BATCHES = int(os.getenv("SWEEP_MAX_BATCHES", "10"))
+SWEEP_BATCH_PAUSE_MS = int(os.getenv("SWEEP_BATCH_PAUSE_MS", "50"))
+# Antecedência (segundos) do evento credito.expirando.<placa> (0 desliga)
+EXPIRING_WARN_S = int(os.getenv("EXPIRING_WARN_S", "600"))
+# Ocupação por zona: snapshot em disco para reiniciar sem reler a tabela
+OCUPACAO_SNAPSHOT_PATH = os.getenv("OCUPACAO_SNAPSHOT_PATH", "/tmp/ocupacao.json")
+OCUPACAO_SNAPSHOT_S = float(os.getenv("OCUPACAO_SNAPSHOT_S", "30"))
+OCUPACAO_SNAPSHOT_MAX_AGE_S = float(os.getenv("OCUPACAO_SNAPSHOT_MAX_AGE_S", "120"))
 
+runtime = AsyncConsumerRuntime()
+storage = None
+sweeper = None
+snapshot_task = None
+reload_task = None
+# order_id -> resposta já calculada: eventos repetidos não voltam ao banco
+applied = IdempotencyCache("on_purchase")
+occupancy = OccupancyTracker()
 
-channel.queue_declare(queue=QUEUE_NAME, durable=True)
-channel.queue_bind(
-    exchange=TOPIC_EXCHANGE,
-    queue=QUEUE_NAME,
-    routing_key=ROUTING_KEY_CREDITOS
-)
+# Função de processamento de compra de crédito: estende ou cria o crédito
+# numa única chamada atômica (função `estender_credito` no Postgres).
+# Erros do banco sobem para o runtime, que agenda uma nova tentativa.
+async def process_purchase(data):
+    placa = data["placa"]
+    horas = data.get("duracao_horas") or 1
+    order_id = data.get("order_id")
 
-# Função de processamento de compra de crédito
-def process_purchase(data):
-    try:
-        placa = data["placa"]
-        horas = data.get("duracao_horas", 1)
-        order_id = data.get("order_id")
-        now_utc = datetime.now(timezone.utc)
-
-        res = supabase.table("creditos").select("*").eq("placa", placa).gte("expira_em", now_utc.isoformat()).execute()
-        active_credit = res.data[0] if res.data else None
-
-        message = ""
-        if active_credit:
-            print(f"🪙 Crédito ativo encontrado para a placa {placa}. Adicionando tempo.")
-            expira_em_atual = datetime.fromisoformat(active_credit["expira_em"])
-            nova_expiracao = expira_em_atual + timedelta(hours=horas)
-            
-            supabase.table("creditos").update({
-                "expira_em": nova_expiracao.isoformat(),
-                "pagamento_id": order_id
-            }).eq("id", active_credit["id"]).execute()
-            message = f"Tempo de crédito estendido com sucesso até {nova_expiracao.isoformat()}."
-        else:
-            print(f"🪙 Nenhum crédito ativo para a placa {placa}. Criando novo crédito.")
-            comprado_em = now_utc.isoformat()
-            expira_em = (now_utc + timedelta(hours=horas)).isoformat()
-
-            record = {
-                "placa": placa,
-                "pagamento_id": order_id,
-                "zona": data.get("zona"),
-                "comprado_em": comprado_em,
-                "expira_em": expira_em,
-                "origem": data.get("origem", "app"),
-            }
-            supabase.table("creditos").insert(record).execute()
-            message = f"Credito comprado com sucesso, valido ate {expira_em}."
-        
-        # Retorna um dicionário de sucesso
-        return {"success": True, "message": message, "order_id": order_id}
+    credito = await storage.extend_credit(
+        placa, horas, order_id, zona=data.get("zona"), origem=data.get("origem", "app")
+    )
+    nova_expiracao = credito["nova_expiracao"]
+    # Também no repetido: se a publicação falhou na tentativa anterior, é refeita aqui.
+    # Repetido sem expiração conhecida (crédito fora das duas tabelas): nada a ativar
+    if nova_expiracao is not None:
+        await publish_activated(placa, data.get("zona"), nova_expiracao)
 
-    except Exception as e:
-        print(f"🪙 ERRO no processamento de crédito: {str(e)}")
-        # Retorna um dicionário de erro
-        return {"success": False, "error": str(e)}
+    if credito.get("duplicado"):
+        print(f"🪙 Pagamento {order_id} já creditado para a placa {placa}. Nada alterado.")
+        message = "Crédito deste pagamento já aplicado."
+        if nova_expiracao is not None:
+            message = f"Crédito deste pagamento já aplicado, valido ate {nova_expiracao}."
+    elif credito["estendido"]:
+        print(f"🪙 Crédito ativo encontrado para a placa {placa}. Tempo adicionado.")
+        message = f"Tempo de crédito estendido com sucesso até {nova_expiracao}."
+    else:
+        print(f"🪙 Nenhum crédito ativo para a placa {placa}. Novo crédito criado.")
+        message = f"Credito comprado com sucesso, valido ate {nova_expiracao}."
+
+    # Retorna um dicionário de sucesso
+    return {"success": True, "message": message, "order_id": order_id, "expira_em": nova_expiracao}
+
+async def send_reply(msg, corr_id, response_payload):
+    reply_to = msg.get("reply_to")
+    deadline = msg.get("deadline")
+    if not reply_to:
+        return
+    if deadlines.expired(deadline):
+        print(f"🪙 Cliente não espera mais a resposta de {corr_id}; resposta omitida.")
+        return
+    response_payload = {**response_payload, "correlation_id": corr_id}
+    if msg.get("trace"):
+        response_payload["_trace"] = tracing.chain()
+    print(f"🪙 Enviando resposta final para a fila '{reply_to}'")
+    formato = msg.get("formato_resposta", codec.JSON)
+    await runtime.publish(
+        reply_to, codec.dumps(response_payload, formato), correlation_id=corr_id,
+        expiration=deadlines.remaining(deadline), content_type=formato
+    )
 
 # Callback para compra
-def on_purchase(ch, method, props, body):
-    msg = json.loads(body)
+async def on_purchase(message):
+    msg, _ = codec.loads(message.body, message.content_type)
+    corr_id = message.correlation_id or msg.get("correlation_id")
     print("🪙 Processando evento de crédito:", msg)
-    
-    response_payload = process_purchase(msg)
-    reply_to = msg.get("reply_to")
-    corr_id = props.correlation_id or req.get("correlation_id")
 
-    if reply_to:
-        response_payload["correlation_id"] = corr_id
-        print(f"🪙 Enviando resposta final para a fila '{reply_to}'")
-        ch.basic_publish(
-            exchange=TOPIC_EXCHANGE,
-            routing_key=reply_to,
-            properties=pika.BasicProperties(correlation_id=corr_id),
-            body=json.dumps(response_payload)
-        )
+    # O pagamento já foi gravado: o crédito é aplicado mesmo depois do
+    # deadline (só a resposta deixa de ser enviada) e nunca é descartado;
+    # falhas do banco voltam pela fila de retry e, por fim, ficam na DLQ
+    try:
+        response_payload = await applied.run(msg.get("order_id"), lambda: process_purchase(msg))
+    except Exception as e:
+        print(f"🪙 ERRO no processamento de crédito: {str(e)}")
+        if last_attempt(message):
+            await send_reply(msg, corr_id, {
+                "success": False,
+                "error": "Pagamento registrado; o crédito será aplicado assim que o serviço se recuperar.",
+                "order_id": msg.get("order_id"),
+            })
+        raise
+
+    await send_reply(msg, corr_id, response_payload)
 
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+# Aviso "crédito expirando" (ex.: para o app lembrar o motorista de renovar)
+async def publish_expiring(credito):
+    await runtime.publish(
+        f"{ROUTING_KEY_EXPIRANDO}.{credito['placa']}", codec.dumps(credito, codec.INTERNAL),
+        persistent=True, content_type=codec.INTERNAL
+    )
+
+# Evento para a ocupação: todas as réplicas recebem (a fila de compras é particionada)
+async def publish_activated(placa, zona, expira_em):
+    event = {"placa": placa, "zona": zona, "expira_em": expira_em}
+    await runtime.publish(
+        f"{ROUTING_KEY_ATIVADO}.{placa}", codec.dumps(event, codec.INTERNAL),
+        persistent=True, content_type=codec.INTERNAL
+    )
+
+# Callback de crédito ativado: mantém a ocupação atualizada
+async def on_credit_activated(message):
+    try:
+        event, _ = codec.loads(message.body, message.content_type)
+        occupancy.apply(event["placa"], event.get("zona"), event["expira_em"])
+    except Exception as e:
+        print(f"🪙 ERRO ao atualizar ocupação: {str(e)}")
+        metrics.count_error("on_credit_activated")
+
+# Callback da consulta de ocupação (painéis da prefeitura)
+async def on_occupancy_query(message):
+    try:
+        req, formato = codec.loads(message.body, message.content_type)
+        reply_to = (req.get("reply_to") or "").replace('/', '.')
+        corr_id  = message.correlation_id or req.get("correlation_id")
+        deadline = req.get("deadline")
+
+        if deadlines.expired(deadline):
+            deadlines.shed("on_occupancy_query", corr_id)
+            return
+
+        zonas = occupancy.counts()
+        if req.get("zona") is not None:
+            zonas = {req["zona"]: zonas.get(req["zona"], 0)}
+        result = {"status": True, "zonas": zonas, "total": sum(zonas.values()), "correlation_id": corr_id}
+        if req.get("trace"):
+            result["_trace"] = tracing.chain()
+
+        if reply_to:
+            await runtime.publish(
+                reply_to, codec.dumps(result, formato), correlation_id=corr_id,
+                expiration=deadlines.remaining(deadline), content_type=formato
+            )
+    except Exception as e:
+        print(f"🪙 ERRO na consulta de ocupação: {str(e)}")
+        metrics.count_error("on_occupancy_query")
+
+# Varre a tabela (ao subir e após reconexão); os eventos consumidos durante
+# a leitura são reaplicados por cima
+async def load_occupancy():
+    occupancy.begin_reload()
+    try:
+        total = occupancy.load(await storage.active_credits())
+    except Exception as e:
+        occupancy.cancel_reload()
+        print(f"🪙 ERRO ao carregar ocupação: {e}")
+        metrics.count_error("load_occupancy")
+        return
+    print(f"🪙 Ocupação carregada do banco com {total} créditos ativos.")
+
+async def save_occupancy_loop():
+    while True:
+        await asyncio.sleep(OCUPACAO_SNAPSHOT_S)
+        try:
+            occupancy.expire()
+            # A cópia é feita no loop; só a escrita do arquivo vai para a thread
+            await asyncio.to_thread(save_snapshot, OCUPACAO_SNAPSHOT_PATH, occupancy.snapshot())
+        except Exception as e:
+            print(f"🪙 ERRO ao gravar snapshot de ocupação: {e}")
+            metrics.count_error("save_occupancy")
+
+async def main():
+    global storage, sweeper, snapshot_task, reload_task
+    storage = await open_storage()
+    await runtime.connect()
+
+    # Fila exclusiva desta instância: recebe a ativação de créditos de todas as partições
+    activated_queue = await runtime.declare_queue('', [f"{ROUTING_KEY_ATIVADO}.#"])
+    total = occupancy.restore(OCUPACAO_SNAPSHOT_PATH, OCUPACAO_SNAPSHOT_MAX_AGE_S)
+    # A fila exclusiva perde os eventos emitidos enquanto a conexão estava caída
+    runtime.on_reconnect(load_occupancy)
+    await runtime.consume(activated_queue, on_credit_activated)
+    # O snapshot não tem as compras feitas com o serviço fora do ar: responde
+    # com ele enquanto a tabela é lida de novo, em segundo plano
+    if total is None:
+        await load_occupancy()
+    else:
+        print(f"🪙 Ocupação restaurada do snapshot com {total} créditos ativos; conferindo com o banco.")
+        reload_task = asyncio.create_task(load_occupancy())
+    if OCUPACAO_SNAPSHOT_S > 0:
+        snapshot_task = asyncio.create_task(save_occupancy_loop())
+
+    # Várias réplicas podem varrer ao mesmo tempo: cada lote trava só as próprias linhas
+    sweeper = CreditSweeper(
+        storage, publish_expiring, interval=SWEEP_INTERVAL_S, batch_size=SWEEP_BATCH_SIZE,
+        max_batches=SWEEP_MAX_BATCHES, batch_pause=SWEEP_BATCH_PAUSE_MS / 1000, warn_window=EXPIRING_WARN_S,
+    )
+    sweeper.start()
+
+    for queue in await runtime.declare_sharded_queue(QUEUE_NAME, [ROUTING_KEY_CREDITOS]):
+        await runtime.consume(queue, on_purchase)
+    # Qualquer réplica responde: todas têm a ocupação completa
+    ocupacao_queue = await runtime.declare_queue(QUEUE_OCUPACAO, [ROUTING_KEY_OCUPACAO], retries=False)
+    await runtime.consume(ocupacao_queue, on_occupancy_query)
 
-def start_consuming():
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=on_purchase)
     print("🪙 Credit Service rodando. Aguardando mensagens...")
-    channel.start_consuming()
+    await runtime.run_forever()
+
+def start_consuming():
+    asyncio.run(main())
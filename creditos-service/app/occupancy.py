@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import heapq
+from datetime import datetime
+
+# Créditos comprados sem zona (chaves do msgpack precisam ser texto)
+SEM_ZONA = "sem_zona"
+
+
+def _timestamp(expira_em):
+    if isinstance(expira_em, (int, float)):
+        return float(expira_em)
+    return datetime.fromisoformat(expira_em).timestamp()
+
+
+class OccupancyTracker:
+    """
+    Quantidade de veículos com crédito ativo por zona, mantida em memória.
+
+    Cada crédito ativado (compra ou extensão) atualiza a contagem da zona;
+    as expirações saem de um min-heap ordenado por `expira_em`, então ler a
+    ocupação custa só retirar do heap o que já venceu, sem varrer a tabela.
+    Extensões deixam a entrada antiga do heap para trás: ela é ignorada ao
+    sair por não bater mais com a expiração atual da placa.
+
+    Como em `estender_credito`, a extensão de um crédito ativo mantém a
+    zona em que ele foi comprado, e a expiração de uma placa nunca recua:
+    `apply` é idempotente e aceita eventos repetidos ou fora de ordem.
+    """
+    def __init__(self):
+        self._active = {}  # placa -> (zona, expira_em em epoch)
+        self._heap = []    # (expira_em, placa)
+        self._counts = {}  # zona -> veículos
+        self._pending = None  # eventos recebidos durante uma recarga
+
+    def apply(self, placa, zona, expira_em, now=None):
+        if self._pending is not None:
+            self._pending.append((placa, zona, expira_em))
+        zona = zona or SEM_ZONA
+        expira = _timestamp(expira_em)
+        now = now or time.time()
+        if expira <= now:
+            return
+        atual = self._active.get(placa)
+        if atual is not None and atual[1] > now:
+            if expira <= atual[1]:
+                return
+            zona = atual[0]
+        if atual is not None:
+            self._counts[atual[0]] -= 1
+        self._active[placa] = (zona, expira)
+        self._counts[zona] = self._counts.get(zona, 0) + 1
+        heapq.heappush(self._heap, (expira, placa))
+
+    def expire(self, now=None):
+        now = now or time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expira, placa = heapq.heappop(self._heap)
+            atual = self._active.get(placa)
+            if atual is not None and atual[1] == expira:
+                del self._active[placa]
+                self._counts[atual[0]] -= 1
+
+    def counts(self, now=None):
+        self.expire(now)
+        return {zona: total for zona, total in self._counts.items() if total > 0}
+
+    def begin_reload(self):
+        """
+        Guarda os eventos aplicados até o próximo `load`, que os reaplica
+        sobre as linhas lidas: o que chega enquanto a tabela é lida não se perde.
+        """
+        self._pending = []
+
+    def cancel_reload(self):
+        self._pending = None
+
+    def load(self, rows, now=None):
+        """Reconstrói o estado a partir de créditos ({placa, zona, expira_em})."""
+        pending, self._pending = self._pending or [], None
+        self._active, self._heap, self._counts = {}, [], {}
+        for row in rows:
+            self.apply(row["placa"], row.get("zona"), row["expira_em"], now)
+        for placa, zona, expira_em in pending:
+            self.apply(placa, zona, expira_em, now)
+        return len(self._active)
+
+    def snapshot(self):
+        return {
+            "gerado_em": time.time(),
+            "creditos": [[placa, zona, expira] for placa, (zona, expira) in self._active.items()],
+        }
+
+    def restore(self, path, max_age):
+        """Carrega o snapshot se existir e tiver menos de `max_age` segundos. Devolve o total ou None."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - data.get("gerado_em", 0) > max_age:
+            return None
+        return self.load({"placa": p, "zona": z, "expira_em": e} for p, z, e in data["creditos"])
+
+
+def save_snapshot(path, snapshot):
+    # Grava num arquivo temporário e troca: um snapshot pela metade nunca é lido
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
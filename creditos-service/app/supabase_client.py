@@ -1,9 +0,0 @@
-from supabase import create_client, Client
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
@@ -0,0 +1,70 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class CreditIndex:
+    """
+    Índice local placa -> expira_em dos créditos ativos.
+
+    Entradas positivas valem por `ttl` segundos; placas sem crédito ficam em
+    cache negativo por `negative_ttl` segundos. Passado esse tempo a consulta
+    volta ao banco.
+    """
+    def __init__(self, ttl=300, negative_ttl=30):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}  # placa -> (expira_em | None, valido_ate)
+        self._lock = threading.Lock()
+
+    def get(self, placa, now=None):
+        """Retorna (hit, expira_em). expira_em None num hit significa cache negativo."""
+        now = now or datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._entries.get(placa)
+            if entry is None:
+                return False, None
+            expira_em, valido_ate = entry
+            if valido_ate < time.monotonic() or (expira_em is not None and expira_em < now):
+                del self._entries[placa]
+                return False, None
+            return True, expira_em
+
+    def put(self, placa, expira_em):
+        with self._lock:
+            self._entries[placa] = (expira_em, time.monotonic() + self.ttl)
+
+    def put_missing(self, placa):
+        with self._lock:
+            self._entries[placa] = (None, time.monotonic() + self.negative_ttl)
+
+    def apply(self, placa, expira_em):
+        """
+        Aplica a expiração já gravada pelo creditos-service (evento
+        credito.ativado). O valor é absoluto e nunca recua: o mesmo evento
+        entregue de novo, ou fora de ordem, não muda a entrada.
+        """
+        with self._lock:
+            entry = self._entries.get(placa)
+            atual = entry[0] if entry else None
+            if atual is not None and atual >= expira_em:
+                return atual
+            self._entries[placa] = (expira_em, time.monotonic() + self.ttl)
+            return expira_em
+
+    def load(self, rows):
+        """Carrega linhas {placa, expira_em} vindas do banco, mantendo a maior expiração por placa."""
+        maiores = {}
+        for row in rows:
+            expira_em = datetime.fromisoformat(row["expira_em"])
+            placa = row["placa"]
+            if placa not in maiores or expira_em > maiores[placa]:
+                maiores[placa] = expira_em
+        valido_ate = time.monotonic() + self.ttl
+        with self._lock:
+            for placa, expira_em in maiores.items():
+                self._entries[placa] = (expira_em, valido_ate)
+        return len(maiores)
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,51 +1,74 @@
 import os
-import json
-import pika
-from supabase_client import supabase
+import asyncio
+from storage import open_storage
+from credit_index import CreditIndex
+from async_runtime import AsyncConsumerRuntime, RetryLater, last_attempt, original_routing_key
+from auth_tokens import TokenVerifier, InvalidToken
+import metrics
+import tracing
+import deadlines
+import codec
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 
 load_dotenv()
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS")
-
-TOPIC_EXCHANGE = 'amq.topic'
 ROUTING_KEY_FISCALIZACAO = 'fiscalizacao.consulta.#'
+ROUTING_KEY_LOTE = 'fiscalizacao.lote.#'
+ROUTING_KEY_LOTE_PREFIX = 'fiscalizacao.lote'
+# Emitido pelo creditos-service depois de gravar o crédito (expiração absoluta)
+ROUTING_KEY_CREDITOS = 'credito.ativado.#'
 QUEUE_NAME = 'queue_fiscalizacao'
 
-# Conexão com RabbitMQ
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-connection  = pika.BlockingConnection(
-    pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-)
-channel = connection.channel()
-
-# Declaração da fila de fiscalização
-channel.queue_declare(queue=QUEUE_NAME, durable=True)
-channel.queue_bind(
-    exchange=TOPIC_EXCHANGE,
-    queue=QUEUE_NAME,
-    routing_key=ROUTING_KEY_FISCALIZACAO
-)
+# Índice local de créditos ativos (segundos)
+CACHE_TTL = int(os.getenv("FISCALIZACAO_CACHE_TTL", "300"))
+CACHE_NEGATIVE_TTL = int(os.getenv("FISCALIZACAO_CACHE_NEGATIVE_TTL", "30"))
 
-# Lógica de negócio: verifica créditos válidos
-def check_plate(req):
-    placa = req.get("placa")
-    now   = datetime.now(timezone.utc).isoformat()
+credit_index = CreditIndex(ttl=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL)
 
+runtime = AsyncConsumerRuntime()
+verifier = TokenVerifier()
+storage = None
+
+# Carrega todos os créditos ativos de uma vez
+async def warm_index():
     try:
-        credits = supabase.table("creditos")\
-            .select("*")\
-            .eq("placa", placa)\
-            .gte("expira_em", now)\
-            .execute().data
+        total = credit_index.load(await storage.active_credits())
     except Exception as e:
-        print(f"🔍 ERRO ao consultar Supabase: {e}")
-        return {"status": False, "mensagem": "Erro interno ao consultar crédito."}
+        print(f"🔍 ERRO ao carregar índice de créditos: {e}")
+        return
+    print(f"🔍 Índice de créditos carregado com {total} placas ativas.")
+
+# Resolve várias placas de uma vez: índice local primeiro, depois uma única
+# consulta ao banco para as placas que faltarem
+async def resolve_plates(placas):
+    now = datetime.now(timezone.utc)
+    resolvidas = {}
+    faltantes = []
+    for placa in placas:
+        hit, expira_em = credit_index.get(placa, now)
+        if hit:
+            resolvidas[placa] = expira_em
+        else:
+            faltantes.append(placa)
 
-    if not credits:
+    if faltantes:
+        credits = await storage.active_credits(faltantes)
+        credit_index.load(credits)
+        for credit in credits:
+            expira_em = datetime.fromisoformat(credit["expira_em"])
+            atual = resolvidas.get(credit["placa"])
+            if atual is None or expira_em > atual:
+                resolvidas[credit["placa"]] = expira_em
+        for placa in faltantes:
+            if placa not in resolvidas:
+                credit_index.put_missing(placa)
+                resolvidas[placa] = None
+
+    return resolvidas
+
+def plate_status(placa, expira_em):
+    if expira_em is None:
         # --- VEÍCULO IRREGULAR ---
         # Apenas prepara uma resposta informando a irregularidade.
         print(f"🔍 Veículo {placa} irregular.")
@@ -53,37 +76,123 @@ def check_plate(req):
             "status": False,
             "mensagem": "Veículo irregular: Sem crédito ativo."
         }
-    
+
     print(f"🔍 Veículo {placa} está regular.")
     return {"status": True, "mensagem": "Veículo regular."}
 
+# Lógica de negócio: verifica créditos válidos
+async def check_plate(req):
+    # Mesmo formato gravado pelo pagamento-service (sem hífen)
+    placa = req.get("placa").replace('-', '')
+
+    try:
+        expira_em = (await resolve_plates([placa]))[placa]
+    except Exception as e:
+        print(f"🔍 ERRO ao consultar o banco: {e}")
+        raise RetryLater(str(e)) from e
+
+    return plate_status(placa, expira_em)
+
+# Verificação em lote (ex.: quarteirão inteiro lido por câmera ALPR)
+async def check_plates(req):
+    placas = [p.replace('-', '') for p in req.get("placas", [])]
+
+    try:
+        resolvidas = await resolve_plates(set(placas))
+    except Exception as e:
+        print(f"🔍 ERRO ao consultar o banco: {e}")
+        raise RetryLater(str(e)) from e
+
+    resultados = []
+    for placa in placas:
+        resultado = plate_status(placa, resolvidas[placa])
+        resultado["placa"] = placa
+        resultados.append(resultado)
+    return {"status": True, "resultados": resultados}
+
+# Token do agente verificado localmente (sem chamada ao Supabase Auth)
+async def authorized(req, corr_id):
+    try:
+        await verifier.authorize_async(req)
+        return True
+    except InvalidToken as e:
+        print(f"🔍 Consulta {corr_id} recusada: {e}")
+        return False
+
 # Callback de consulta de placa
-def on_query(ch, method, properties, body):
+async def on_query(message):
     try:
-        req         = json.loads(body)
+        req, formato = codec.loads(message.body, message.content_type)
         reply_to    = req.get('reply_to').replace('/', '.')
-        corr_id     = properties.correlation_id or req.get("correlation_id")
-        
-        print(f"🔍 Consultando placa={req.get('placa')}")
+        corr_id     = message.correlation_id or req.get("correlation_id")
+        deadline    = req.get("deadline")
 
-        result = check_plate(req)
+        if deadlines.expired(deadline):
+            deadlines.shed("on_query", corr_id)
+            return
+
+        try:
+            if not await authorized(req, corr_id):
+                result = {"status": False, "mensagem": "Não autorizado."}
+            elif original_routing_key(message).startswith(ROUTING_KEY_LOTE_PREFIX):
+                print(f"🔍 Consultando lote de {len(req.get('placas', []))} placas")
+                result = await check_plates(req)
+            else:
+                print(f"🔍 Consultando placa={req.get('placa')}")
+                result = await check_plate(req)
+        except RetryLater:
+            # Banco fora: nova tentativa pela fila de retry; na última, responde o erro
+            if not last_attempt(message):
+                raise
+            result = {"status": False, "mensagem": "Erro interno ao consultar crédito."}
         result['correlation_id'] = corr_id
+        if req.get("trace"):
+            result["_trace"] = tracing.chain()
         
         # Responde ao solicitante original (App do Agente)
         if reply_to:
             print(f"🔍 Respondendo na fila '{reply_to}'")
-            channel.basic_publish(
-                exchange='amq.topic',
-                routing_key=reply_to,
-                properties=pika.BasicProperties(correlation_id=corr_id),
-                body=json.dumps(result)
+            await runtime.publish(
+                reply_to, codec.dumps(result, formato), correlation_id=corr_id,
+                expiration=deadlines.remaining(deadline), content_type=formato
             )
+    except RetryLater:
+        raise
     except Exception as e:
         print(f"🔍 ERRO GERAL: {str(e)}")
-    finally:    
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+        metrics.count_error("on_query")
 
-def start_consuming():
-    channel.basic_consume(queue="queue_fiscalizacao", on_message_callback=on_query)
+# Callback de crédito ativado: mantém o índice atualizado com a expiração
+# gravada no banco (eventos repetidos não estendem o crédito de novo)
+async def on_credit_event(message):
+    try:
+        event, _ = codec.loads(message.body, message.content_type)
+        placa = event.get("placa").replace('-', '')
+        nova_expiracao = credit_index.apply(placa, datetime.fromisoformat(event["expira_em"]))
+        print(f"🔍 Índice atualizado: {placa} válido até {nova_expiracao.isoformat()}")
+    except Exception as e:
+        print(f"🔍 ERRO ao atualizar índice: {str(e)}")
+        metrics.count_error("on_credit_event")
+
+async def main():
+    global storage
+    storage = await open_storage()
+    await runtime.connect()
+
+    # Declaração da fila de fiscalização
+    queues = await runtime.declare_sharded_queue(QUEUE_NAME, [ROUTING_KEY_FISCALIZACAO, ROUTING_KEY_LOTE])
+    # Fila exclusiva desta instância para manter o índice atualizado com as compras
+    credit_events_queue = await runtime.declare_queue('', [ROUTING_KEY_CREDITOS])
+
+    await warm_index()
+    # A fila exclusiva perde os eventos emitidos enquanto a conexão estava caída
+    runtime.on_reconnect(warm_index)
+    await asyncio.to_thread(verifier.warm)
+    await runtime.consume(credit_events_queue, on_credit_event)
+    for queue in queues:
+        await runtime.consume(queue, on_query)
     print("🔍 Serviço de Fiscalização rodando. Aguardando mensagens...")
-    channel.start_consuming()
\ No newline at end of file
+    await runtime.run_forever()
+
+def start_consuming():
+    asyncio.run(main())
@@ -1,6 +0,0 @@
-from supabase import create_client, Client
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
\ No newline at end of file
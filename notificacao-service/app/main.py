@@ -1,4 +1,4 @@
 from notificacao_consumer import start_consuming
 
 if __name__ == '__main__':
-    start_consuming()
\ No newline at end of file
+    start_consuming()
@@ -0,0 +1,90 @@
+import time
+import threading
+from datetime import datetime, timezone
+import metrics
+
+
+class MultaDispatcher:
+    """
+    Agrupa as confirmações de multa antes de acionar a Guarda Municipal.
+
+    Uma placa já notificada nos últimos `dedupe_window` segundos é
+    descartada (vários agentes marcando o mesmo carro). As demais ficam
+    pendentes por área e saem em um lote por área a cada `batch_interval`
+    segundos, ou antes, quando uma área junta `batch_max` multas.
+
+    Cada multa carrega o `ack` da mensagem, chamado só depois que o lote
+    foi entregue ao sink: se o processo cair antes, o broker entrega as
+    mensagens de novo. Se o sink falhar, o lote continua pendente e é
+    reenviado na próxima rodada.
+    """
+    def __init__(self, sink, dedupe_window=600, batch_interval=30, batch_max=100):
+        self.sink = sink
+        self.dedupe_window = dedupe_window
+        self.batch_interval = batch_interval
+        self.batch_max = batch_max
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._recent = {}   # placa -> instante em que foi aceita
+        self._pending = {}  # área -> [(multa, ack)]
+        self._thread = None
+
+    def submit(self, placa, area, multa, ack, now=None):
+        """Enfileira a multa. Devolve False quando é repetida (o chamador confirma a mensagem)."""
+        now = now or time.time()
+        with self._lock:
+            aceita_em = self._recent.get(placa)
+            if aceita_em is not None and now - aceita_em < self.dedupe_window:
+                metrics.NOTIFICATIONS.labels(resultado="duplicada").inc()
+                return False
+            self._recent[placa] = now
+            pendentes = self._pending.setdefault(area, [])
+            pendentes.append((multa, ack))
+            cheio = len(pendentes) >= self.batch_max
+        if cheio:
+            self.flush(area)
+        return True
+
+    def flush(self, area=None):
+        """Envia os lotes pendentes (de uma área ou de todas)."""
+        with self._send_lock:
+            with self._lock:
+                areas = [area] if area is not None else list(self._pending)
+                lotes = {a: self._pending.pop(a) for a in areas if self._pending.get(a)}
+                self._prune(time.time())
+
+            for area, itens in lotes.items():
+                lote = {
+                    "area": area,
+                    "quantidade": len(itens),
+                    "multas": [multa for multa, _ in itens],
+                    "enviado_em": datetime.now(timezone.utc).isoformat(),
+                }
+                try:
+                    self.sink.send(lote)
+                except Exception as e:
+                    print(f"🚨 ERRO ao enviar lote da área {area}: {e}; nova tentativa na próxima rodada.")
+                    metrics.NOTIFICATIONS.labels(resultado="falha_envio").inc()
+                    with self._lock:
+                        self._pending[area] = itens + self._pending.get(area, [])
+                    continue
+                for _, ack in itens:
+                    ack()
+                metrics.NOTIFICATIONS.labels(resultado="lote").inc()
+                metrics.NOTIFICATIONS.labels(resultado="enviada").inc(len(itens))
+
+    def _prune(self, now):
+        vencidas = [placa for placa, aceita_em in self._recent.items() if now - aceita_em >= self.dedupe_window]
+        for placa in vencidas:
+            del self._recent[placa]
+
+    def start(self):
+        def loop():
+            while True:
+                time.sleep(self.batch_interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"🚨 ERRO no envio periódico de lotes: {e}")
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
@@ -1,50 +1,69 @@
 import os
-import json
-import pika
+import functools
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+from consumer_runtime import ConsumerRuntime
+from multa_dispatcher import MultaDispatcher
+from sinks import open_sink
+import codec
 
 load_dotenv()
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS")
-
 TOPIC_EXCHANGE = 'amq.topic'
 ROUTING_KEY_NOTIFICACAO = 'fiscalizacao.multa.#'
+QUEUE_NAME = 'queue_notificacao'
 
-# Conexão com RabbitMQ
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-connection  = pika.BlockingConnection(
-    pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-)
-channel = connection.channel()
-
-# Fila para receber a CONFIRMAÇÃO do agente
-result = channel.queue_declare(queue='', exclusive=True)
-queue_name = result.method.queue
-channel.queue_bind(
-    exchange=TOPIC_EXCHANGE,
-    queue=queue_name,
-    routing_key=ROUTING_KEY_NOTIFICACAO
+# Multas repetidas da mesma placa dentro da janela são descartadas (segundos)
+MULTA_DEDUPE_S = int(os.getenv("MULTA_DEDUPE_S", "600"))
+# Um lote por área a cada N segundos, ou antes ao juntar NOTIFICACAO_BATCH_MAX multas
+NOTIFICACAO_BATCH_S = float(os.getenv("NOTIFICACAO_BATCH_S", "30"))
+NOTIFICACAO_BATCH_MAX = int(os.getenv("NOTIFICACAO_BATCH_MAX", "100"))
+# Destino dos lotes: log, arquivo:<caminho> ou http:<url>
+NOTIFICACAO_SINK = os.getenv("NOTIFICACAO_SINK", "log")
+# As mensagens só são confirmadas depois do envio do lote: o prefetch
+# precisa comportar todas as multas pendentes
+NOTIFICACAO_PREFETCH = int(os.getenv("NOTIFICACAO_PREFETCH", "1000"))
+
+# Fila durável: multas não se perdem entre reinícios (declarada a cada (re)conexão)
+def declare_topology(channel):
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    channel.queue_bind(
+        exchange=TOPIC_EXCHANGE,
+        queue=QUEUE_NAME,
+        routing_key=ROUTING_KEY_NOTIFICACAO
+    )
+
+runtime = ConsumerRuntime(declare_topology, prefetch=NOTIFICACAO_PREFETCH)
+dispatcher = MultaDispatcher(
+    open_sink(NOTIFICACAO_SINK),
+    dedupe_window=MULTA_DEDUPE_S,
+    batch_interval=NOTIFICACAO_BATCH_S,
+    batch_max=NOTIFICACAO_BATCH_MAX,
 )
 
 print('[*] Aguardando CONFIRMAÇÃO de multa do agente. Para sair, pressione CTRL+C')
 
 def on_confirmation_received(ch, method, properties, body):
     """Callback para processar a confirmação de multa vinda do agente."""
-    data = json.loads(body)
-    placa = data.get('placa')
+    data, _ = codec.loads(body, properties.content_type)
+    placa = (data.get('placa') or 'N/A').upper().replace('-', '')
     localizacao = data.get('localizacao', 'N/A')
+    area = data.get('zona') or localizacao
 
-    print(f"\n------ 🚨 CONFIRMAÇÃO DE MULTA RECEBIDA 🚨 ------")
-    print(f"  [>] Placa: {placa}")
-    print(f"  [>] Localização: {localizacao}")
-    print(f"  [>] Acionando Guarda Municipal para emissão de multa...")
-    print(f"--------------------------------------------------")
-    
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    multa = {
+        "placa": placa,
+        "localizacao": localizacao,
+        "recebida_em": datetime.now(timezone.utc).isoformat(),
+    }
+    ack = functools.partial(ch.basic_ack, delivery_tag=method.delivery_tag)
+    if dispatcher.submit(placa, area, multa, ack):
+        print(f"🚨 Multa da placa {placa} aguardando o lote da área '{area}'.")
+    else:
+        print(f"🚨 Multa repetida da placa {placa} descartada.")
+        ack()
 
 def start_consuming():
-    channel.basic_consume(queue=queue_name, on_message_callback=on_confirmation_received)
+    dispatcher.start()
+    runtime.consume(QUEUE_NAME, on_confirmation_received)
     print("🚨 Serviço de Notificação rodando. Aguardando mensagens...")
-    channel.start_consuming()
+    runtime.start()
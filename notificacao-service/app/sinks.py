@@ -0,0 +1,51 @@
+import json
+import threading
+import urllib.request
+
+
+class LogSink:
+    """Imprime o lote no log (comportamento original do serviço)."""
+    def send(self, lote):
+        print(f"\n------ 🚨 LOTE DE MULTAS: {lote['area']} ({lote['quantidade']}) 🚨 ------")
+        for multa in lote["multas"]:
+            print(f"  [>] Placa: {multa['placa']}  Localização: {multa['localizacao']}")
+        print(f"  [>] Acionando Guarda Municipal para emissão de multa...")
+        print(f"--------------------------------------------------")
+
+
+class FileSink:
+    """Acrescenta cada lote como uma linha JSON no arquivo."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, lote):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(lote) + "\n")
+
+
+class HttpSink:
+    """Envia cada lote por POST (JSON) para o despacho da Guarda Municipal."""
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, lote):
+        request = urllib.request.Request(
+            self.url, data=json.dumps(lote).encode(), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def open_sink(spec):
+    """`log`, `arquivo:<caminho>` ou `http:<url>` (ex.: http:http://guarda.local/despacho)."""
+    tipo, _, destino = spec.partition(":")
+    if tipo == "log":
+        return LogSink()
+    if tipo == "arquivo" and destino:
+        return FileSink(destino)
+    if tipo == "http" and destino:
+        return HttpSink(destino)
+    raise ValueError(f"NOTIFICACAO_SINK inválido: {spec}. Opções: log, arquivo:<caminho>, http:<url>")
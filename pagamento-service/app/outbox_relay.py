@@ -0,0 +1,89 @@
+import asyncio
+import metrics
+
+
+class OutboxRelay:
+    """
+    Garante que todo evento gravado na outbox chegue ao broker.
+
+    O caminho normal é o próprio pedido publicar o evento logo após gravar
+    o pagamento e chamar `published(id)` com a confirmação do broker: a
+    linha é apagada na hora, fora do caminho da compra (exclusões que chegam
+    enquanto outra está em andamento vão juntas no delete seguinte).
+
+    A cada `interval` segundos o relay também reserva (em lotes de
+    `batch_size`) as linhas com mais de `grace` segundos, deixadas para trás
+    por um processo que caiu entre o commit e a publicação, publica cada uma
+    com confirmação do broker e só então as apaga. `grace` precisa ser maior
+    que a publicação mais lenta do pedido, senão o relay republica eventos
+    ainda em andamento. Se o relay cair antes de apagar, a reserva de
+    `lease` segundos vence e outra réplica publica: o creditos-service
+    ignora o repetido.
+    """
+    def __init__(self, storage, publish, interval=5, batch_size=100, grace=60, lease=30):
+        self.storage = storage
+        self.publish = publish
+        self.interval = interval
+        self.batch_size = batch_size
+        self.grace = grace
+        self.lease = lease
+        self._pending = []
+        self._deleting = None
+        self._task = None
+
+    def published(self, outbox_id):
+        if outbox_id is None:
+            return
+        metrics.OUTBOX.labels(resultado="publicado").inc()
+        self._pending.append(outbox_id)
+        if self._deleting is None or self._deleting.done():
+            self._deleting = asyncio.create_task(self._delete_published())
+
+    async def _delete_published(self):
+        while self._pending:
+            ids, self._pending = self._pending, []
+            try:
+                await self.storage.delete_outbox(ids)
+            except Exception as e:
+                # As linhas ficam: o relay as publica de novo depois de `grace`
+                print(f"📤 ERRO ao apagar {len(ids)} eventos publicados da outbox: {e}")
+                metrics.count_error("outbox_relay")
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+        return self._task
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"📤 ERRO no relay da outbox: {e}")
+                metrics.count_error("outbox_relay")
+
+    async def drain(self):
+        """Uma rodada: republica as linhas esquecidas e as apaga."""
+        reenviados = 0
+        while True:
+            rows = await self.storage.claim_outbox(self.batch_size, self.grace, self.lease)
+            enviados = []
+            for row in rows:
+                try:
+                    await self.publish(row["routing_key"], row["payload"], row.get("correlation_id"))
+                except Exception as e:
+                    # Fica reservada até a reserva vencer; volta numa rodada seguinte
+                    print(f"📤 ERRO ao publicar evento {row['id']} da outbox: {e}")
+                    continue
+                enviados.append(row["id"])
+            if enviados:
+                await self.storage.delete_outbox(enviados)
+            reenviados += len(enviados)
+            if len(rows) < self.batch_size or not enviados:
+                break
+
+        metrics.OUTBOX.labels(resultado="reenviado").inc(reenviados)
+        if reenviados:
+            print(f"📤 Relay da outbox: {reenviados} eventos pendentes publicados.")
+        return reenviados
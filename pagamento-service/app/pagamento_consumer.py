@@ -1,96 +1,230 @@
 import os
-import json
-import pika
+import hashlib
+import asyncio
 from dotenv import load_dotenv
-from supabase_client import supabase
+from storage import open_storage
+from async_runtime import AsyncConsumerRuntime, PublishError, last_attempt, max_publish_seconds
+from payment_batcher import PaymentBatcher
+from outbox_relay import OutboxRelay
+from idempotency import IdempotencyCache
+from tariff_table import TariffTable
+from auth_tokens import TokenVerifier, InvalidToken
+import metrics
+import tracing
+import deadlines
+import codec
 
 load_dotenv()
 
-RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
-RABBITMQ_USER = os.getenv("RABBITMQ_USER")
-RABBITMQ_PASS = os.getenv("RABBITMQ_PASS")
-
-TOPIC_EXCHANGE = 'amq.topic'
 ROUTING_KEY_PAGAMENTO = 'credito.compra.#'
 ROUTING_KEY_SUCCESS = 'credito.confirmacao.sucesso'
 QUEUE_NAME = 'queue_pagamento'
+# Publicado por quem altera a tabela `tarifas` (ex.: MQTT tarifa/atualizada)
+ROUTING_KEY_TARIFA = 'tarifa.atualizada.#'
+
+# Inserções em lote de até N pagamentos. Sem janela (padrão) nenhum pedido
+# espera: só os que chegam durante uma gravação vão juntos na seguinte.
+# PAGAMENTO_BATCH_WINDOW_MS > 0 liga a espera de até T ms por lote maior;
+# PAGAMENTO_BATCH_SIZE=1 grava um pagamento por vez
+BATCH_SIZE = int(os.getenv("PAGAMENTO_BATCH_SIZE", "50"))
+BATCH_WINDOW_MS = int(os.getenv("PAGAMENTO_BATCH_WINDOW_MS", "0"))
+
+# Tarifas em memória: recarregadas a cada TTL ou no evento de alteração
+TARIFA_TTL_S = float(os.getenv("TARIFA_TTL_S", "300"))
+TARIFA_PADRAO = float(os.getenv("TARIFA_PADRAO", "5.00"))
+TARIFA_TZ = os.getenv("TARIFA_TZ", "America/Sao_Paulo")
+
+# Relay da outbox: eventos que o pedido não chegou a publicar (OUTBOX_RELAY_S=0 desliga)
+OUTBOX_RELAY_S = float(os.getenv("OUTBOX_RELAY_S", "5"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# Maior que o pior caso de publicação (PUBLISH_CONFIRM_TIMEOUT x PUBLISH_MAX_ATTEMPTS)
+OUTBOX_GRACE_S = int(os.getenv("OUTBOX_GRACE_S", "60"))
+OUTBOX_LEASE_S = int(os.getenv("OUTBOX_LEASE_S", "30"))
+
+runtime = AsyncConsumerRuntime()
+verifier = TokenVerifier()
+storage = None
+tariffs = TariffTable(TARIFA_PADRAO, TARIFA_TZ)
+reload_task = None
+relay = None
 
-# Conexão com RabbitMQ
-credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
-connection  = pika.BlockingConnection(
-    pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials)
-)
-channel = connection.channel()
-
-# Declaração de filas
-channel.queue_declare(queue=QUEUE_NAME,     durable=True)
-
-channel.queue_bind(
-    exchange=TOPIC_EXCHANGE,
-    queue=QUEUE_NAME,
-    routing_key=ROUTING_KEY_PAGAMENTO
-)
-
-# Publica eventos
-def send_event(routing_key, payload, correlation_id):
-    channel.basic_publish(
-        exchange=TOPIC_EXCHANGE,
-        routing_key=routing_key,
-        properties=pika.BasicProperties(delivery_mode=2, correlation_id=correlation_id),
-        body=json.dumps(payload)
+# Pagamento e evento de crédito gravados juntos (outbox), em lote
+async def record_payments(items):
+    return await storage.record_payments(items)
+
+# Idempotente: pagamentos repetidos (correlation_id) não são gravados de novo
+batcher = PaymentBatcher(record_payments, max_size=BATCH_SIZE, max_wait=BATCH_WINDOW_MS / 1000, idempotent=True)
+# correlation_id -> pagamento gravado (repetições do cliente e reentregas do broker)
+payments = IdempotencyCache("on_payment_request")
+
+# Publica eventos (persistentes, confirmados pelo broker e com fila de destino obrigatória)
+async def send_event(routing_key, payload, correlation_id):
+    await runtime.publish(
+        routing_key, codec.dumps(payload, codec.INTERNAL), correlation_id=correlation_id,
+        persistent=True, mandatory=True, content_type=codec.INTERNAL
     )
 
 # Callback para pedidos de pagamento
-def on_payment_request(ch, method, properties, body):
-    req         = json.loads(body)
+async def on_payment_request(message):
+    req, formato = codec.loads(message.body, message.content_type)
     reply_to    = req.get('reply_to').replace('/', '.')
     corr_id     = req.get("correlation_id")
     placa       = req.get("placa").replace('-', '')
-    
+    deadline    = req.get("deadline")
+
+    # Ninguém mais espera a resposta: descarta antes de gravar o pagamento
+    if deadlines.expired(deadline):
+        deadlines.shed("on_payment_request", corr_id)
+        return
+
     print(f"🛠️ Processando pagamento para placa {req.get('placa')}")
 
+    # O cliente pediu o trace: o evento ao creditos-service leva o header x-trace
+    if req.get("trace"):
+        tracing.activate()
+
+    # A mesma duração é cobrada e repassada ao creditos-service. Só a
+    # ausência do campo vale 1 hora: 0 e null são recusados, não cobrados
+    horas = req.get("duracao_horas", 1)
+    if not isinstance(horas, int) or isinstance(horas, bool) or horas <= 0:
+        print(f"🛠️ Pagamento {corr_id} recusado: duracao_horas inválida ({horas!r})")
+        if reply_to:
+            await runtime.publish(
+                reply_to, codec.dumps({"success": False, "error": "Duração inválida."}, formato),
+                correlation_id=corr_id, expiration=deadlines.remaining(deadline), content_type=formato
+            )
+        return
+
     try:
-        horas = req.get("duracao_horas", 1)
-        valor_por_hora = 5.00
-        
+        # Verificação local do token (claims em cache): nada de ida ao Supabase Auth por compra
+        await verifier.authorize_async(req)
+
+        # Chave de idempotência: um pagamento por requisição do cliente. Sem
+        # correlation_id usa o corpo da mensagem, que é o mesmo nas novas
+        # tentativas (fila de retry, DLQ): o pagamento não é gravado duas vezes
+        chave = corr_id or message.correlation_id or f"sha256:{hashlib.sha256(message.body).hexdigest()}"
+
         pagamento_record = {
             "placa": placa,
             "duracao_horas": horas,
-            "valor": horas * valor_por_hora,
+            # Tarifa da zona em cada hora comprada, sem acesso ao banco
+            "valor": tariffs.price(req.get("zona"), horas),
+            "correlation_id": chave,
         }
-        
-        res = supabase.table("pagamentos").insert(pagamento_record).execute()
-        pagamento_criado = res.data[0]
-        order_id_gerado = pagamento_criado['order_id']
-        
-        print(f"🛠️ Pagamento registrado com sucesso. Order ID: {order_id_gerado}")
-        
+
+        # A placa no fim da routing key mantém o crédito na mesma partição
+        routing_key = f"{ROUTING_KEY_SUCCESS}.{placa}"
         credit_event = {
-            "order_id": order_id_gerado,
             "placa": placa,
             "zona":  req.get("zona"),
-            "duracao_horas": req.get("duracao_horas"),
+            "duracao_horas": horas,
             "reply_to": reply_to,
-            "correlation_id": corr_id
+            "correlation_id": corr_id,
+            "deadline": deadline,
+            "trace": req.get("trace", False),
+            # A resposta ao cliente sai no formato em que ele enviou o pedido
+            "formato_resposta": formato
         }
-        send_event(ROUTING_KEY_SUCCESS, credit_event, corr_id)
 
+        # Pagamento e evento na mesma transação (outbox): se o processo cair
+        # antes de publicar, o relay publica. A espera pelo lote conta como
+        # tempo de banco deste pedido. Um pedido repetido reaproveita o
+        # pagamento original, sem nova linha na outbox (outbox_id nulo), e
+        # reenvia o evento; o creditos-service não credita o mesmo pagamento
+        # duas vezes.
+        item = {"pagamento": pagamento_record, "routing_key": routing_key, "evento": credit_event}
+        with tracing.db_time():
+            pagamento_criado = await payments.run(chave, lambda: batcher.submit(item))
+        order_id_gerado = pagamento_criado['order_id']
+
+        print(f"🛠️ Pagamento registrado com sucesso. Order ID: {order_id_gerado}")
+
+        # Sem expiração: o pagamento já foi gravado, o crédito precisa ser aplicado
+        await send_event(routing_key, {"order_id": order_id_gerado, **credit_event}, corr_id)
+        relay.published(pagamento_criado.get("outbox_id"))
+
+    except InvalidToken as e:
+        print(f"🛠️ Pagamento {corr_id} recusado: {e}")
+        if reply_to:
+            await runtime.publish(
+                reply_to, codec.dumps({"success": False, "error": "Não autorizado."}, formato),
+                correlation_id=corr_id, expiration=deadlines.remaining(deadline), content_type=formato
+            )
+    except PublishError:
+        # Pagamento gravado mas o evento não chegou ao broker: a mensagem
+        # volta pela fila de retry em vez de responder erro ao cliente (a
+        # linha da outbox garante o crédito mesmo se as tentativas acabarem)
+        raise
     except Exception as e:
         print(f"🛠️ ERRO no processamento de pagamento: {e}")
+        # Falha transitória (ex.: banco fora): nova tentativa pela fila de
+        # retry enquanto o cliente ainda espera; depois disso responde o erro
+        if not last_attempt(message) and not deadlines.expired(deadline):
+            raise
+        metrics.count_error("on_payment_request")
         # --- MUDANÇA 3: Adicionado bloco para responder ao cliente em caso de erro ---
         if reply_to:
             error_response = {"success": False, "error": f"Falha no serviço de pagamento: {e}"}
-            channel.basic_publish(
-                exchange=TOPIC_EXCHANGE,
-                routing_key=reply_to,
-                properties=pika.BasicProperties(correlation_id=corr_id),
-                body=json.dumps(error_response)
+            if req.get("trace"):
+                error_response["_trace"] = tracing.chain()
+            await runtime.publish(
+                reply_to, codec.dumps(error_response, formato), correlation_id=corr_id,
+                expiration=deadlines.remaining(deadline), content_type=formato
             )
 
-    finally:
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+async def reload_tariffs():
+    try:
+        total = tariffs.load(await storage.tariffs())
+    except Exception as e:
+        # Segue com a última tabela carregada (ou TARIFA_PADRAO)
+        print(f"🛠️ ERRO ao carregar tarifas: {e}")
+        metrics.count_error("reload_tariffs")
+        return
+    print(f"🛠️ Tarifas carregadas: {total} faixas.")
+
+async def reload_tariffs_loop():
+    while True:
+        await asyncio.sleep(TARIFA_TTL_S)
+        await reload_tariffs()
+
+# Callback do evento de alteração de tarifas
+async def on_tariff_changed(message):
+    await reload_tariffs()
+
+async def main():
+    global storage, reload_task, relay
+    # Com grace menor, o relay republicaria eventos que o pedido ainda está publicando
+    if OUTBOX_GRACE_S <= max_publish_seconds():
+        raise ValueError(
+            f"OUTBOX_GRACE_S={OUTBOX_GRACE_S} precisa ser maior que o pior caso de publicação "
+            f"({max_publish_seconds():.1f}s)"
+        )
+    storage = await open_storage()
+    await runtime.connect()
+    await asyncio.to_thread(verifier.warm)
+
+    # Várias réplicas podem rodar o relay: cada uma reserva as próprias linhas
+    relay = OutboxRelay(
+        storage, send_event, interval=OUTBOX_RELAY_S, batch_size=OUTBOX_BATCH_SIZE,
+        grace=OUTBOX_GRACE_S, lease=OUTBOX_LEASE_S,
+    )
+    relay.start()
+
+    await reload_tariffs()
+    # Fila exclusiva desta instância: todas as réplicas recarregam no evento
+    tariff_queue = await runtime.declare_queue('', [ROUTING_KEY_TARIFA])
+    # Eventos perdidos com a conexão caída: recarrega ao reconectar
+    runtime.on_reconnect(reload_tariffs)
+    await runtime.consume(tariff_queue, on_tariff_changed)
+    if TARIFA_TTL_S > 0:
+        reload_task = asyncio.create_task(reload_tariffs_loop())
+
+    # Declaração de filas
+    for queue in await runtime.declare_sharded_queue(QUEUE_NAME, [ROUTING_KEY_PAGAMENTO]):
+        await runtime.consume(queue, on_payment_request)
 
-def start_consuming():
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=on_payment_request)
     print("🛠️ Serviço de Pagamento rodando. Aguardando mensagens...")
-    channel.start_consuming()
+    await runtime.run_forever()
+
+def start_consuming():
+    asyncio.run(main())
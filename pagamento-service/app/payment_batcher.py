@@ -0,0 +1,86 @@
+import asyncio
+
+
+class PaymentBatcher:
+    """
+    Agrupa inserções de pagamentos num único insert em lote.
+
+    Cada chamada a `submit` espera o próprio resultado. Com `max_wait` = 0
+    (padrão) nada espera: sem lote em andamento o registro sai na hora, e
+    os que chegam enquanto um lote é gravado vão juntos no próximo, assim
+    que ele termina. Com `max_wait` > 0 o lote é enviado quando atinge
+    `max_size` registros ou quando `max_wait` segundos se passam desde o
+    primeiro registro pendente.
+
+    Uma falha do lote (ex.: timeout depois do commit) não prova que nada
+    foi gravado. Só com `idempotent` (o insert ignora registros repetidos
+    pela chave de idempotência, como o correlation_id dos pagamentos) os
+    registros são reenviados um a um, para que só os pedidos com problema
+    recebam erro; sem isso todo o lote recebe o erro. Um lote que devolve
+    um número de linhas diferente do enviado nunca é repetido.
+    """
+    def __init__(self, insert_many, max_size=50, max_wait=0, idempotent=False):
+        self.insert_many = insert_many
+        self.idempotent = idempotent
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, record):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, future))
+
+        if len(self._pending) >= self.max_size or (self.max_wait <= 0 and not self._tasks):
+            self._flush_now()
+        elif self.max_wait > 0 and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush_now)
+
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._flushed)
+
+    def _flushed(self, task):
+        self._tasks.discard(task)
+        # Sem janela: o que chegou durante a gravação sai agora, num lote só
+        if self.max_wait <= 0 and self._pending and not self._tasks:
+            self._flush_now()
+
+    async def _flush(self, batch):
+        records = [record for record, _ in batch]
+        try:
+            rows = await self.insert_many(records)
+        except Exception as e:
+            if len(batch) == 1 or not self.idempotent:
+                self._fail(batch, e)
+                return
+            print(f"🛠️ Lote de {len(batch)} pagamentos falhou ({e}); reenviando individualmente.")
+            await asyncio.gather(*(self._flush([item]) for item in batch))
+            return
+
+        if len(rows) != len(records):
+            # O lote foi gravado, mas não dá para saber qual linha é de quem
+            self._fail(batch, RuntimeError(
+                f"insert em lote retornou {len(rows)} linhas para {len(records)} registros"
+            ))
+            return
+
+        # O PostgREST devolve as linhas na mesma ordem do insert
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
@@ -0,0 +1,57 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+HORAS_SEMANA = 7 * 24
+
+
+class TariffTable:
+    """
+    Preço por hora de cada zona, pré-calculado para as 168 horas da semana.
+
+    `load` recebe as linhas da tabela `tarifas` e monta uma lista por zona
+    (mais a lista padrão, usada para zonas sem tarifa própria), aplicando da
+    regra mais geral para a mais específica: todas as zonas, todas as zonas
+    num dia, a zona, a zona num dia. As listas novas substituem as antigas
+    de uma vez, então `price` nunca vê uma tabela pela metade e custa só um
+    acesso ao dicionário e à lista por hora comprada.
+    """
+    def __init__(self, default_price, tz="America/Sao_Paulo"):
+        self.default_price = default_price
+        self.tz = ZoneInfo(tz)
+        self._default = [default_price] * HORAS_SEMANA
+        self._zones = {}
+
+    def load(self, rows):
+        rows = sorted(rows, key=lambda row: row.get("dia_semana") is not None)
+        default = [self.default_price] * HORAS_SEMANA
+        for row in rows:
+            if row.get("zona") is None:
+                _apply(default, row)
+
+        zones = {}
+        for row in rows:
+            zona = row.get("zona")
+            if zona is not None:
+                _apply(zones.setdefault(zona, list(default)), row)
+
+        self._default, self._zones = default, zones
+        return len(rows)
+
+    def price(self, zona, horas, inicio=None):
+        """Valor de `horas` horas a partir de `inicio` (agora), cada hora na sua faixa."""
+        inicio = (inicio or datetime.now(self.tz)).astimezone(self.tz)
+        slot = inicio.weekday() * 24 + inicio.hour
+        precos = self._zones.get(zona, self._default)
+        return round(sum(precos[(slot + h) % HORAS_SEMANA] for h in range(horas)), 2)
+
+
+def _apply(precos, row):
+    valor = float(row["valor_por_hora"])
+    inicio = row.get("hora_inicio") or 0
+    fim = row.get("hora_fim") or 24
+    if fim <= inicio:
+        fim += 24  # faixa que passa da meia-noite
+    dias = range(7) if row.get("dia_semana") is None else [row["dia_semana"]]
+    for dia in dias:
+        for hora in range(inicio, fim):
+            precos[(dia * 24 + hora) % HORAS_SEMANA] = valor
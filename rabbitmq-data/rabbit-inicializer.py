@@ -1,11 +1,38 @@
+import os
+import argparse
+import urllib.parse
 import requests
 from requests.auth import HTTPBasicAuth
 import time
 
 # Configurações do RabbitMQ
-RABBITMQ_API = "http://localhost:15672/api"
-USER = "myuser"
-PASSWORD = "mypassword"
+RABBITMQ_API = os.getenv("RABBITMQ_API", "http://localhost:15672/api")
+USER = os.getenv("RABBITMQ_USER", "myuser")
+PASSWORD = os.getenv("RABBITMQ_PASS", "mypassword")
+
+# Filas dos serviços e as routing keys (com a placa, ou o id do lote, no último segmento) que recebem
+SERVICE_QUEUES = {
+    "queue_pagamento": ["credito.compra.#"],
+    "queue_credito": ["credito.confirmacao.#"],
+    "queue_fiscalizacao": ["fiscalizacao.consulta.#", "fiscalizacao.lote.#"],
+}
+
+# Topologia original (exchanges diretas), mantida para quem ainda publica nela
+LEGACY_EXCHANGES = [
+    "exchange_placa",
+    "exchange_pagamento",
+    "exchange_fiscalizacao",
+    "exchange_notificacao",
+    "exchange_auth",
+]
+LEGACY_BINDINGS = [
+    ("exchange_placa", "queue_placa", "placa_key"),
+    ("exchange_pagamento", "queue_pagamento", "pagamento_key"),
+    ("exchange_pagamento", "queue_credito", "credito_key"),
+    ("exchange_fiscalizacao", "queue_fiscalizacao", "fiscalizacao_key"),
+    ("exchange_notificacao", "queue_notificacao", "notificacao_key"),
+    ("exchange_auth", "queue_auth", "auth_key"),
+]
 
 auth = HTTPBasicAuth(USER, PASSWORD)
 
@@ -32,11 +59,14 @@ def create_exchange(name, exchange_type="direct", durable=True):
     resp.raise_for_status()
     print(f"Exchange '{name}' criada.")
 
-def create_queue(name, durable=True):
+def create_queue(name, durable=True, queue_type="classic"):
     url = f"{RABBITMQ_API}/queues/%2f/{name}"
     data = {
         "durable": durable
     }
+    # Mesmos argumentos que os serviços usam ao declarar (classic = sem argumento)
+    if queue_type != "classic":
+        data["arguments"] = {"x-queue-type": queue_type}
     resp = requests.put(url, json=data, auth=auth)
     resp.raise_for_status()
     print(f"Fila '{name}' criada.")
@@ -50,33 +80,86 @@ def create_binding(exchange, queue, routing_key):
     resp.raise_for_status()
     print(f"Binding criado: exchange='{exchange}' -> queue='{queue}' (routing_key='{routing_key}')")
 
+def create_exchange_binding(source, destination, routing_key):
+    url = f"{RABBITMQ_API}/bindings/%2f/e/{source}/e/{destination}"
+    resp = requests.post(url, json={"routing_key": routing_key}, auth=auth)
+    resp.raise_for_status()
+    print(f"Binding criado: exchange='{source}' -> exchange='{destination}' (routing_key='{routing_key}')")
+
+def unbind_queue(exchange, queue):
+    """Remove todos os bindings de `exchange` para `queue` (a fila e o que ela guarda ficam)."""
+    url = f"{RABBITMQ_API}/bindings/%2f/e/{exchange}/q/{queue}"
+    resp = requests.get(url, auth=auth)
+    if resp.status_code == 404:
+        return
+    resp.raise_for_status()
+    for binding in resp.json():
+        key = urllib.parse.quote(binding["properties_key"], safe="")
+        requests.delete(f"{url}/{key}", auth=auth).raise_for_status()
+        print(f"Binding removido: exchange='{exchange}' -> queue='{queue}' (routing_key='{binding['routing_key']}')")
+
+def delete_queue(name):
+    resp = requests.delete(f"{RABBITMQ_API}/queues/%2f/{name}", auth=auth)
+    if resp.status_code != 404:
+        resp.raise_for_status()
+        print(f"Fila '{name}' removida.")
+
+def create_sharded_queue(name, routing_keys, shards, queue_type):
+    """
+    Exchange x-consistent-hash `<fila>.hash` ligada ao amq.topic, com as
+    partições `<fila>.0` ... `<fila>.<N-1>` (peso 1 cada). Como a routing key
+    termina na placa, cada placa fica sempre na mesma partição.
+    """
+    hash_exchange = f"{name}.hash"
+    create_exchange(hash_exchange, "x-consistent-hash")
+    for routing_key in routing_keys:
+        create_exchange_binding("amq.topic", hash_exchange, routing_key)
+    for shard in range(shards):
+        create_queue(f"{name}.{shard}", queue_type=queue_type)
+        create_binding(hash_exchange, f"{name}.{shard}", "1")
+
+def create_legacy_topology(sharded):
+    for exchange in LEGACY_EXCHANGES:
+        create_exchange(exchange)
+    for exchange, queue, routing_key in LEGACY_BINDINGS:
+        if queue in SERVICE_QUEUES:
+            # Particionada, a fila única não é mais consumida: o binding
+            # antigo só acumularia mensagens nela
+            if sharded:
+                continue
+        else:
+            create_queue(queue)
+        create_binding(exchange, queue, routing_key)
+
 def main():
+    parser = argparse.ArgumentParser(description="Declara a topologia das filas dos serviços")
+    parser.add_argument("--particoes", type=int, default=int(os.getenv("QUEUE_SHARDS", "1")),
+                        help="partições por fila (1 = fila única, sem particionar)")
+    parser.add_argument("--tipo", default=os.getenv("QUEUE_TYPE", "classic"), choices=["classic", "quorum"],
+                        help="tipo das filas")
+    parser.add_argument("--remover-fila-unica", action="store_true",
+                        help="ao particionar, remove a fila única antiga (por padrão ela só é desligada do amq.topic)")
+    args = parser.parse_args()
+
     wait_rabbitmq()
 
-    # Criar exchanges
-    create_exchange("exchange_placa")
-    create_exchange("exchange_pagamento")
-    create_exchange("exchange_fiscalizacao")
-    create_exchange("exchange_notificacao")
-    create_exchange("exchange_auth")
-
-    # Criar filas
-    create_queue("queue_placa")
-    create_queue("queue_pagamento")
-    create_queue("queue_credito")
-    create_queue("queue_fiscalizacao")
-    create_queue("queue_notificacao")
-    create_queue("queue_auth")
-
-    # Criar bindings
-    create_binding("exchange_placa", "queue_placa", "placa_key")
-    create_binding("exchange_pagamento", "queue_pagamento", "pagamento_key")
-    create_binding("exchange_pagamento", "queue_credito", "credito_key")
-    create_binding("exchange_fiscalizacao", "queue_fiscalizacao", "fiscalizacao_key")
-    create_binding("exchange_notificacao", "queue_notificacao", "notificacao_key")
-    create_binding("exchange_auth", "queue_auth", "auth_key")
+    for name, routing_keys in SERVICE_QUEUES.items():
+        if args.particoes > 1:
+            create_sharded_queue(name, routing_keys, args.particoes, args.tipo)
+            # A fila única ligada ao amq.topic receberia cópia de cada mensagem
+            # das partições: sempre sai do amq.topic; o que já estava nela
+            # continua lá para ser consumido, a menos que seja removida
+            unbind_queue("amq.topic", name)
+            if args.remover_fila_unica:
+                delete_queue(name)
+        else:
+            create_queue(name, queue_type=args.tipo)
+            for routing_key in routing_keys:
+                create_binding("amq.topic", name, routing_key)
+
+    create_legacy_topology(args.particoes > 1)
 
     print("Setup do RabbitMQ completo!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,79 @@
+"""
+Inspeciona e reprocessa as mensagens da fila de mensagens mortas (<fila>.dlq).
+
+Uso:
+    python rabbitmq-data/replay_dlq.py queue_credito --listar
+    python rabbitmq-data/replay_dlq.py queue_credito [--limite 100]
+
+No reprocessamento cada mensagem volta para a fila original com o
+contador de tentativas zerado e só é removida da DLQ depois que o broker
+confirma a republicação.
+"""
+import os
+import argparse
+import pika
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "estaciona_user")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "estaciona_user")
+
+RETRY_HEADER = "x-retry-count"
+ERROR_HEADER = "x-ultimo-erro"
+ROUTING_KEY_HEADER = "x-routing-key"
+
+
+def connect():
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    return pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials))
+
+
+def listar(channel, dlq, limite):
+    # Sem ack: as mensagens voltam para a DLQ quando a conexão fecha
+    for _ in range(limite):
+        method, properties, body = channel.basic_get(dlq, auto_ack=False)
+        if method is None:
+            break
+        headers = properties.headers or {}
+        print(f"- correlation_id={properties.correlation_id} routing_key={headers.get(ROUTING_KEY_HEADER)} "
+              f"tentativas={headers.get(RETRY_HEADER)}")
+        print(f"  erro: {headers.get(ERROR_HEADER)}")
+        print(f"  corpo ({properties.content_type or 'sem content_type'}): {body[:200]!r}")
+
+
+def reprocessar(channel, fila, dlq, limite):
+    channel.confirm_delivery()
+    total = 0
+    while total < limite:
+        method, properties, body = channel.basic_get(dlq, auto_ack=False)
+        if method is None:
+            break
+        headers = dict(properties.headers or {})
+        headers.pop(RETRY_HEADER, None)
+        properties.headers = headers
+        channel.basic_publish(exchange="", routing_key=fila, body=body, properties=properties)
+        channel.basic_ack(method.delivery_tag)
+        total += 1
+    print(f"{total} mensagens devolvidas de '{dlq}' para '{fila}'.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspeciona ou reprocessa a DLQ de uma fila")
+    parser.add_argument("fila", help="fila original (ex.: queue_credito)")
+    parser.add_argument("--listar", action="store_true", help="só mostra as mensagens, sem reprocessar")
+    parser.add_argument("--limite", type=int, default=1000, help="número máximo de mensagens")
+    args = parser.parse_args()
+
+    connection = connect()
+    channel = connection.channel()
+    dlq = f"{args.fila}.dlq"
+    try:
+        if args.listar:
+            listar(channel, dlq, args.limite)
+        else:
+            reprocessar(channel, args.fila, dlq, args.limite)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+-- Estende o crédito ativo da placa ou cria um novo, numa única chamada.
+-- O advisory lock por placa serializa compras simultâneas do mesmo veículo,
+-- inclusive entre réplicas diferentes do creditos-service.
+create or replace function public.estender_credito(
+    p_placa        text,
+    p_horas        integer,
+    p_pagamento_id public.creditos.pagamento_id%type,
+    p_zona         public.creditos.zona%type default null,
+    p_origem       public.creditos.origem%type default 'app'
+)
+returns table (nova_expiracao timestamptz, estendido boolean)
+language plpgsql
+as $$
+declare
+    v_expiracao timestamptz;
+begin
+    if p_horas is null or p_horas <= 0 then
+        raise exception 'estender_credito: p_horas deve ser positivo (recebido %)', p_horas
+            using errcode = '22023';
+    end if;
+
+    perform pg_advisory_xact_lock(hashtext('creditos:' || p_placa));
+
+    update public.creditos c
+       set expira_em    = c.expira_em + make_interval(hours => p_horas),
+           pagamento_id = p_pagamento_id
+     where c.id = (
+         select a.id
+           from public.creditos a
+          where a.placa = p_placa
+            and a.expira_em >= now()
+          order by a.expira_em desc
+          limit 1
+     )
+    returning c.expira_em into v_expiracao;
+
+    if found then
+        return query select v_expiracao, true;
+        return;
+    end if;
+
+    insert into public.creditos (placa, pagamento_id, zona, comprado_em, expira_em, origem)
+    values (p_placa, p_pagamento_id, p_zona, now(), now() + make_interval(hours => p_horas), p_origem)
+    returning expira_em into v_expiracao;
+
+    return query select v_expiracao, false;
+end;
+$$;
+
+create index if not exists creditos_placa_expira_em_idx
+    on public.creditos (placa, expira_em);
@@ -0,0 +1,75 @@
+-- Idempotência dos pagamentos: cada requisição do cliente (correlation_id)
+-- gera no máximo um pagamento, e cada pagamento estende o crédito uma vez só.
+alter table public.pagamentos add column if not exists correlation_id text;
+alter table public.pagamentos add column if not exists creditado_em timestamptz;
+
+create unique index if not exists pagamentos_correlation_id_key
+    on public.pagamentos (correlation_id);
+
+-- Mesmo contrato de antes mais `duplicado`: true quando o pagamento já tinha
+-- sido creditado (nada é alterado e volta a expiração atual da placa, ou a
+-- última arquivada; nula se a placa não tem crédito em nenhuma das tabelas).
+drop function if exists public.estender_credito;
+
+create function public.estender_credito(
+    p_placa        text,
+    p_horas        integer,
+    p_pagamento_id public.creditos.pagamento_id%type,
+    p_zona         public.creditos.zona%type default null,
+    p_origem       public.creditos.origem%type default 'app'
+)
+returns table (nova_expiracao timestamptz, estendido boolean, duplicado boolean)
+language plpgsql
+as $$
+declare
+    v_expiracao timestamptz;
+begin
+    if p_horas is null or p_horas <= 0 then
+        raise exception 'estender_credito: p_horas deve ser positivo (recebido %)', p_horas
+            using errcode = '22023';
+    end if;
+
+    perform pg_advisory_xact_lock(hashtext('creditos:' || p_placa));
+
+    if p_pagamento_id is not null and exists (
+        select 1 from public.pagamentos p
+         where p.order_id = p_pagamento_id and p.creditado_em is not null
+    ) then
+        -- O crédito pode já ter vencido e ido para `creditos_arquivo` (migração
+        -- seguinte; a tabela só é resolvida quando a função executa)
+        return query
+            select coalesce(
+                       (select max(c.expira_em) from public.creditos c where c.placa = p_placa),
+                       (select max(a.expira_em) from public.creditos_arquivo a where a.placa = p_placa)
+                   ),
+                   true, true;
+        return;
+    end if;
+
+    update public.creditos c
+       set expira_em    = c.expira_em + make_interval(hours => p_horas),
+           pagamento_id = p_pagamento_id
+     where c.id = (
+         select a.id
+           from public.creditos a
+          where a.placa = p_placa
+            and a.expira_em >= now()
+          order by a.expira_em desc
+          limit 1
+     )
+    returning c.expira_em into v_expiracao;
+
+    if found then
+        update public.pagamentos set creditado_em = now() where order_id = p_pagamento_id;
+        return query select v_expiracao, true, false;
+        return;
+    end if;
+
+    insert into public.creditos (placa, pagamento_id, zona, comprado_em, expira_em, origem)
+    values (p_placa, p_pagamento_id, p_zona, now(), now() + make_interval(hours => p_horas), p_origem)
+    returning expira_em into v_expiracao;
+
+    update public.pagamentos set creditado_em = now() where order_id = p_pagamento_id;
+    return query select v_expiracao, false, false;
+end;
+$$;
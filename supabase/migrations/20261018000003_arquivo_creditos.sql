@@ -0,0 +1,77 @@
+-- Separação quente/fria da tabela de créditos: um job do creditos-service
+-- move os créditos vencidos para `creditos_arquivo` em lotes, mantendo em
+-- `creditos` só os ativos (as consultas por placa continuam pequenas).
+
+-- Expiração para a qual o aviso "crédito expirando" já foi publicado
+alter table public.creditos add column if not exists avisado_para timestamptz;
+
+create table if not exists public.creditos_arquivo (like public.creditos);
+alter table public.creditos_arquivo add column if not exists arquivado_em timestamptz not null default now();
+create index if not exists creditos_arquivo_placa_idx on public.creditos_arquivo (placa);
+
+create index if not exists creditos_expira_em_idx on public.creditos (expira_em);
+
+-- Move até p_limite créditos vencidos; devolve quantos foram movidos.
+-- `skip locked` deixa várias réplicas varrerem ao mesmo tempo e não espera
+-- por créditos que `estender_credito` está alterando.
+create or replace function public.arquivar_creditos(p_limite integer default 1000)
+returns integer
+language plpgsql
+as $$
+declare
+    v_total integer;
+begin
+    with movidos as (
+        delete from public.creditos c
+         where c.id in (
+             select a.id
+               from public.creditos a
+              where a.expira_em < now()
+              order by a.expira_em
+              limit p_limite
+              for update skip locked
+         )
+        returning c.*
+    )
+    insert into public.creditos_arquivo
+    select m.*, now() from movidos m;
+
+    get diagnostics v_total = row_count;
+    return v_total;
+end;
+$$;
+
+-- Marca e devolve os créditos que vencem nos próximos p_janela_segundos e
+-- ainda não foram avisados para a expiração atual (uma extensão gera novo aviso).
+create or replace function public.creditos_expirando(p_janela_segundos integer, p_limite integer default 1000)
+returns table (placa text, zona text, expira_em timestamptz)
+language sql
+as $$
+    update public.creditos c
+       set avisado_para = c.expira_em
+     where c.id in (
+         select a.id
+           from public.creditos a
+          where a.expira_em >= now()
+            and a.expira_em < now() + make_interval(secs => p_janela_segundos)
+            and a.avisado_para is distinct from a.expira_em
+          order by a.expira_em
+          limit p_limite
+          for update skip locked
+     )
+    returning c.placa::text, c.zona::text, c.expira_em;
+$$;
+
+-- Desfaz a marca dos créditos ({placa, expira_em}) cujo aviso não foi
+-- publicado; uma extensão feita nesse meio-tempo já mudou a expiração.
+create or replace function public.desmarcar_avisos(p_creditos jsonb)
+returns void
+language sql
+as $$
+    update public.creditos c
+       set avisado_para = null
+      from jsonb_to_recordset(p_creditos) as x(placa text, expira_em timestamptz)
+     where c.placa = x.placa
+       and c.expira_em = x.expira_em
+       and c.avisado_para = c.expira_em;
+$$;
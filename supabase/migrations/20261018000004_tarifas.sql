@@ -0,0 +1,22 @@
+-- Tarifas por zona e horário. O pagamento-service carrega a tabela inteira
+-- em memória (um preço por hora da semana) e não consulta o banco por compra.
+--
+-- Linhas com `zona` nula valem para todas as zonas e com `dia_semana` nulo
+-- para todos os dias; a linha mais específica prevalece. `dia_semana` vai
+-- de 0 (segunda) a 6 (domingo) e as horas estão no fuso da cidade
+-- (TARIFA_TZ do serviço). `hora_fim` menor ou igual a `hora_inicio` vira a
+-- meia-noite (ex.: 22 -> 6).
+create table if not exists public.tarifas (
+    id             bigint generated always as identity primary key,
+    zona           text,
+    dia_semana     smallint check (dia_semana between 0 and 6),
+    hora_inicio    smallint not null default 0 check (hora_inicio between 0 and 23),
+    hora_fim       smallint not null default 24 check (hora_fim between 1 and 24),
+    valor_por_hora numeric(10, 2) not null check (valor_por_hora >= 0),
+    atualizado_em  timestamptz not null default now()
+);
+
+-- Preço que vigorava antes da tabela
+insert into public.tarifas (zona, dia_semana, hora_inicio, hora_fim, valor_por_hora)
+select null, null, 0, 24, 5.00
+ where not exists (select 1 from public.tarifas);
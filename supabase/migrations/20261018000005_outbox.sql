@@ -0,0 +1,104 @@
+-- Outbox do pagamento-service: o pagamento e o evento que leva ao crédito
+-- (credito.confirmacao.sucesso.<placa>) são gravados na mesma transação.
+-- O serviço publica o evento logo depois e apaga a linha assim que o
+-- broker confirma; se o processo cair no meio, o relay publica as linhas
+-- que ficaram para trás.
+create table if not exists public.outbox (
+    id             bigint generated always as identity primary key,
+    routing_key    text not null,
+    payload        jsonb not null,
+    correlation_id text,
+    criado_em      timestamptz not null default now(),
+    reservado_ate  timestamptz,
+    tentativas     integer not null default 0
+);
+
+create index if not exists outbox_criado_em_idx on public.outbox (criado_em);
+
+-- Grava um lote de pagamentos (idempotente por correlation_id) e um evento
+-- por pagamento novo. p_itens: [{pagamento: {placa, duracao_horas, valor,
+-- correlation_id}, routing_key, evento}]; o order_id entra no evento aqui.
+-- Um pedido repetido não cria outro pagamento nem outro evento: volta o
+-- order_id original com outbox_id nulo (o serviço reenvia o evento direto e
+-- o creditos-service responde que o crédito já foi aplicado). A mesma chave
+-- repetida dentro do lote conta como repetição do primeiro item com ela.
+create or replace function public.registrar_pagamentos(p_itens jsonb)
+returns table (
+    order_id       public.pagamentos.order_id%type,
+    correlation_id text,
+    outbox_id      bigint
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+    return query
+    with itens as (
+        select i.valor as item, i.ordem, i.valor->'pagamento'->>'correlation_id' as chave,
+               i.ordem = min(i.ordem) over (partition by i.valor->'pagamento'->>'correlation_id') as primeiro
+          from jsonb_array_elements(p_itens) with ordinality as i(valor, ordem)
+    ),
+    novos as (
+        insert into public.pagamentos (placa, duracao_horas, valor, correlation_id)
+        select it.item->'pagamento'->>'placa',
+               (it.item->'pagamento'->>'duracao_horas')::integer,
+               (it.item->'pagamento'->>'valor')::numeric,
+               it.chave
+          from itens it
+         where it.primeiro
+         order by it.ordem
+        on conflict (correlation_id) do nothing
+        returning order_id, correlation_id
+    ),
+    eventos as (
+        insert into public.outbox (routing_key, payload, correlation_id)
+        select it.item->>'routing_key',
+               (it.item->'evento') || jsonb_build_object('order_id', n.order_id),
+               n.correlation_id
+          from itens it
+          join novos n on n.correlation_id = it.chave
+         where it.primeiro
+         order by it.ordem
+        returning id, correlation_id
+    )
+    -- Os CTEs não enxergam as linhas inseridas pelos outros: o pagamento novo
+    -- vem de `novos` e o repetido da tabela
+    select coalesce(n.order_id, p.order_id), it.chave, e.id
+      from itens it
+      left join novos n on n.correlation_id = it.chave
+      left join public.pagamentos p on p.correlation_id = it.chave
+      left join eventos e on e.correlation_id = it.chave and it.primeiro
+     order by it.ordem;
+end;
+$$;
+
+-- Reserva até p_limite eventos criados há mais de p_atraso_segundos (o
+-- serviço que os gravou já devia ter publicado) por p_reserva_segundos.
+-- `skip locked` e a reserva deixam vários relays rodarem juntos; se o relay
+-- cair antes de apagar, a reserva vence e outro publica.
+create or replace function public.reservar_outbox(
+    p_limite            integer default 100,
+    p_atraso_segundos   integer default 60,
+    p_reserva_segundos  integer default 30
+)
+returns table (id bigint, routing_key text, payload jsonb, correlation_id text)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+    return query
+    update public.outbox o
+       set reservado_ate = now() + make_interval(secs => p_reserva_segundos),
+           tentativas    = o.tentativas + 1
+     where o.id in (
+         select a.id
+           from public.outbox a
+          where a.criado_em < now() - make_interval(secs => p_atraso_segundos)
+            and (a.reservado_ate is null or a.reservado_ate < now())
+          order by a.criado_em
+          limit p_limite
+            for update skip locked
+     )
+    returning o.id, o.routing_key, o.payload, o.correlation_id;
+end;
+$$;
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Os serviços importam os módulos de common/ e do próprio app/ pelo nome
+# (é assim que ficam dentro da imagem); os testes usam o mesmo layout.
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for pasta in ("common", "pagamento-service/app", "creditos-service/app",
+              "fiscalizacao-service/app", "notificacao-service/app"):
+    sys.path.insert(0, os.path.join(RAIZ, pasta))
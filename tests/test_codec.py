@@ -0,0 +1,30 @@
+import pytest
+import codec
+
+PAYLOAD = {"placa": "BRA2E19", "duracao_horas": 2, "zona": None, "trace": True}
+
+
+@pytest.mark.parametrize("formato", [codec.JSON, codec.MSGPACK])
+def test_ida_e_volta_no_mesmo_formato(formato):
+    if formato == codec.MSGPACK and codec.msgpack is None:
+        pytest.skip("msgpack não instalado")
+
+    assert codec.loads(codec.dumps(PAYLOAD, formato), formato) == (PAYLOAD, formato)
+
+
+@pytest.mark.parametrize("formato", [codec.JSON, codec.MSGPACK])
+def test_sem_content_type_detecta_pelo_primeiro_byte(formato):
+    # Mensagens vindas do MQTT 3.1.1 chegam sem content_type
+    if formato == codec.MSGPACK and codec.msgpack is None:
+        pytest.skip("msgpack não instalado")
+
+    assert codec.loads(codec.dumps(PAYLOAD, formato)) == (PAYLOAD, formato)
+
+
+def test_json_com_espaco_inicial_nao_e_msgpack():
+    assert codec.detect(b' {"placa": "BRA2E19"}') == codec.JSON
+    assert codec.loads(b' {"placa": "BRA2E19"}') == ({"placa": "BRA2E19"}, codec.JSON)
+
+
+def test_content_type_desconhecido_cai_na_deteccao():
+    assert codec.loads(b'{"a": 1}', "text/plain") == ({"a": 1}, codec.JSON)
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+from credit_index import CreditIndex
+
+
+def test_evento_repetido_nao_estende_expiracao():
+    index = CreditIndex()
+    expira_em = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    index.apply("BRA2E19", expira_em)
+    index.apply("BRA2E19", expira_em)
+
+    assert index.get("BRA2E19") == (True, expira_em)
+
+
+def test_evento_fora_de_ordem_nao_recua_expiracao():
+    index = CreditIndex()
+    agora = datetime.now(timezone.utc)
+
+    index.apply("BRA2E19", agora + timedelta(hours=2))
+    index.apply("BRA2E19", agora + timedelta(hours=1))
+
+    assert index.get("BRA2E19") == (True, agora + timedelta(hours=2))
+
+
+def test_load_mantem_maior_expiracao_por_placa():
+    index = CreditIndex()
+    agora = datetime.now(timezone.utc)
+    rows = [
+        {"placa": "ABC1234", "expira_em": (agora + timedelta(minutes=10)).isoformat()},
+        {"placa": "ABC1234", "expira_em": (agora + timedelta(minutes=50)).isoformat()},
+    ]
+
+    assert index.load(rows) == 1
+    assert index.get("ABC1234") == (True, agora + timedelta(minutes=50))
+
+
+def test_cache_negativo_e_expiracao_vencida():
+    index = CreditIndex()
+    agora = datetime.now(timezone.utc)
+
+    index.put_missing("SEM0000")
+    index.put("VENCIDO", agora - timedelta(seconds=1))
+
+    assert index.get("SEM0000") == (True, None)
+    assert index.get("VENCIDO") == (False, None)
@@ -0,0 +1,31 @@
+import asyncio
+import storage
+from credit_sweeper import CreditSweeper
+
+
+def test_aviso_que_falhou_volta_na_rodada_seguinte(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "estaciona.db"))
+    publicados = []
+
+    async def publish_expiring(credito):
+        if credito["placa"] == "AAA1111" and not publicados:
+            publicados.append(None)
+            raise RuntimeError("broker fora")
+        publicados.append(credito["placa"])
+
+    async def run():
+        s = await storage.SqliteStorage.connect()
+        try:
+            await s.extend_credit("AAA1111", 1, None)
+            await s.extend_credit("BBB2222", 1, None)
+            sweeper = CreditSweeper(s, publish_expiring, warn_window=7200)
+            primeira = await sweeper.sweep()
+            segunda = await sweeper.sweep()
+            terceira = await sweeper.sweep()
+        finally:
+            await s.close()
+        return primeira, segunda, terceira
+
+    primeira, segunda, terceira = asyncio.run(run())
+    assert (primeira["avisos"], segunda["avisos"], terceira["avisos"]) == (1, 1, 0)
+    assert publicados == [None, "BBB2222", "AAA1111"]
@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from idempotency import IdempotencyCache
+
+
+def test_repetido_reaproveita_resultado_sem_executar_de_novo():
+    cache = IdempotencyCache("teste")
+    chamadas = []
+
+    async def grava():
+        chamadas.append(1)
+        return {"order_id": "a"}
+
+    async def run():
+        return await cache.run("c1", grava), await cache.run("c1", grava)
+
+    primeiro, repetido = asyncio.run(run())
+    assert primeiro is repetido
+    assert len(chamadas) == 1
+
+
+def test_repetido_em_andamento_espera_o_original():
+    cache = IdempotencyCache("teste")
+    chamadas = []
+
+    async def grava():
+        chamadas.append(1)
+        await asyncio.sleep(0.01)
+        return {"order_id": "a"}
+
+    async def run():
+        return await asyncio.gather(cache.run("c1", grava), cache.run("c1", grava))
+
+    resultados = asyncio.run(run())
+    assert resultados[0] is resultados[1]
+    assert len(chamadas) == 1
+
+
+def test_falha_nao_fica_em_cache():
+    cache = IdempotencyCache("teste")
+    tentativas = []
+
+    async def grava():
+        tentativas.append(1)
+        if len(tentativas) == 1:
+            raise RuntimeError("banco fora")
+        return {"order_id": "a"}
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await cache.run("c1", grava)
+        return await cache.run("c1", grava)
+
+    assert asyncio.run(run()) == {"order_id": "a"}
+    assert len(tentativas) == 2
+
+
+def test_lru_descarta_chaves_mais_antigas():
+    cache = IdempotencyCache("teste", max_size=2)
+    chamadas = []
+
+    async def grava():
+        chamadas.append(1)
+        return len(chamadas)
+
+    async def run():
+        for chave in ("c1", "c2", "c3", "c1"):
+            await cache.run(chave, grava)
+
+    asyncio.run(run())
+    assert len(chamadas) == 4
+
+
+def test_sem_chave_sempre_executa():
+    cache = IdempotencyCache("teste")
+    chamadas = []
+
+    async def grava():
+        chamadas.append(1)
+
+    async def run():
+        await cache.run(None, grava)
+        await cache.run(None, grava)
+
+    asyncio.run(run())
+    assert len(chamadas) == 2
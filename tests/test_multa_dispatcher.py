@@ -0,0 +1,62 @@
+import time
+from multa_dispatcher import MultaDispatcher
+
+
+class Sink:
+    def __init__(self, falhas=0):
+        self.lotes = []
+        self.falhas = falhas
+
+    def send(self, lote):
+        if self.falhas:
+            self.falhas -= 1
+            raise RuntimeError("guarda municipal fora")
+        self.lotes.append(lote)
+
+
+def test_placa_repetida_na_janela_e_descartada():
+    dispatcher = MultaDispatcher(Sink(), dedupe_window=600)
+    agora = time.time()
+
+    assert dispatcher.submit("BRA2E19", "A", {"placa": "BRA2E19"}, ack=lambda: None, now=agora)
+    assert not dispatcher.submit("BRA2E19", "A", {"placa": "BRA2E19"}, ack=lambda: None, now=agora + 60)
+    assert dispatcher.submit("BRA2E19", "A", {"placa": "BRA2E19"}, ack=lambda: None, now=agora + 600)
+
+
+def test_lote_por_area_e_ack_so_depois_do_envio():
+    sink = Sink()
+    dispatcher = MultaDispatcher(sink, batch_max=10)
+    acks = []
+    for placa, area in (("BRA2E19", "A"), ("ABC1234", "A"), ("XYZ9876", "B")):
+        dispatcher.submit(placa, area, {"placa": placa}, ack=lambda placa=placa: acks.append(placa))
+
+    assert acks == []
+    dispatcher.flush()
+
+    assert {lote["area"]: lote["quantidade"] for lote in sink.lotes} == {"A": 2, "B": 1}
+    assert sorted(acks) == ["ABC1234", "BRA2E19", "XYZ9876"]
+
+
+def test_area_cheia_envia_antes_do_intervalo():
+    sink = Sink()
+    dispatcher = MultaDispatcher(sink, batch_max=2)
+
+    dispatcher.submit("BRA2E19", "A", {}, ack=lambda: None)
+    assert sink.lotes == []
+    dispatcher.submit("ABC1234", "A", {}, ack=lambda: None)
+
+    assert [lote["quantidade"] for lote in sink.lotes] == [2]
+
+
+def test_falha_no_envio_mantem_lote_pendente():
+    sink = Sink(falhas=1)
+    dispatcher = MultaDispatcher(sink)
+    acks = []
+    dispatcher.submit("BRA2E19", "A", {"placa": "BRA2E19"}, ack=lambda: acks.append(1))
+
+    dispatcher.flush()
+    assert acks == [] and sink.lotes == []
+
+    dispatcher.flush()
+    assert acks == [1]
+    assert [lote["multas"] for lote in sink.lotes] == [[{"placa": "BRA2E19"}]]
@@ -0,0 +1,66 @@
+from occupancy import OccupancyTracker, SEM_ZONA, save_snapshot
+
+AGORA = 1_000_000.0
+
+
+def test_extensao_mantem_zona_da_compra():
+    tracker = OccupancyTracker()
+
+    tracker.apply("BRA2E19", "A", AGORA + 3600, now=AGORA)
+    tracker.apply("BRA2E19", "B", AGORA + 7200, now=AGORA)
+
+    assert tracker.counts(now=AGORA) == {"A": 1}
+
+
+def test_evento_repetido_ou_atrasado_nao_muda_contagem():
+    tracker = OccupancyTracker()
+
+    tracker.apply("BRA2E19", "A", AGORA + 7200, now=AGORA)
+    tracker.apply("BRA2E19", "A", AGORA + 7200, now=AGORA)
+    tracker.apply("BRA2E19", "A", AGORA + 3600, now=AGORA)
+
+    assert tracker.counts(now=AGORA) == {"A": 1}
+    assert tracker.counts(now=AGORA + 3600) == {"A": 1}
+
+
+def test_expiracao_sai_da_contagem():
+    tracker = OccupancyTracker()
+    tracker.apply("BRA2E19", "A", AGORA + 60, now=AGORA)
+    tracker.apply("ABC1234", None, AGORA + 120, now=AGORA)
+
+    assert tracker.counts(now=AGORA) == {"A": 1, SEM_ZONA: 1}
+    assert tracker.counts(now=AGORA + 90) == {SEM_ZONA: 1}
+
+
+def test_nova_compra_depois_de_expirar_usa_zona_nova():
+    tracker = OccupancyTracker()
+    tracker.apply("BRA2E19", "A", AGORA + 60, now=AGORA)
+
+    tracker.apply("BRA2E19", "B", AGORA + 3600, now=AGORA + 120)
+
+    assert tracker.counts(now=AGORA + 120) == {"B": 1}
+
+
+def test_eventos_durante_recarga_sao_reaplicados():
+    tracker = OccupancyTracker()
+    tracker.begin_reload()
+    # Compra aplicada enquanto a tabela era lida; as linhas lidas não a têm
+    tracker.apply("BRA2E19", "A", AGORA + 3600, now=AGORA)
+
+    total = tracker.load([{"placa": "ABC1234", "zona": "B", "expira_em": AGORA + 3600}], now=AGORA)
+
+    assert total == 2
+    assert tracker.counts(now=AGORA) == {"A": 1, "B": 1}
+
+
+def test_snapshot_recente_e_restaurado(tmp_path):
+    tracker = OccupancyTracker()
+    tracker.apply("BRA2E19", "A", 4_000_000_000.0)
+    path = tmp_path / "ocupacao.json"
+    save_snapshot(path, tracker.snapshot())
+
+    restaurado = OccupancyTracker()
+
+    assert restaurado.restore(path, max_age=120) == 1
+    assert restaurado.counts() == {"A": 1}
+    assert OccupancyTracker().restore(tmp_path / "nao_existe.json", max_age=120) is None
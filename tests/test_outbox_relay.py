@@ -0,0 +1,51 @@
+import asyncio
+from outbox_relay import OutboxRelay
+
+
+class FakeStorage:
+    def __init__(self, rows=()):
+        self.rows = {row["id"]: row for row in rows}
+        self.deletes = []
+
+    async def claim_outbox(self, limite, atraso_segundos, reserva_segundos):
+        return list(self.rows.values())[:limite]
+
+    async def delete_outbox(self, ids):
+        self.deletes.append(sorted(ids))
+        for id_ in ids:
+            self.rows.pop(id_, None)
+
+
+def test_evento_publicado_e_apagado_na_hora():
+    storage = FakeStorage()
+    relay = OutboxRelay(storage, publish=None)
+
+    async def run():
+        relay.published(1)
+        relay.published(None)  # pagamento repetido: sem linha na outbox
+        await asyncio.sleep(0)
+        relay.published(2)
+        relay.published(3)
+        await relay._deleting
+
+    asyncio.run(run())
+    assert storage.deletes == [[1], [2, 3]]
+
+
+def test_drain_republica_e_apaga_linhas_esquecidas():
+    storage = FakeStorage([
+        {"id": 1, "routing_key": "credito.confirmacao.sucesso.ABC1234", "payload": {"order_id": "a"}, "correlation_id": "c1"},
+        {"id": 2, "routing_key": "credito.confirmacao.sucesso.BRA2E19", "payload": {"order_id": "b"}, "correlation_id": "c2"},
+    ])
+    publicados = []
+
+    async def publish(routing_key, payload, correlation_id):
+        if correlation_id == "c2":
+            raise RuntimeError("broker fora")
+        publicados.append(routing_key)
+
+    relay = OutboxRelay(storage, publish, batch_size=10)
+
+    assert asyncio.run(relay.drain()) == 1
+    assert publicados == ["credito.confirmacao.sucesso.ABC1234"]
+    assert list(storage.rows) == [2]
@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from payment_batcher import PaymentBatcher
+
+
+class FakeInsert:
+    """insert_many falso: grava por correlation_id e ignora repetidos, como o banco."""
+    def __init__(self, falhas=0, linhas_a_menos=0):
+        self.gravados = {}
+        self.chamadas = []
+        self.falhas = falhas
+        self.linhas_a_menos = linhas_a_menos
+
+    async def __call__(self, records):
+        self.chamadas.append(len(records))
+        rows = []
+        for record in records:
+            row = self.gravados.setdefault(record["correlation_id"], {**record, "order_id": f"o-{len(self.gravados)}"})
+            rows.append(row)
+        if self.falhas:
+            # Timeout depois do commit: gravou, mas o chamador recebe erro
+            self.falhas -= 1
+            raise TimeoutError("timeout depois do commit")
+        return rows[:len(rows) - self.linhas_a_menos]
+
+
+def submit_all(batcher, records):
+    async def run():
+        return await asyncio.gather(*(batcher.submit(r) for r in records), return_exceptions=True)
+    return asyncio.run(run())
+
+
+def pedidos(n):
+    return [{"correlation_id": f"c{i}", "placa": f"ABC{i:04d}"} for i in range(n)]
+
+
+def test_lote_unico_com_linhas_na_ordem():
+    insert = FakeInsert()
+    rows = submit_all(PaymentBatcher(insert, max_size=10, max_wait=0.01), pedidos(3))
+
+    assert insert.chamadas == [3]
+    assert [row["correlation_id"] for row in rows] == ["c0", "c1", "c2"]
+
+
+def test_falha_ambigua_sem_idempotencia_nao_reenvia():
+    insert = FakeInsert(falhas=1)
+    resultados = submit_all(PaymentBatcher(insert, max_size=10, max_wait=0.01), pedidos(3))
+
+    assert insert.chamadas == [3]
+    assert all(isinstance(r, TimeoutError) for r in resultados)
+
+
+def test_falha_ambigua_idempotente_reenvia_sem_duplicar():
+    insert = FakeInsert(falhas=1)
+    rows = submit_all(PaymentBatcher(insert, max_size=10, max_wait=0.01, idempotent=True), pedidos(3))
+
+    assert insert.chamadas == [3, 1, 1, 1]
+    assert len(insert.gravados) == 3
+    assert [row["order_id"] for row in rows] == ["o-0", "o-1", "o-2"]
+
+
+@pytest.mark.parametrize("idempotent", [False, True])
+def test_contagem_diferente_falha_o_lote_sem_reenviar(idempotent):
+    insert = FakeInsert(linhas_a_menos=1)
+    resultados = submit_all(
+        PaymentBatcher(insert, max_size=10, max_wait=0.01, idempotent=idempotent), pedidos(3)
+    )
+
+    assert insert.chamadas == [3]
+    assert all(isinstance(r, RuntimeError) for r in resultados)
+
+
+def test_lote_cheio_sai_sem_esperar_a_janela():
+    insert = FakeInsert()
+    submit_all(PaymentBatcher(insert, max_size=2, max_wait=60), pedidos(4))
+
+    assert insert.chamadas == [2, 2]
+
+
+def test_sem_janela_ocioso_grava_na_hora_e_agrupa_o_que_chega_durante_a_gravacao():
+    insert = FakeInsert()
+    batcher = PaymentBatcher(insert, max_size=10)
+
+    async def run():
+        primeiro = asyncio.ensure_future(batcher.submit(pedidos(1)[0]))
+        await asyncio.sleep(0)
+        # Chegam enquanto o primeiro está sendo gravado
+        resto = [asyncio.ensure_future(batcher.submit(r)) for r in pedidos(4)[1:]]
+        return await asyncio.gather(primeiro, *resto)
+
+    rows = asyncio.run(run())
+    assert insert.chamadas == [1, 3]
+    assert [row["correlation_id"] for row in rows] == ["c0", "c1", "c2", "c3"]
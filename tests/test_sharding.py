@@ -0,0 +1,26 @@
+import pytest
+import sharding
+
+
+def test_shard_index_explicito():
+    assert sharding.assigned(4, shard_index="0, 2", replica_index="", replica_count="") == {0, 2}
+
+
+def test_particoes_derivadas_da_replica():
+    atribuidas = [sharding.assigned(8, shard_index="", replica_index=str(r), replica_count="3") for r in range(3)]
+
+    assert atribuidas == [{0, 3, 6}, {1, 4, 7}, {2, 5}]
+
+
+def test_sem_atribuicao_nao_consome_todas():
+    with pytest.raises(ValueError):
+        sharding.assigned(4, shard_index="", replica_index="", replica_count="")
+
+
+@pytest.mark.parametrize("shard_index, replica_index, replica_count", [
+    ("4", "", ""),
+    ("", "2", "2"),
+])
+def test_atribuicao_invalida(shard_index, replica_index, replica_count):
+    with pytest.raises(ValueError):
+        sharding.assigned(4, shard_index=shard_index, replica_index=replica_index, replica_count=replica_count)
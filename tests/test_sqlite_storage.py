@@ -0,0 +1,133 @@
+import asyncio
+import sqlite3
+import pytest
+import storage
+
+
+def connect(path, monkeypatch):
+    monkeypatch.setenv("SQLITE_PATH", str(path))
+    return storage.SqliteStorage.connect()
+
+
+def test_storage_base_e_abstrata():
+    with pytest.raises(TypeError):
+        storage.Storage()
+
+
+def test_datas_com_offsets_diferentes_sao_normalizadas(tmp_path, monkeypatch):
+    path = tmp_path / "estaciona.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(storage.SqliteStorage.SCHEMA)
+    # 02:00 em -03:00 é 05:00 UTC: como texto, ficaria antes de "2099-01-01T04..."
+    conn.execute("insert into creditos (placa, expira_em) values ('AAA1111', '2099-01-01T02:00:00-03:00')")
+    conn.execute("insert into creditos (placa, expira_em) values ('BBB2222', '2000-01-01T00:00:00+00:00')")
+    conn.commit()
+    conn.close()
+
+    async def run():
+        s = await connect(path, monkeypatch)
+        try:
+            ativos = await s.active_credits()
+            estendido = await s.extend_credit("AAA1111", 1, None)
+        finally:
+            await s.close()
+        return ativos, estendido
+
+    ativos, estendido = asyncio.run(run())
+    assert ativos == [{"placa": "AAA1111", "zona": None, "expira_em": "2099-01-01T05:00:00.000000+00:00"}]
+    assert estendido["nova_expiracao"] == "2099-01-01T06:00:00.000000+00:00"
+
+
+def test_extend_credit_recusa_horas_invalidas(tmp_path, monkeypatch):
+    async def run():
+        s = await connect(tmp_path / "estaciona.db", monkeypatch)
+        try:
+            with pytest.raises(ValueError):
+                await s.extend_credit("AAA1111", 0, None)
+        finally:
+            await s.close()
+
+    asyncio.run(run())
+
+
+def test_pagamento_repetido_nao_gera_evento_na_outbox(tmp_path, monkeypatch):
+    def item(chave):
+        return {
+            "pagamento": {"placa": "BRA2E19", "duracao_horas": 1, "valor": 5.0, "correlation_id": chave},
+            "routing_key": "credito.confirmacao.sucesso.BRA2E19",
+            "evento": {"placa": "BRA2E19"},
+        }
+
+    async def run():
+        s = await connect(tmp_path / "estaciona.db", monkeypatch)
+        try:
+            primeiro = await s.record_payments([item("c1")])
+            repetido = await s.record_payments([item("c1"), item("c2")])
+            pendentes = await s.claim_outbox(10, 0, 30)
+        finally:
+            await s.close()
+        return primeiro, repetido, pendentes
+
+    primeiro, repetido, pendentes = asyncio.run(run())
+    assert repetido[0] == {**primeiro[0], "outbox_id": None}
+    assert repetido[1]["outbox_id"] is not None
+    assert sorted(row["correlation_id"] for row in pendentes) == ["c1", "c2"]
+
+
+def test_chave_repetida_no_mesmo_lote_gera_um_evento_so(tmp_path, monkeypatch):
+    item = {
+        "pagamento": {"placa": "BRA2E19", "duracao_horas": 1, "valor": 5.0, "correlation_id": "c1"},
+        "routing_key": "credito.confirmacao.sucesso.BRA2E19",
+        "evento": {"placa": "BRA2E19"},
+    }
+
+    async def run():
+        s = await connect(tmp_path / "estaciona.db", monkeypatch)
+        try:
+            gravados = await s.record_payments([item, item])
+            pendentes = await s.claim_outbox(10, 0, 30)
+        finally:
+            await s.close()
+        return gravados, pendentes
+
+    gravados, pendentes = asyncio.run(run())
+    assert gravados[0]["order_id"] == gravados[1]["order_id"]
+    assert gravados[0]["outbox_id"] is not None and gravados[1]["outbox_id"] is None
+    assert [row["id"] for row in pendentes] == [gravados[0]["outbox_id"]]
+
+
+def test_credito_repetido_depois_de_arquivado_devolve_a_expiracao_arquivada(tmp_path, monkeypatch):
+    path = tmp_path / "estaciona.db"
+    pagamento = {
+        "pagamento": {"placa": "BRA2E19", "duracao_horas": 1, "valor": 5.0, "correlation_id": "c1"},
+        "routing_key": "credito.confirmacao.sucesso.BRA2E19",
+        "evento": {"placa": "BRA2E19"},
+    }
+
+    async def creditar():
+        s = await connect(path, monkeypatch)
+        try:
+            [gravado] = await s.record_payments([pagamento])
+            await s.extend_credit("BRA2E19", 1, gravado["order_id"])
+        finally:
+            await s.close()
+        return gravado["order_id"]
+
+    async def repetir(order_id):
+        s = await connect(path, monkeypatch)
+        try:
+            arquivados = await s.archive_expired(10)
+            repetido = await s.extend_credit("BRA2E19", 1, order_id)
+        finally:
+            await s.close()
+        return arquivados, repetido
+
+    order_id = asyncio.run(creditar())
+    conn = sqlite3.connect(path)
+    conn.execute("update creditos set expira_em = '2000-01-01T00:00:00.000000+00:00'")
+    conn.commit()
+    conn.close()
+
+    arquivados, repetido = asyncio.run(repetir(order_id))
+    assert arquivados == 1
+    assert repetido == {"nova_expiracao": "2000-01-01T00:00:00.000000+00:00", "estendido": True, "duplicado": True}
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+from tariff_table import TariffTable
+
+# Segunda-feira, 10h (UTC)
+SEGUNDA_10H = datetime(2026, 10, 19, 10, tzinfo=timezone.utc)
+
+TARIFAS = [
+    {"zona": None, "dia_semana": None, "hora_inicio": 8, "hora_fim": 18, "valor_por_hora": 4.0},
+    {"zona": "A", "dia_semana": None, "hora_inicio": 8, "hora_fim": 18, "valor_por_hora": 6.0},
+    {"zona": "A", "dia_semana": 0, "hora_inicio": 10, "hora_fim": 12, "valor_por_hora": 8.0},
+    {"zona": "B", "dia_semana": None, "hora_inicio": 22, "hora_fim": 2, "valor_por_hora": 1.0},
+]
+
+
+def tabela():
+    table = TariffTable(default_price=5.0, tz="UTC")
+    table.load(TARIFAS)
+    return table
+
+
+def test_sem_linhas_usa_tarifa_padrao():
+    assert TariffTable(default_price=5.0, tz="UTC").price("A", 3, SEGUNDA_10H) == 15.0
+
+
+def test_regra_mais_especifica_prevalece():
+    # 10h e 11h na faixa da segunda da zona A; 12h na faixa geral da zona
+    assert tabela().price("A", 3, SEGUNDA_10H) == 8.0 + 8.0 + 6.0
+
+
+def test_zona_sem_tarifa_usa_linhas_gerais():
+    assert tabela().price("C", 2, SEGUNDA_10H) == 8.0
+    assert tabela().price("C", 1, SEGUNDA_10H.replace(hour=20)) == 5.0
+
+
+def test_faixa_que_passa_da_meia_noite():
+    # 23h, 0h e 1h na faixa noturna; 2h já fora dela (padrão)
+    assert tabela().price("B", 4, SEGUNDA_10H.replace(hour=23)) == 1.0 + 1.0 + 1.0 + 5.0
+
+
+def test_compra_que_vira_a_semana():
+    domingo_23h = datetime(2026, 10, 18, 23, tzinfo=timezone.utc)
+
+    assert tabela().price("B", 2, domingo_23h) == 2.0
+
+
+def test_recarga_substitui_tabela():
+    table = tabela()
+
+    table.load([])
+
+    assert table.price("A", 1, SEGUNDA_10H) == 5.0
@@ -0,0 +1,32 @@
+import json
+import tracing
+
+
+def test_sem_trace_pedido_nao_publica_header():
+    span = tracing.begin("on_payment_request")
+    try:
+        assert tracing.publish_headers() is None
+        tracing.activate()
+        spans = json.loads(tracing.publish_headers()[tracing.TRACE_HEADER])
+        assert [s["handler"] for s in spans] == ["on_payment_request"]
+    finally:
+        tracing.finish(span)
+
+
+def test_header_recebido_segue_adiante():
+    anterior = [{"servico": "pagamento", "handler": "on_payment_request"}]
+    span = tracing.begin("on_purchase", {tracing.TRACE_HEADER: json.dumps(anterior)})
+    try:
+        spans = json.loads(tracing.publish_headers()[tracing.TRACE_HEADER])
+        assert [s["handler"] for s in spans] == ["on_payment_request", "on_purchase"]
+    finally:
+        tracing.finish(span)
+
+
+def test_finish_encerra_o_span_atual():
+    tracing.activate()
+    span = tracing.begin("on_purchase", {tracing.TRACE_HEADER: "[]"})
+    tracing.finish(span)
+
+    assert tracing.current() is None
+    assert tracing.publish_headers() is None